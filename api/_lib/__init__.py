@@ -0,0 +1,6 @@
+"""Shared helpers for the webhook handlers and self-hosted tooling.
+
+Vercel does not turn files under an underscore-prefixed path into
+serverless functions, so everything in here is importable from the
+handlers (``from api._lib.server import ...``) without becoming a route.
+"""
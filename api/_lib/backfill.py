@@ -0,0 +1,278 @@
+"""
+Replay captured call_analyzed webhooks through a client's pipeline.
+
+When a client's Apps Script URL was misconfigured, the calls it missed can be
+re-sent from captured webhook bodies. Input is a JSONL file (one webhook body
+per line), a ``.json`` file holding one body, a capture segment (``.seg``,
+see ``api._lib.capture``), or a directory of those files. Bodies are
+streamed, so the corpus never has to fit in memory.
+
+- A bounded thread pool runs extraction, tech lookup and the sheet write.
+- Sheet writes are paced per sink URL with a token bucket.
+- Tech lookups are cached per emergency type for ``--tech-cache-seconds``;
+  every call in a run would otherwise get the same on-call answer anyway.
+- Successful call_ids are appended to ``--checkpoint`` and skipped on the
+  next run, so an interrupted backfill resumes where it stopped.
+- ``--dry-run`` extracts and looks up techs but writes nothing.
+
+Usage:
+    python -m api._lib.backfill captured.jsonl --client braconier --workers 8 \
+        --sink-rate 5 --checkpoint /tmp/braconier.ckpt
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from api._lib.capture import SEGMENT_SUFFIX, iter_segment
+from api._lib.codec import JSONDecodeError, loads
+from api._lib.metrics import inc
+from api._lib.pipelines import PIPELINES, get_pipeline
+from api._lib.ratelimit import TokenBucket
+
+
+def iter_files(paths):
+    """Expand directories into their sorted .json/.jsonl/.seg files."""
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(('.json', '.jsonl', SEGMENT_SUFFIX)):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+def iter_bodies(paths):
+    """Yield (source, webhook_body) pairs from JSONL/JSON/capture files without loading whole files."""
+    for path in iter_files(paths):
+        if path.endswith(SEGMENT_SUFFIX):
+            for offset, _, raw in iter_segment(path):
+                try:
+                    yield f'{path}@{offset}', loads(raw)
+                except JSONDecodeError as e:
+                    print(f"[BACKFILL] Skipping invalid JSON at {path}@{offset}: {e}")
+        elif path.endswith('.jsonl'):
+            with open(path, 'rb') as f:
+                for line_no, line in enumerate(f, 1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        yield f'{path}:{line_no}', loads(line)
+                    except JSONDecodeError as e:
+                        print(f"[BACKFILL] Skipping invalid JSON at {path}:{line_no}: {e}")
+        else:
+            try:
+                with open(path, 'rb') as f:
+                    data = loads(f.read())
+            except (OSError, JSONDecodeError) as e:
+                print(f"[BACKFILL] Skipping {path}: {e}")
+                continue
+            for index, body in enumerate(data if isinstance(data, list) else [data]):
+                yield f'{path}#{index}', body
+
+
+def call_from_body(body):
+    """Return the call object of a call_analyzed body (or a bare call object), else None."""
+    if not isinstance(body, dict):
+        return None
+    if 'event' in body or 'call' in body:
+        if body.get('event') != 'call_analyzed':
+            return None
+        call_data = body.get('call')
+    else:
+        call_data = body
+    if isinstance(call_data, dict) and call_data.get('call_id'):
+        return call_data
+    return None
+
+
+class Checkpoint:
+    """Append-only file of call_ids that were written successfully."""
+
+    def __init__(self, path, read_only=False):
+        self.path = path
+        self.done = set()
+        self.lock = threading.Lock()
+        self.file = None
+        if path:
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    self.done.update(line.strip() for line in f if line.strip())
+            if not read_only:
+                self.file = open(path, 'a')
+
+    def __contains__(self, call_id):
+        return call_id in self.done
+
+    def mark(self, call_id):
+        with self.lock:
+            self.done.add(call_id)
+            if self.file:
+                self.file.write(call_id + '\n')
+                self.file.flush()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+
+class TechCache:
+    """Short-lived cache of tech lookups keyed by Pipeline.lookup_key."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, pipeline, extracted):
+        key = pipeline.lookup_key(extracted)
+        if key is None or self.ttl <= 0:
+            return pipeline.lookup_tech(extracted)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and time.monotonic() - entry[0] < self.ttl:
+                inc('webhook_cache_requests_total', cache='backfill_tech', result='hit')
+                return entry[1].copy()
+        inc('webhook_cache_requests_total', cache='backfill_tech', result='miss')
+        tech = pipeline.lookup_tech(extracted)
+        # Stale on-call snapshots are not cached so the next call retries the live API
+        if (tech.get('email') or tech.get('phone')) and not tech.get('stale'):
+            with self.lock:
+                self.entries[key] = (time.monotonic(), tech)
+        return tech.copy()
+
+
+class Backfill:
+    """Streams bodies through a pipeline with bounded concurrency."""
+
+    def __init__(self, pipeline, workers=8, sink_rate=2.0, sink_burst=None, checkpoint=None,
+                 dry_run=False, tech_cache_seconds=60.0):
+        self.pipeline = pipeline
+        self.workers = workers
+        self.dry_run = dry_run
+        self.checkpoint = checkpoint or Checkpoint(None)
+        self.tech_cache = TechCache(tech_cache_seconds)
+        self.sink_rate = sink_rate
+        self.sink_burst = sink_burst
+        self.sink_buckets = {}
+        self.lock = threading.Lock()
+        self.counts = {'seen': 0, 'queued': 0, 'ok': 0, 'failed': 0, 'skipped': 0}
+
+    def bucket_for(self, sink_url):
+        """One token bucket per destination URL."""
+        with self.lock:
+            bucket = self.sink_buckets.get(sink_url)
+            if bucket is None:
+                bucket = self.sink_buckets[sink_url] = TokenBucket(self.sink_rate, self.sink_burst)
+            return bucket
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def process(self, source, call_data):
+        """Run one call through the pipeline and count the outcome."""
+        ok = self.process_call(source, call_data)
+        self.count('ok' if ok else 'failed')
+        return ok
+
+    def process_call(self, source, call_data):
+        """Run one call through the pipeline. Returns True on success."""
+        call_id = call_data.get('call_id', '')
+        try:
+            extracted = self.pipeline.extract(call_data)
+            tech_data = self.tech_cache.get(self.pipeline, extracted)
+            if self.dry_run:
+                print(f"[BACKFILL] DRY RUN {call_id} ({source}): vars={extracted} tech={tech_data}")
+                return True
+            sink_url = os.environ.get(self.pipeline.sink_env, '')
+            self.bucket_for(sink_url).acquire()
+            if not self.pipeline.send(call_data, extracted, tech_data):
+                print(f"[BACKFILL] Sheet write failed for {call_id} ({source})")
+                return False
+            self.checkpoint.mark(call_id)
+            return True
+        except Exception as e:
+            print(f"[BACKFILL] Error processing {call_id} ({source}): {e}")
+            return False
+
+    def run(self, paths, progress_every=5.0):
+        """Process every call_analyzed body found in ``paths``. Returns the final counts."""
+        started = time.monotonic()
+        last_progress = started
+        seen_ids = set()
+        pending = set()
+        max_pending = self.workers * 2
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='backfill') as pool:
+            for source, body in iter_bodies(paths):
+                self.count('seen')
+                call_data = call_from_body(body)
+                call_id = call_data.get('call_id') if call_data else None
+                if not call_id or call_id in seen_ids or call_id in self.checkpoint:
+                    self.count('skipped')
+                    continue
+                seen_ids.add(call_id)
+
+                # Bound the number of queued calls so large corpora stream through
+                while len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+                # Queued calls hold only the fields the pipeline reads
+                pending.add(pool.submit(self.process, source, self.pipeline.project(call_data)))
+                self.count('queued')
+
+                now = time.monotonic()
+                if now - last_progress >= progress_every:
+                    last_progress = now
+                    self.report(now - started)
+            wait(pending)
+        self.report(time.monotonic() - started)
+        return dict(self.counts)
+
+    def report(self, elapsed):
+        counts = self.counts
+        finished = counts['ok'] + counts['failed']
+        rate = finished / elapsed if elapsed > 0 else 0.0
+        print(f"[BACKFILL] {finished}/{counts['queued']} done ({counts['ok']} ok, {counts['failed']} failed, "
+              f"{counts['skipped']} skipped) in {elapsed:.1f}s, {rate:.1f} calls/s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay captured call_analyzed webhooks into a client sheet.')
+    parser.add_argument('paths', nargs='+', help='JSONL/JSON files, capture segments or directories of captured webhook bodies')
+    parser.add_argument('--client', required=True, choices=sorted(PIPELINES))
+    parser.add_argument('--workers', type=int, default=8, help='Concurrent calls in flight')
+    parser.add_argument('--sink-rate', type=float, default=2.0,
+                        help='Sheet writes per second per sink URL (0 disables the limit)')
+    parser.add_argument('--sink-burst', type=float, default=None, help='Token bucket burst size')
+    parser.add_argument('--checkpoint', help='File recording finished call_ids; existing entries are skipped')
+    parser.add_argument('--tech-cache-seconds', type=float, default=60.0,
+                        help='Reuse a tech lookup for this long (0 looks up every call)')
+    parser.add_argument('--dry-run', action='store_true', help='Extract and look up techs but write nothing')
+    args = parser.parse_args(argv)
+
+    pipeline = get_pipeline(args.client)
+    if not args.dry_run and not os.environ.get(pipeline.sink_env):
+        parser.error(f'{pipeline.sink_env} must be set unless --dry-run is used')
+
+    checkpoint = Checkpoint(args.checkpoint, read_only=args.dry_run)
+    try:
+        counts = Backfill(
+            pipeline,
+            workers=args.workers,
+            sink_rate=args.sink_rate,
+            sink_burst=args.sink_burst,
+            checkpoint=checkpoint,
+            dry_run=args.dry_run,
+            tech_cache_seconds=args.tech_cache_seconds,
+        ).run(args.paths)
+    finally:
+        checkpoint.close()
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""
+Bounded request-body reading for the webhook handlers.
+
+The handlers used to ``self.rfile.read(content_length)`` with whatever
+Content-Length the caller sent. Now:
+
+- ``check_body_size`` rejects an unparseable or negative Content-Length with
+  400 and anything over ``MAX_BODY_BYTES`` (env, default 8 MiB) with 413,
+  before a byte of the body is read;
+- ``read_body`` reads in ``CHUNK_SIZE`` pieces straight into one
+  preallocated ``bytearray`` through a ``memoryview``, so there is a single
+  copy of the body. ``json.loads`` decodes it directly, and the handler
+  drops it once it has been forwarded to the API gateway.
+"""
+import os
+
+DEFAULT_MAX_BODY_BYTES = 8 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+def max_body_bytes():
+    try:
+        return int(os.environ.get('MAX_BODY_BYTES', DEFAULT_MAX_BODY_BYTES))
+    except ValueError:
+        return DEFAULT_MAX_BODY_BYTES
+
+
+def content_length(headers):
+    """Declared body size, 0 when absent, -1 when not a non-negative integer."""
+    value = headers.get('Content-Length')
+    if value is None or not str(value).strip():
+        return 0
+    try:
+        length = int(value)
+    except ValueError:
+        return -1
+    return length if length >= 0 else -1
+
+
+def check_body_size(headers, limit=None):
+    """Gate a request on its Content-Length. Returns None to proceed, else (status, response_data)."""
+    length = content_length(headers)
+    if length < 0:
+        return 400, {"error": "Invalid Content-Length"}
+    limit = max_body_bytes() if limit is None else limit
+    if length > limit:
+        print(f"[BODY] Rejecting {length}-byte body (limit {limit})")
+        return 413, {"error": "Request body too large", "max_bytes": limit}
+    return None
+
+
+def read_body(rfile, headers, chunk_size=CHUNK_SIZE):
+    """Read the declared body into a ``bytearray``; shorter if the stream ends early."""
+    length = content_length(headers)
+    if length <= 0:
+        return bytearray()
+    buf = bytearray(length)
+    view = memoryview(buf)
+    pos = 0
+    try:
+        while pos < length:
+            with view[pos:pos + chunk_size] as chunk:
+                read = rfile.readinto(chunk)
+            if not read:
+                break
+            pos += read
+    finally:
+        view.release()
+    if pos < length:
+        del buf[pos:]
+    return buf
@@ -0,0 +1,289 @@
+"""
+Opt-in capture of raw inbound webhooks into a compressed ring buffer.
+
+Debugging an extraction failure meant reading ``DEBUG`` prints of whole
+payloads. With ``CAPTURE_DIR`` set, every accepted webhook is appended, as it
+arrived, to a segment file in that directory instead:
+
+- each record is the request's path, sniffed event/call_id, headers
+  (credentials dropped) and raw body, zlib-compressed on its own
+  (``CAPTURE_LEVEL``, default 1: cheap, still ~5-10x on transcripts),
+- records are appended with one ``write`` each to ``<time_ns>-<pid>.seg``, and a
+  fixed-width entry (offset, length, time, call_id) goes to the matching
+  ``.idx``, so a reader finds a call without decompressing the segment,
+- a segment is closed at ``CAPTURE_SEGMENT_BYTES`` (default 16 MiB) and the
+  oldest segments are deleted beyond ``CAPTURE_MAX_SEGMENTS`` (default 8).
+  Several processes share the directory, so a segment another writer may still
+  have open (the newest one of a live pid, or any written to in the last
+  ``CAPTURE_ACTIVE_SECONDS``, default 300) is never deleted; the ring can run
+  over its limit by one segment per live writer.
+
+Capture never fails a request: errors are logged and counted.
+
+Captured segments can be fed to ``api._lib.backfill`` as they are, or read here:
+
+    python -m api._lib.capture list [--call-id ID]      # what is in CAPTURE_DIR
+    python -m api._lib.capture dump > bodies.jsonl      # raw bodies, one per line
+"""
+import argparse
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+
+from api._lib.codec import dumps, loads
+from api._lib.metrics import inc
+from api._lib.sniff import sniff_call_id, sniff_event
+
+CAPTURE_DIR = os.environ.get('CAPTURE_DIR', '')
+SEGMENT_BYTES = int(os.environ.get('CAPTURE_SEGMENT_BYTES', str(16 * 1024 * 1024)))
+MAX_SEGMENTS = int(os.environ.get('CAPTURE_MAX_SEGMENTS', '8'))
+LEVEL = int(os.environ.get('CAPTURE_LEVEL', '1'))
+ACTIVE_SECONDS = float(os.environ.get('CAPTURE_ACTIVE_SECONDS', '300'))
+
+SEGMENT_SUFFIX = '.seg'
+INDEX_SUFFIX = '.idx'
+MAGIC = b'WCAP'
+# magic, compressed length, crc32 of the compressed bytes
+RECORD_HEADER = struct.Struct('>4sII')
+# offset of the record header, compressed length, capture time, call_id (NUL-padded)
+INDEX_ENTRY = struct.Struct('>QId64s')
+
+# Never written to disk. Replay does not check signatures, and a captured
+# x-retell-signature would let anyone who can read a segment re-post that body.
+REDACTED_HEADERS = {'authorization', 'cookie', 'x-debug-response', 'x-api-key', 'x-retell-signature'}
+
+
+def encode_record(path, headers, body, captured_at=None):
+    """Compressed record bytes (header included) and its metadata."""
+    meta = {
+        'ts': time.time() if captured_at is None else captured_at,
+        'path': path,
+        'event': sniff_event(body) if body else None,
+        'call_id': sniff_call_id(body) if body else None,
+        'headers': {k: v for k, v in headers.items() if k.lower() not in REDACTED_HEADERS} if headers else {},
+    }
+    payload = zlib.compress(dumps(meta) + b'\n' + bytes(body), LEVEL)
+    return RECORD_HEADER.pack(MAGIC, len(payload), zlib.crc32(payload)) + payload, meta
+
+
+def decode_record(data):
+    """``(meta, body)`` from a record's compressed payload."""
+    raw = zlib.decompress(data)
+    head, _, body = raw.partition(b'\n')
+    return loads(head), body
+
+
+class CaptureWriter:
+    """Appends records to this process's current segment, rotating and pruning the ring."""
+
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, max_segments=MAX_SEGMENTS,
+                 active_seconds=ACTIVE_SECONDS):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self.active_seconds = active_seconds
+        self.lock = threading.Lock()
+        self.segment_fd = None
+        self.index_fd = None
+        self.size = 0
+
+    def _open_segment(self):
+        os.makedirs(self.directory, exist_ok=True)
+        # Time first so names sort oldest-first across processes
+        base = os.path.join(self.directory, f'{time.time_ns():020d}-{os.getpid()}')
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+        self.segment_fd = os.open(base + SEGMENT_SUFFIX, flags, 0o600)
+        self.index_fd = os.open(base + INDEX_SUFFIX, flags, 0o600)
+        self.size = 0
+        self.prune()
+
+    def _close_segment(self):
+        for fd in (self.segment_fd, self.index_fd):
+            if fd is not None:
+                os.close(fd)
+        self.segment_fd = self.index_fd = None
+
+    def prune(self):
+        """Delete the oldest segments (and their indexes) beyond ``max_segments``.
+
+        Segments that some process may still be appending to are skipped; see
+        ``active_segments``.
+        """
+        segments = list_segments(self.directory)
+        excess = len(segments) - self.max_segments
+        if excess <= 0:
+            return
+        active = active_segments(segments, self.active_seconds)
+        for path in [p for p in segments if p not in active][:excess]:
+            for name in (path, path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX):
+                try:
+                    os.unlink(name)
+                except FileNotFoundError:
+                    pass
+
+    def append(self, path, headers, body):
+        record, meta = encode_record(path, headers, body)
+        call_id = (meta['call_id'] or '').encode()[:64]
+        with self.lock:
+            if self.segment_fd is None or self.size + len(record) > self.segment_bytes:
+                self._close_segment()
+                self._open_segment()
+            offset = self.size
+            os.write(self.segment_fd, record)
+            os.write(self.index_fd, INDEX_ENTRY.pack(offset, len(record), meta['ts'], call_id))
+            self.size += len(record)
+        return len(record)
+
+    def close(self):
+        with self.lock:
+            self._close_segment()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def capture_request(path, headers, body):
+    """Append one inbound request when ``CAPTURE_DIR`` is set; never raises."""
+    global _writer
+    if not CAPTURE_DIR:
+        return
+    try:
+        if _writer is None:
+            with _writer_lock:
+                if _writer is None:
+                    _writer = CaptureWriter(CAPTURE_DIR)
+        size = _writer.append(path, headers, body)
+        inc('webhook_captured_total', result='ok')
+        inc('webhook_captured_bytes_total', size)
+    except Exception as e:
+        inc('webhook_captured_total', result='error')
+        print(f"[CAPTURE] Could not capture request: {e}")
+
+
+def list_segments(directory):
+    try:
+        names = sorted(n for n in os.listdir(directory) if n.endswith(SEGMENT_SUFFIX))
+    except FileNotFoundError:
+        return []
+    return [os.path.join(directory, n) for n in names]
+
+
+def segment_pid(segment_path):
+    """The writer pid in a ``<time_ns>-<pid>.seg`` name, or None."""
+    stem = os.path.basename(segment_path)[:-len(SEGMENT_SUFFIX)]
+    try:
+        return int(stem.rpartition('-')[2])
+    except ValueError:
+        return None
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+def active_segments(segments, active_seconds=ACTIVE_SECONDS):
+    """Segments a writer may still have open.
+
+    Each writer only appends to its newest segment, so that one is active while
+    its pid is alive. The directory may be shared with other hosts, whose pids
+    mean nothing here, so anything modified within ``active_seconds`` is active
+    too.
+    """
+    newest = {}
+    for path in segments:  # sorted oldest first
+        newest[segment_pid(path)] = path
+    active = {path for pid, path in newest.items() if pid is not None and pid_alive(pid)}
+    cutoff = time.time() - active_seconds
+    for path in segments:
+        try:
+            if os.stat(path).st_mtime >= cutoff:
+                active.add(path)
+        except FileNotFoundError:
+            pass
+    return active
+
+
+def read_index(segment_path):
+    """``[(offset, length, ts, call_id), ...]`` for a segment; a torn last entry is ignored."""
+    try:
+        with open(segment_path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return []
+    entries = []
+    for start in range(0, len(data) - INDEX_ENTRY.size + 1, INDEX_ENTRY.size):
+        offset, length, ts, call_id = INDEX_ENTRY.unpack_from(data, start)
+        entries.append((offset, length, ts, call_id.rstrip(b'\0').decode('utf-8', 'replace')))
+    return entries
+
+
+def read_record(f, offset, length):
+    """``(meta, body)`` of the record at ``offset`` in an open segment, or None if it is damaged."""
+    f.seek(offset)
+    data = f.read(length)
+    if len(data) < RECORD_HEADER.size:
+        return None
+    magic, size, crc = RECORD_HEADER.unpack_from(data)
+    payload = data[RECORD_HEADER.size:RECORD_HEADER.size + size]
+    if magic != MAGIC or len(payload) != size or zlib.crc32(payload) != crc:
+        return None
+    return decode_record(payload)
+
+
+def iter_segment(segment_path, call_id=None):
+    """Yield ``(offset, meta, body)`` for a segment's records, via its index, oldest first."""
+    entries = read_index(segment_path)
+    if call_id:
+        entries = [e for e in entries if e[3] == call_id]
+    with open(segment_path, 'rb') as f:
+        for offset, length, _, _ in entries:
+            record = read_record(f, offset, length)
+            if record is None:
+                print(f"[CAPTURE] Skipping damaged record at {segment_path}@{offset}")
+                continue
+            yield offset, record[0], record[1]
+
+
+def iter_captures(paths, call_id=None):
+    """Yield ``(source, meta, body)`` from segment files and directories of them."""
+    for path in paths:
+        segments = list_segments(path) if os.path.isdir(path) else [path]
+        for segment in segments:
+            for offset, meta, body in iter_segment(segment, call_id):
+                yield f'{segment}@{offset}', meta, body
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Inspect captured webhooks.')
+    parser.add_argument('command', choices=['list', 'dump'])
+    parser.add_argument('paths', nargs='*', help='Segment files or directories (default CAPTURE_DIR)')
+    parser.add_argument('--call-id', help='Only this call')
+    args = parser.parse_args(argv)
+
+    paths = args.paths or ([CAPTURE_DIR] if CAPTURE_DIR else [])
+    if not paths:
+        parser.error('pass a capture directory or set CAPTURE_DIR')
+    for source, meta, body in iter_captures(paths, args.call_id):
+        if args.command == 'dump':
+            sys.stdout.write(body.decode('utf-8', 'replace').strip() + '\n')
+        else:
+            captured = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(meta['ts']))
+            print(f"{captured}  {meta.get('event') or '-':<14} {meta.get('call_id') or '-':<36} "
+                  f"{len(body):>8}B  {meta.get('path')}  {source}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
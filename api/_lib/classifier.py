@@ -0,0 +1,150 @@
+"""
+Single-pass emergency-type classifier for call summaries.
+
+Adaptive Climate used to infer ``emergencyType`` with ``token in issue_text``
+per keyword: a substring scan per keyword, where ``'ac'`` matched inside
+"back", "place" or "contact". Braconier and Pacific Western route their
+tech lookups purely on ``emergencyType``, so a blank or wrong type sends the
+call to the wrong on-call list.
+
+The text is tokenized once (lowercase words, trailing plural ``s`` dropped,
+``a/c`` folded to ``ac``), and every keyword and phrase of every type is
+matched in one pass by an Aho-Corasick automaton over tokens, compiled once
+per client's set of types. Each match adds its weight to its type. The
+result is the best type and a confidence in [0, 1]: its share of the total
+score, scaled down while the score is weaker than ``STRONG_SCORE``.
+"""
+import re
+from collections import deque
+
+# type -> (phrase, weight). Phrases are matched on whole tokens.
+KEYWORDS = {
+    'HVAC': [
+        ('hvac', 3), ('ac', 2), ('air conditioner', 3), ('air conditioning', 3), ('furnace', 3),
+        ('heat pump', 3), ('no heat', 3), ('heating', 2), ('cooling', 2), ('thermostat', 2),
+        ('boiler', 2), ('mini split', 3), ('ductwork', 2), ('duct', 1), ('refrigerant', 2),
+        ('compressor', 2), ('condenser', 2), ('blowing warm air', 3), ('not cooling', 3),
+    ],
+    'Plumbing': [
+        ('plumbing', 3), ('plumber', 3), ('leak', 2), ('leaking', 2), ('pipe', 2), ('burst pipe', 3),
+        ('drain', 2), ('clogged', 2), ('clog', 2), ('toilet', 2), ('sewer', 3), ('water heater', 3),
+        ('hot water tank', 3), ('no hot water', 3), ('faucet', 2), ('sump pump', 3), ('flooding', 1),
+        ('backed up', 2), ('sink', 1), ('shower', 1),
+    ],
+    'Fire Alarm': [
+        ('fire alarm', 3), ('alarm', 1), ('smoke detector', 3), ('smoke alarm', 3), ('fire panel', 3),
+        ('alarm panel', 3), ('panel', 1), ('trouble signal', 3), ('trouble light', 3), ('beeping', 1),
+        ('strobe', 2), ('pull station', 3), ('monitoring', 1), ('false alarm', 3), ('heat detector', 3),
+    ],
+    'Sprinkler': [
+        ('sprinkler', 3), ('sprinkler head', 3), ('fire sprinkler', 3), ('riser', 2), ('dry pipe', 3),
+        ('wet pipe', 3), ('backflow', 2), ('fire pump', 3), ('standpipe', 3), ('fire line', 2),
+        ('water flow', 2), ('flow switch', 3), ('tamper', 2), ('leak', 1), ('pipe', 1),
+    ],
+}
+
+# Types each client's tech routing understands
+CLIENT_TYPES = {
+    'adaptive': ('HVAC',),
+    'braconier': ('HVAC', 'Plumbing'),
+    'pacific': ('Fire Alarm', 'Sprinkler'),
+}
+
+STRONG_SCORE = 4.0
+MIN_CONFIDENCE = 0.3
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text):
+    """Lowercase word tokens with a trailing plural ``s`` removed."""
+    text = str(text or '').lower().replace('a/c', 'ac')
+    return [t[:-1] if len(t) > 3 and t.endswith('s') and not t.endswith('ss') else t
+            for t in _TOKEN_RE.findall(text)]
+
+
+class Classifier:
+    """Aho-Corasick automaton over tokens for one set of emergency types."""
+
+    def __init__(self, types):
+        self.types = tuple(types)
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        for label in self.types:
+            for phrase, weight in KEYWORDS[label]:
+                self._add(tokenize(phrase), label, weight)
+        self._link()
+
+    def _add(self, tokens, label, weight):
+        state = 0
+        for token in tokens:
+            nxt = self.goto[state].get(token)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[state][token] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append([])
+            state = nxt
+        self.out[state].append((label, weight))
+
+    def _link(self):
+        """Breadth-first failure links; each state's output includes its suffixes' outputs."""
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, nxt in self.goto[state].items():
+                queue.append(nxt)
+                if state:
+                    fallback = self.fail[state]
+                    while fallback and token not in self.goto[fallback]:
+                        fallback = self.fail[fallback]
+                    self.fail[nxt] = self.goto[fallback].get(token, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def scores(self, *texts):
+        """Summed keyword weights per type across ``texts``."""
+        totals = {}
+        for text in texts:
+            state = 0
+            for token in tokenize(text):
+                while state and token not in self.goto[state]:
+                    state = self.fail[state]
+                state = self.goto[state].get(token, 0)
+                for label, weight in self.out[state]:
+                    totals[label] = totals.get(label, 0) + weight
+        return totals
+
+    def classify(self, *texts):
+        """Return ``(type, confidence)``; ``('', 0.0)`` when nothing matched."""
+        totals = self.scores(*texts)
+        if not totals:
+            return '', 0.0
+        # Ties go to the type listed first for the client
+        label = max(self.types, key=lambda t: totals.get(t, 0))
+        top = totals[label]
+        confidence = top / sum(totals.values()) * min(1.0, top / STRONG_SCORE)
+        return label, round(confidence, 2)
+
+
+_classifiers = {}
+
+
+def classifier_for(client):
+    """The compiled classifier for ``client``'s emergency types."""
+    classifier = _classifiers.get(client)
+    if classifier is None:
+        classifier = _classifiers[client] = Classifier(CLIENT_TYPES[client])
+    return classifier
+
+
+def classify_emergency(client, *texts):
+    """Best emergency type for ``client`` from ``texts`` and its confidence."""
+    return classifier_for(client).classify(*texts)
+
+
+def infer_emergency_type(client, *texts, min_confidence=MIN_CONFIDENCE):
+    """The inferred type when its confidence reaches ``min_confidence``, else ''."""
+    label, confidence = classify_emergency(client, *texts)
+    return label if confidence >= min_confidence else ''
@@ -0,0 +1,73 @@
+"""
+JSON decode/encode for the request paths, with an optional fast backend.
+
+Parsing the webhook body, tool-call contents and API answers, and
+serializing sheet rows, responses and state files, are most of a request's
+CPU. ``loads`` takes bytes (or str) and ``dumps`` returns bytes, so nothing
+round-trips through ``str``. Both use ``orjson`` when it is installed
+(``pip install orjson``; without it the deployment stays stdlib-only) and
+the stdlib ``json`` otherwise. ``JSON_CODEC=stdlib`` forces the fallback.
+
+With orjson, ``dumps`` output is compact and writes non-ASCII as UTF-8 rather
+than ``\\u`` escapes. Every consumer (Apps Script, Retell, the gateway, our
+state files) parses it as JSON, so nothing downstream changes. Values orjson
+refuses (integers beyond 64 bits, NaN in input) are handed to the stdlib.
+
+Anything hashed or compared byte for byte across instances must not depend on
+the backend. The dedup content hash and claim values keep using
+``json.dumps(..., sort_keys=True)``.
+"""
+import json
+import os
+
+try:
+    import orjson
+except ImportError:  # optional; the stdlib path below is complete
+    orjson = None
+
+BACKEND = 'orjson' if orjson is not None and os.environ.get('JSON_CODEC', '').strip().lower() != 'stdlib' else 'stdlib'
+
+# orjson.JSONDecodeError subclasses this, so callers catch one type either way
+JSONDecodeError = json.JSONDecodeError
+
+
+def encode_default(value):
+    """``default=`` hook: records (anything with ``to_dict``) serialize as objects."""
+    to_dict = getattr(value, 'to_dict', None)
+    if to_dict is None:
+        raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+    return to_dict()
+
+
+def stdlib_dumps(obj):
+    """``obj`` as JSON bytes via the stdlib (ASCII, ``json.dumps`` spacing)."""
+    return json.dumps(obj, default=encode_default).encode()
+
+
+def stdlib_loads(data):
+    """Parse JSON from bytes, bytearray, memoryview or str via the stdlib."""
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+if BACKEND == 'orjson':
+    _OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj):
+        """``obj`` as UTF-8 JSON bytes."""
+        try:
+            return orjson.dumps(obj, default=encode_default, option=_OPTIONS)
+        except TypeError:
+            return stdlib_dumps(obj)
+
+    def loads(data):
+        """Parse JSON from bytes, bytearray, memoryview or str."""
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # Raises the stdlib's error for genuinely bad input
+            return stdlib_loads(data)
+else:
+    dumps = stdlib_dumps
+    loads = stdlib_loads
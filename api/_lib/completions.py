@@ -0,0 +1,108 @@
+"""
+Completion markers: which calls actually reached a client's sheet.
+
+A dedup claim is taken before extraction and the sheet write, so it only says
+a call was seen, not that its row was written. Reconciliation needs the
+latter. Each client's sheet-write function (the live handler, the
+``/api/webhook`` router and backfill all go through one) calls
+``mark_completed`` after Apps Script accepted the row, with the call_id and
+the row's idempotency key.
+
+Markers are stored like dedup claims, keyed by call_id:
+
+- ``DEDUP_BACKEND=redis``: in the shared store under
+  ``<DEDUP_KEY_PREFIX>done-<client>:<call_id>`` for the dedup TTL, so a
+  reconcile run on any node sees completions from every instance,
+- otherwise, or when the store is unreachable, in
+  ``COMPLETIONS_DIR/completed_calls_<client>.json`` (default ``/tmp``).
+
+A failed marker write is logged and never fails the request: the row is
+already in the sheet, and the worst case is that reconcile re-sends it under
+the same idempotency key.
+"""
+import os
+import threading
+import time
+from datetime import datetime
+
+from api._lib import dedup
+from api._lib.metrics import inc
+
+COMPLETIONS_DIR = os.environ.get('COMPLETIONS_DIR', '/tmp')
+
+_stores = {}
+_lock = threading.Lock()
+
+
+class Completions:
+    """One client's completion markers: the shared store when configured, then its local file."""
+
+    def __init__(self, backend, fallback=None, tag='DONE'):
+        self.backend = backend
+        self.fallback = fallback
+        self.tag = tag
+
+    def mark(self, call_id, idempotency_key=''):
+        """Record that ``call_id``'s row was written. Returns False when no backend took it."""
+        if not call_id:
+            return False
+        now = time.time()
+        record = {
+            'call_id': call_id,
+            'idempotency_key': idempotency_key or '',
+            'completed_at': datetime.fromtimestamp(now).isoformat(),
+            # The file backend expires entries by this (ms), like dedup claims
+            'timestamp': int(now * 1000),
+        }
+        for backend in (self.backend, self.fallback):
+            if backend is None:
+                continue
+            try:
+                backend.claim_many([(call_id, record)])
+                return True
+            except Exception as e:
+                inc('webhook_dedup_errors_total', backend=backend.name)
+                print(f"[{self.tag} ERROR] Could not record completion of {call_id} ({backend.name}): {e}")
+        return False
+
+    def call_ids(self):
+        """call_ids with a completion marker, from the store and the local file."""
+        done = set()
+        for backend in (self.backend, self.fallback):
+            if backend is not None:
+                try:
+                    done.update(backend.call_ids())
+                except Exception as e:
+                    print(f"[{self.tag} ERROR] Could not list completed calls ({backend.name}): {e}")
+        return done
+
+
+def completions_file(client):
+    return os.path.join(COMPLETIONS_DIR, f'completed_calls_{client}.json')
+
+
+def build_completions(client):
+    local = dedup.FileBackend(completions_file(client))
+    if dedup.DEDUP_BACKEND == 'redis' and dedup.REDIS_URL:
+        return Completions(dedup.RedisBackend(dedup.REDIS_URL, f'done-{client}'), fallback=local)
+    return Completions(local)
+
+
+def completions_for(client):
+    """The (shared, per-process) completion markers of ``client``."""
+    store = _stores.get(client)
+    if store is None:
+        with _lock:
+            store = _stores.get(client)
+            if store is None:
+                store = _stores[client] = build_completions(client)
+    return store
+
+
+def mark_completed(client, call_id, idempotency_key=''):
+    """Record that ``client``'s row for ``call_id`` was written; never raises."""
+    try:
+        return completions_for(client).mark(call_id, idempotency_key)
+    except Exception as e:
+        print(f"[DONE ERROR] Could not record completion of {call_id} for {client}: {e}")
+        return False
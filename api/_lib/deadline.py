@@ -0,0 +1,64 @@
+"""
+End-to-end time budget for one webhook request.
+
+Each outbound call used to have its own hardcoded timeout: 3s for the gateway,
+8s for Retell, 10s for assignments, 10-20s for Sheets and 15s for SendGrid.
+Together, plus the 3/6/9s re-fetch sleeps, they could run far past the point
+where Retell or the platform stops waiting for a response.
+
+``do_POST`` now creates one ``Deadline`` and passes it down as ``deadline=``.
+Every outbound call then uses ``min(its usual timeout, remaining budget)``.
+Optional work (Retell re-fetches, the fallback assignments API, notification
+emails) checks ``has()`` first and is skipped when the budget runs low.
+The sheet write is the point of the request, so neither its timeout nor its
+wait for an outbound slot drops below ``MIN_TIMEOUT_SECONDS`` even when the
+budget is spent.
+
+``REQUEST_DEADLINE_SECONDS`` sets the budget (default 25).
+"""
+import os
+import time
+
+DEFAULT_BUDGET_SECONDS = 25.0
+MIN_TIMEOUT_SECONDS = 1.0
+# Budget kept back for the sheet write when deciding whether optional work still fits
+RESERVE_SECONDS = 5.0
+
+
+def default_budget():
+    try:
+        return float(os.environ.get('REQUEST_DEADLINE_SECONDS', DEFAULT_BUDGET_SECONDS))
+    except ValueError:
+        return DEFAULT_BUDGET_SECONDS
+
+
+class Deadline:
+    """A point in time by which the request should be finished."""
+
+    def __init__(self, budget=None):
+        self.budget = default_budget() if budget is None else float(budget)
+        self.started = time.monotonic()
+        self.expires_at = self.started + self.budget
+
+    def remaining(self):
+        """Seconds left in the budget (never negative)."""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def has(self, seconds):
+        """True when at least ``seconds`` of budget are left."""
+        return self.remaining() >= seconds
+
+    def timeout(self, cap, floor=MIN_TIMEOUT_SECONDS):
+        """Timeout for one outbound call: ``cap`` shrunk to the remaining budget, but at least ``floor`` (or ``cap``)."""
+        return max(min(floor, cap), min(cap, self.remaining()))
+
+    def __repr__(self):
+        return f'Deadline(remaining={self.remaining():.2f}s of {self.budget:.1f}s)'
+
+
+def timeout_for(deadline, cap):
+    """``cap`` when there is no deadline, else the deadline-bounded timeout (socket timeouts and slot waits)."""
+    return cap if deadline is None else deadline.timeout(cap)
@@ -0,0 +1,572 @@
+"""
+Duplicate-call detection shared across threads, processes and instances.
+
+Retell retries a webhook it did not get a timely 200 for, and the retry can
+land on another warm Vercel instance or another self-hosted node. The
+``/tmp/processed_calls_*.json`` files only see their own instance, so each
+node wrote the row again. ``DEDUP_BACKEND`` picks where claims are kept:
+
+- ``file`` (default): the tenant's processed-calls file, as before,
+- ``redis``: any Redis-protocol store at ``DEDUP_REDIS_URL``
+  (``redis://[:password@]host:port/db``), shared by every instance.
+
+A call is identified by the same content hash as before (call_id, variables
+and start minute). Claiming it is ``SET key value NX PX ttl``: exactly one
+caller gets ``OK``, everyone else is a duplicate. The ``SET`` is pipelined
+with a ``GET`` of the key, so a claim that went through on a connection that
+then failed is recognised as ours when it is retried.
+
+A claim is held while the call is processed. When processing fails (the sheet
+write failed, or the handler hit an error) the handler calls ``release``,
+which deletes the claim only if it still holds our claim uuid
+(compare-and-delete: a short ``EVAL`` on the store, a locked check on the
+file). Retell's retry of that delivery is then processed rather than
+answered as a duplicate on every instance until the TTL runs out.
+
+In front of the store is a per-process cache of the claims this process
+holds, so a retry reaching the same process while the call is in flight
+answers without a round trip. A call claimed elsewhere is not cached; it
+may yet be released. Each
+thread keeps one connection open with ``TCP_NODELAY``, which keeps a claim to
+a nearby store well under a millisecond. If the store is unreachable the
+tenant's file is used instead, and if that fails too the call is processed
+(a duplicate row is better than a lost one).
+
+    python -m api._lib.dedup serve --port 6390        # local Redis-protocol stand-in
+    python -m api._lib.dedup bench --url redis://127.0.0.1:6390/0
+"""
+import argparse
+import asyncio
+import fnmatch
+import hashlib
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+from api._lib.codec import loads
+from api._lib.filestate import file_lock, read_json, write_json_atomic
+from api._lib.metrics import inc
+
+DEDUP_BACKEND = os.environ.get('DEDUP_BACKEND', 'file').strip().lower()
+REDIS_URL = os.environ.get('DEDUP_REDIS_URL', '')
+KEY_PREFIX = os.environ.get('DEDUP_KEY_PREFIX', 'dedup:')
+TTL_SECONDS = float(os.environ.get('DEDUP_TTL_SECONDS', str(24 * 60 * 60)))
+REDIS_TIMEOUT_SECONDS = float(os.environ.get('DEDUP_REDIS_TIMEOUT_SECONDS', '0.5'))
+FRONT_CACHE_SIZE = int(os.environ.get('DEDUP_FRONT_CACHE_SIZE', '4096'))
+
+# The file backend keeps at most this many claims
+MAX_FILE_ENTRIES = 1000
+
+# Delete KEYS[1] only while it still holds ARGV[1] (our claim)
+RELEASE_SCRIPT = "if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) else return 0 end"
+
+
+def content_hash(call_data):
+    """Hash of call_id + variables + start time (rounded to the minute)."""
+    hash_content = {
+        'call_id': call_data.get('call_id', ''),
+        'custom_data': str(call_data.get('call_analysis', {}).get('custom_analysis_data', {})),
+        'collected_vars': str(call_data.get('collected_dynamic_variables', {})),
+        'timestamp_minute': int(call_data.get('start_timestamp', 0) / 60000),
+    }
+    # stdlib json on purpose: the hash must not change with the codec backend
+    return hashlib.md5(json.dumps(hash_content, sort_keys=True).encode()).hexdigest()
+
+
+class FileBackend:
+    """Claims in a JSON file, serialized with ``file_lock`` (one instance only)."""
+
+    name = 'file'
+
+    def __init__(self, path, ttl=TTL_SECONDS, max_entries=MAX_FILE_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def claim_many(self, entries):
+        """Claim each ``(key, record)``; returns True for the keys this call claimed."""
+        results = []
+        with file_lock(self.path):
+            processed = read_json(self.path, {}) or {}
+            for key, record in entries:
+                if key in processed:
+                    results.append(False)
+                    continue
+                processed[key] = record
+                results.append(True)
+            if any(results):
+                self.cleanup(processed)
+                write_json_atomic(self.path, processed)
+        return results
+
+    def release(self, key, record):
+        """Delete the claim on ``key`` if it is still ``record``'s; True when deleted."""
+        with file_lock(self.path):
+            processed = read_json(self.path, {}) or {}
+            current = processed.get(key)
+            if not isinstance(current, dict) or current.get('claim') != record.get('claim'):
+                return False
+            del processed[key]
+            write_json_atomic(self.path, processed)
+        return True
+
+    def cleanup(self, processed):
+        """Drop claims for calls older than the TTL, then keep the newest ``max_entries``."""
+        cutoff_ms = time.time() * 1000 - self.ttl * 1000
+        for key in [k for k, v in processed.items() if v.get('timestamp', 0) < cutoff_ms]:
+            del processed[key]
+        if len(processed) > self.max_entries:
+            newest = sorted(processed.items(), key=lambda item: item[1].get('timestamp', 0), reverse=True)
+            processed.clear()
+            processed.update(newest[:self.max_entries])
+
+    def call_ids(self):
+        return {v['call_id'] for v in (read_json(self.path, {}) or {}).values()
+                if isinstance(v, dict) and v.get('call_id')}
+
+
+class RedisError(Exception):
+    """An error reply from the store."""
+
+
+def encode_command(*args):
+    out = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode()
+        out.append(b'$%d\r\n%s\r\n' % (len(data), data))
+    return b''.join(out)
+
+
+def read_reply(stream):
+    """Parse one RESP reply from a buffered binary stream."""
+    line = stream.readline()
+    if not line.endswith(b'\r\n'):
+        raise ConnectionError('Connection closed by the store')
+    kind, rest = line[:1], line[1:-2]
+    if kind == b'+':
+        return rest.decode()
+    if kind == b'-':
+        return RedisError(rest.decode())
+    if kind == b':':
+        return int(rest)
+    if kind == b'$':
+        length = int(rest)
+        if length < 0:
+            return None
+        data = stream.read(length + 2)
+        if len(data) != length + 2:
+            raise ConnectionError('Connection closed by the store')
+        return data[:-2]
+    if kind == b'*':
+        length = int(rest)
+        return None if length < 0 else [read_reply(stream) for _ in range(length)]
+    raise ConnectionError(f'Unexpected reply from the store: {line[:40]!r}')
+
+
+class RedisBackend:
+    """Claims in a Redis-protocol store, one persistent connection per thread."""
+
+    name = 'redis'
+
+    def __init__(self, url, namespace, ttl=TTL_SECONDS, timeout=REDIS_TIMEOUT_SECONDS, prefix=KEY_PREFIX):
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.hostname or '127.0.0.1'
+        self.port = parsed.port or 6379
+        self.password = urllib.parse.unquote(parsed.password) if parsed.password else ''
+        self.db = int(parsed.path.strip('/') or 0)
+        self.prefix = f'{prefix}{namespace}:'
+        self.ttl_ms = int(ttl * 1000)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = (sock, sock.makefile('rb'))
+        setup = []
+        if self.password:
+            setup.append(('AUTH', self.password))
+        if self.db:
+            setup.append(('SELECT', self.db))
+        if setup:
+            for reply in self._send(conn, setup):
+                if isinstance(reply, RedisError):
+                    self._close(conn)
+                    raise reply
+        return conn
+
+    def _close(self, conn):
+        for part in reversed(conn):
+            try:
+                part.close()
+            except OSError:
+                pass
+
+    def _send(self, conn, commands):
+        sock, stream = conn
+        sock.sendall(b''.join(encode_command(*command) for command in commands))
+        return [read_reply(stream) for _ in commands]
+
+    def execute_many(self, commands, retry=True):
+        """Send ``commands`` as one pipeline and return their replies in order."""
+        conn = getattr(self._local, 'conn', None)
+        reused = conn is not None
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        try:
+            return self._send(conn, commands)
+        except (OSError, ConnectionError):
+            self._close(conn)
+            self._local.conn = None
+            # An idle connection the store has since closed; one fresh attempt
+            if reused and retry:
+                return self.execute_many(commands, retry=False)
+            raise
+
+    @staticmethod
+    def encode_record(record):
+        # Compared byte for byte with a value another instance may have written: stdlib json, sorted
+        return json.dumps(record, sort_keys=True).encode()
+
+    def claim_many(self, entries):
+        commands = []
+        values = []
+        for key, record in entries:
+            value = self.encode_record(record)
+            values.append(value)
+            commands.append(('SET', self.prefix + key, value, 'NX', 'PX', self.ttl_ms))
+            commands.append(('GET', self.prefix + key))
+        replies = self.execute_many(commands)
+        results = []
+        for i, value in enumerate(values):
+            set_reply, current = replies[2 * i], replies[2 * i + 1]
+            for reply in (set_reply, current):
+                if isinstance(reply, RedisError):
+                    raise reply
+            # Our own value means an earlier attempt of this pipeline already claimed it
+            results.append(set_reply == 'OK' or current == value)
+        return results
+
+    def release(self, key, record):
+        """Compare-and-delete: drop ``key`` only while it still holds ``record``; True when deleted."""
+        reply = self.execute_many([('EVAL', RELEASE_SCRIPT, 1, self.prefix + key, self.encode_record(record))])[0]
+        if isinstance(reply, RedisError):
+            raise reply
+        return reply == 1
+
+    def call_ids(self):
+        keys = []
+        cursor = '0'
+        while True:
+            cursor, batch = self.execute_many([('SCAN', cursor, 'MATCH', self.prefix + '*', 'COUNT', 500)])[0]
+            keys.extend(batch)
+            cursor = cursor.decode() if isinstance(cursor, bytes) else cursor
+            if cursor == '0':
+                break
+        done = set()
+        for start in range(0, len(keys), 500):
+            values = self.execute_many([('MGET', *keys[start:start + 500])])[0]
+            for value in values:
+                try:
+                    call_id = loads(value).get('call_id') if value else None
+                except ValueError:
+                    call_id = None
+                if call_id:
+                    done.add(call_id)
+        return done
+
+
+class FrontCache:
+    """Claims this process holds, by hash, kept for the claim TTL (bounded, least recently used out)."""
+
+    def __init__(self, size=FRONT_CACHE_SIZE, ttl=TTL_SECONDS):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return False
+            self._entries.move_to_end(key)
+            return True
+
+    def add(self, key, claim=None):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, claim)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        """Forget ``key`` and return the claim stored with it, or None."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return entry[1] if entry else None
+
+
+class Deduper:
+    """A tenant's duplicate check: front cache, then the shared store, then its file."""
+
+    def __init__(self, backend, fallback=None, tag='DEDUP', cache_size=FRONT_CACHE_SIZE):
+        self.backend = backend
+        self.fallback = fallback
+        self.tag = tag
+        self.cache = FrontCache(cache_size, getattr(backend, 'ttl', TTL_SECONDS))
+
+    def is_duplicate(self, call_data):
+        """Claim ``call_data``; True when another request (anywhere) already did."""
+        key = content_hash(call_data)
+        if key in self.cache:
+            inc('webhook_cache_requests_total', cache='dedup_front', result='hit')
+            print(f"[{self.tag}] Found duplicate hash: {key} (cached)")
+            return True
+        inc('webhook_cache_requests_total', cache='dedup_front', result='miss')
+        record = {
+            'call_id': call_data.get('call_id', ''),
+            'processed_at': datetime.now().isoformat(),
+            'timestamp': call_data.get('start_timestamp', 0),
+            'claim': uuid.uuid4().hex,
+        }
+        backend, results = self.claim_with([(key, record)])
+        if not results[0]:
+            # Not cached: the holder may still release it
+            print(f"[{self.tag}] Found duplicate hash: {key}")
+            return True
+        # Ours until released; the backend that took it is the one to release it on
+        self.cache.add(key, (backend, record))
+        print(f"[{self.tag}] New call hash: {key}")
+        return False
+
+    def release(self, call_data):
+        """Give up this process's claim on ``call_data`` after a failure, so a retry is processed."""
+        key = content_hash(call_data)
+        held = self.cache.pop(key)
+        if not held or held[0] is None:
+            return False
+        backend, record = held
+        try:
+            released = backend.release(key, record)
+        except Exception as e:
+            inc('webhook_dedup_errors_total', backend=backend.name)
+            print(f"[{self.tag} ERROR] Could not release {key} ({backend.name}): {e}")
+            return False
+        print(f"[{self.tag}] Released claim {key}" if released else f"[{self.tag}] Claim {key} no longer ours")
+        return released
+
+    def claim_with(self, entries):
+        """Claim ``entries``; returns (backend that answered, results). The backend is None when none did."""
+        for backend in (self.backend, self.fallback):
+            if backend is None:
+                continue
+            try:
+                return backend, backend.claim_many(entries)
+            except Exception as e:
+                inc('webhook_dedup_errors_total', backend=backend.name)
+                print(f"[{self.tag} ERROR] Error checking duplicate ({backend.name}): {e}")
+        # If error, allow processing to continue
+        return None, [True] * len(entries)
+
+    def claim(self, entries):
+        return self.claim_with(entries)[1]
+
+    def call_ids(self):
+        """call_ids with a live claim, from the store and the local file."""
+        done = set()
+        for backend in (self.backend, self.fallback):
+            if backend is not None:
+                try:
+                    done.update(backend.call_ids())
+                except Exception as e:
+                    print(f"[{self.tag} ERROR] Could not list processed calls ({backend.name}): {e}")
+        return done
+
+
+def deduper(tenant, tag='DEDUP'):
+    """The duplicate check for ``tenant``, on the backend ``DEDUP_BACKEND`` selects."""
+    local = FileBackend(tenant.dedup_file) if tenant.dedup_file else None
+    if DEDUP_BACKEND == 'redis' and REDIS_URL:
+        return Deduper(RedisBackend(REDIS_URL, tenant.dedup_namespace or tenant.key), fallback=local, tag=tag)
+    if DEDUP_BACKEND == 'redis':
+        print(f"[{tag}] DEDUP_BACKEND=redis but DEDUP_REDIS_URL is unset; using the local file")
+    return Deduper(local, tag=tag)
+
+
+class StandInStore:
+    """In-memory stand-in for the Redis commands the backend uses, for local runs and tests."""
+
+    def __init__(self):
+        self.data = {}
+
+    def _live(self, key):
+        entry = self.data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            del self.data[key]
+            return None
+        return entry
+
+    def execute(self, args):
+        command = args[0].decode().upper()
+        if command == 'PING':
+            return '+PONG'
+        if command in ('AUTH', 'SELECT'):
+            return '+OK'
+        if command == 'SET':
+            key, value = args[1], args[2]
+            options = [a.decode().upper() for a in args[3:]]
+            expires_at = None
+            for unit, scale in (('PX', 0.001), ('EX', 1.0)):
+                if unit in options:
+                    expires_at = time.monotonic() + int(options[options.index(unit) + 1]) * scale
+            if 'NX' in options and self._live(key) is not None:
+                return None
+            self.data[key] = (value, expires_at)
+            return '+OK'
+        if command == 'GET':
+            entry = self._live(args[1])
+            return entry[0] if entry else None
+        if command == 'MGET':
+            return [(self._live(key) or (None,))[0] for key in args[1:]]
+        if command == 'EVAL':
+            # Only the release script; anything else is unsupported here
+            if args[1].decode() != RELEASE_SCRIPT:
+                return RedisError('ERR the stand-in store only runs the release script')
+            entry = self._live(args[3])
+            if entry is None or entry[0] != args[4]:
+                return 0
+            del self.data[args[3]]
+            return 1
+        if command == 'DEL':
+            return sum(1 for key in args[1:] if self.data.pop(key, None) is not None)
+        if command == 'FLUSHDB':
+            self.data.clear()
+            return '+OK'
+        if command == 'SCAN':
+            options = [a.decode() for a in args[2:]]
+            pattern = options[options.index('MATCH') + 1] if 'MATCH' in options else '*'
+            keys = [k for k in list(self.data) if self._live(k) and fnmatch.fnmatchcase(k.decode(), pattern)]
+            return [b'0', keys]
+        return RedisError(f"ERR unknown command '{command}'")
+
+
+def encode_reply(reply):
+    if reply is None:
+        return b'$-1\r\n'
+    if isinstance(reply, RedisError):
+        return f'-{reply}\r\n'.encode()
+    if isinstance(reply, str):
+        return reply.encode() + b'\r\n'
+    if isinstance(reply, int):
+        return b':%d\r\n' % reply
+    if isinstance(reply, bytes):
+        return b'$%d\r\n%s\r\n' % (len(reply), reply)
+    return b'*%d\r\n' % len(reply) + b''.join(encode_reply(item) for item in reply)
+
+
+async def read_command(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b'*'):
+        return line.split()
+    args = []
+    for _ in range(int(line[1:-2])):
+        length = int((await reader.readline())[1:-2])
+        args.append((await reader.readexactly(length + 2))[:-2])
+    return args
+
+
+async def serve_stand_in(host='127.0.0.1', port=6390, ready=None):
+    """Run a stand-in store until cancelled; ``ready(port)`` is called once listening."""
+    store = StandInStore()
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                args = await read_command(reader)
+                if args is None:
+                    break
+                if not args:
+                    continue
+                writer.write(encode_reply(store.execute(args)))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    bound = server.sockets[0].getsockname()[1]
+    print(f"[DEDUP] Stand-in store listening on {host}:{bound}")
+    if ready:
+        ready(bound)
+    async with server:
+        await server.serve_forever()
+
+
+def start_stand_in(host='127.0.0.1', port=0):
+    """Start a stand-in store on a background thread; returns its ``redis://`` URL."""
+    bound = []
+    started = threading.Event()
+
+    def ready(p):
+        bound.append(p)
+        started.set()
+
+    thread = threading.Thread(target=lambda: asyncio.run(serve_stand_in(host, port, ready)), daemon=True)
+    thread.start()
+    started.wait(5)
+    return f'redis://{host}:{bound[0]}/0'
+
+
+def bench(url, count):
+    """Time ``count`` fresh claims against ``url``; returns (p50_ms, p99_ms)."""
+    backend = RedisBackend(url, f'bench-{uuid.uuid4().hex[:8]}')
+    timings = []
+    for i in range(count):
+        started = time.perf_counter()
+        backend.claim_many([(f'{i}', {'call_id': f'bench-{i}', 'timestamp': 0})])
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2], timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Shared dedup store tools.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help='Run a local Redis-protocol stand-in store')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=6390)
+    bench_cmd = commands.add_parser('bench', help='Measure claim round-trips against a store')
+    bench_cmd.add_argument('--url', default=REDIS_URL, help='Store URL (default DEDUP_REDIS_URL, else a stand-in)')
+    bench_cmd.add_argument('-n', type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        try:
+            asyncio.run(serve_stand_in(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+        return 0
+    url = args.url or start_stand_in()
+    p50, p99 = bench(url, args.n)
+    print(f"[DEDUP] {args.n} claims against {url}: p50 {p50:.3f} ms, p99 {p99:.3f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,61 @@
+"""
+Small helpers for JSON state files shared between threads and processes.
+
+The handlers keep their dedup state in ``/tmp/*.json``. Once several threads
+(self-hosted server) or several processes (pre-fork mode) touch the same file,
+the read-modify-write in ``is_duplicate_call`` has to be serialized and the
+write has to be atomic so a reader never sees a half-written file.
+"""
+import os
+import tempfile
+from contextlib import contextmanager
+
+from api._lib.codec import dumps, loads
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX dev machines
+    fcntl = None
+
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive advisory lock on ``path + '.lock'`` for the duration of the block.
+
+    flock() locks belong to the open file description, so this serializes
+    threads of one process as well as separate processes.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def read_json(path, default=None):
+    """Load a JSON file, returning ``default`` when it is missing or unreadable."""
+    try:
+        with open(path, 'rb') as f:
+            return loads(f.read())
+    except (OSError, ValueError):
+        return default
+
+
+def write_json_atomic(path, data):
+    """Write JSON to a temp file in the same directory and rename it over ``path``."""
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.json')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(dumps(data))
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,36 @@
+"""
+Deterministic idempotency keys for Google Sheets row writes.
+
+A sheet write that times out after Apps Script already appended the row used
+to turn a retry (or a backfill) into a duplicate row. Every row now carries a
+key derived from the call_id and the pipeline version that produced it, sent
+both as the ``Idempotency-Key`` header and as the ``idempotency_key`` field.
+
+Apps Script's ``doPost(e)`` cannot read request headers, so the script checks
+the field; the header is there for proxies and non-Apps Script sinks. See
+"Idempotent sheet writes" in README.md for the script-side check.
+
+A payload without a call_id gets no key (the field and header are left off):
+a key from the pipeline version alone would be shared by every such row, and
+the script would drop all of them after the first.
+"""
+import hashlib
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_FIELD = 'idempotency_key'
+
+
+def idempotency_key(call_id, pipeline_version):
+    """Return a stable 32-hex-char key for one call written by one pipeline version, or None without a call_id."""
+    if not call_id:
+        return None
+    raw = f'{pipeline_version}:{call_id}'.encode('utf-8')
+    return hashlib.sha256(raw).hexdigest()[:32]
+
+
+def sheet_headers(key):
+    """Headers for a sheet write: JSON, plus ``Idempotency-Key`` when the row has a key."""
+    headers = {'Content-Type': 'application/json'}
+    if key:
+        headers[IDEMPOTENCY_HEADER] = key
+    return headers
@@ -0,0 +1,186 @@
+"""
+Per-host latency histograms and the timeouts learned from them.
+
+The assignment APIs (hvacapi, plumbing-api, the fire-alarm/sprinkler APIs)
+normally answer in well under a second, but were called with ``timeout=10``,
+so one hung request burnt most of a request's budget. ``open_url`` records
+how long every successful call to a host took; ``learned_timeout`` turns the
+host's high percentile into a timeout:
+
+    timeout = clamp(p99 * HEADROOM + PADDING_SECONDS, MIN_TIMEOUT, default)
+
+Until a host has ``MIN_SAMPLES`` observations the default is used unchanged,
+and the learned value never exceeds it. Failed calls are counted but kept out
+of the histogram so timeouts cannot ratchet the percentile up to the timeout.
+
+Histograms survive warm invocations in memory and are persisted to
+``LATENCY_STATE_FILE`` (default ``/tmp/dependency_latency.json``) so a new
+process on the same instance starts from them. Counts are halved once a host
+passes ``MAX_SAMPLES`` so old behaviour fades out.
+"""
+import os
+import threading
+import time
+import urllib.parse
+
+from api._lib.filestate import read_json, write_json_atomic
+
+STATE_FILE = os.environ.get('LATENCY_STATE_FILE', '/tmp/dependency_latency.json')
+
+# Upper bounds of the histogram buckets in milliseconds; the last bucket is open-ended
+BUCKETS_MS = [25, 50, 75, 100, 150, 200, 300, 400, 500, 750, 1000, 1500, 2000, 3000, 5000, 7500, 10000, 15000, 20000]
+
+PERCENTILE = 0.99
+HEADROOM = 1.5
+PADDING_SECONDS = 0.25
+# The assignment APIs are serverless too; leave room for their occasional cold start
+MIN_TIMEOUT = 2.0
+MIN_SAMPLES = 20
+MAX_SAMPLES = 5000
+SAVE_INTERVAL_SECONDS = 30.0
+
+
+class Histogram:
+    """Bucketed latency counts for one host."""
+
+    def __init__(self, counts=None, failures=0, total_ms=0.0):
+        counts = list(counts or [])
+        self.counts = (counts + [0] * (len(BUCKETS_MS) + 1))[:len(BUCKETS_MS) + 1]
+        self.failures = failures
+        self.total_ms = total_ms
+
+    @property
+    def samples(self):
+        return sum(self.counts)
+
+    def add(self, elapsed_ms):
+        index = len(BUCKETS_MS)
+        for i, bound in enumerate(BUCKETS_MS):
+            if elapsed_ms <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.total_ms += elapsed_ms
+        if self.samples > MAX_SAMPLES:
+            self.decay()
+
+    def decay(self):
+        """Halve every count so recent behaviour outweighs old observations."""
+        self.counts = [count // 2 for count in self.counts]
+        self.failures //= 2
+        self.total_ms /= 2
+
+    def percentile(self, fraction):
+        """Estimated latency in ms at ``fraction`` (0-1), interpolated within the bucket."""
+        samples = self.samples
+        if not samples:
+            return None
+        target = fraction * samples
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= target:
+                lower = BUCKETS_MS[i - 1] if i > 0 else 0
+                upper = BUCKETS_MS[i] if i < len(BUCKETS_MS) else BUCKETS_MS[-1] * 2
+                return lower + (upper - lower) * (target - seen) / count
+            seen += count
+        return float(BUCKETS_MS[-1] * 2)
+
+    def to_dict(self):
+        return {'counts': self.counts, 'failures': self.failures, 'total_ms': round(self.total_ms, 1)}
+
+
+class LatencyTracker:
+    """Histograms for every host called by this process, persisted to ``path``."""
+
+    def __init__(self, path=STATE_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.hosts = None
+        # Save on the first record so even a short-lived instance leaves its histograms behind
+        self.last_saved = float('-inf')
+
+    def _load(self):
+        if self.hosts is None:
+            state = read_json(self.path, {}) if self.path else {}
+            self.hosts = {}
+            for host, entry in (state or {}).items():
+                if isinstance(entry, dict):
+                    self.hosts[host] = Histogram(entry.get('counts'), entry.get('failures', 0), entry.get('total_ms', 0.0))
+        return self.hosts
+
+    def record(self, host, elapsed_seconds, ok=True):
+        with self.lock:
+            hist = self._load().setdefault(host, Histogram())
+            if ok:
+                hist.add(elapsed_seconds * 1000)
+            else:
+                hist.failures += 1
+            due = time.monotonic() - self.last_saved >= SAVE_INTERVAL_SECONDS
+        if due:
+            self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            state = {host: hist.to_dict() for host, hist in self._load().items()}
+            self.last_saved = time.monotonic()
+        try:
+            write_json_atomic(self.path, state)
+        except OSError as e:
+            print(f"[LATENCY] Could not persist histograms: {e}")
+
+    def histogram(self, host):
+        with self.lock:
+            return self._load().get(host)
+
+    def timeout(self, host, default):
+        """Timeout for ``host`` learned from its histogram, never above ``default``."""
+        hist = self.histogram(host)
+        if hist is None or hist.samples < MIN_SAMPLES:
+            return default
+        learned = hist.percentile(PERCENTILE) / 1000 * HEADROOM + PADDING_SECONDS
+        return round(min(default, max(MIN_TIMEOUT, learned)), 2)
+
+    def report(self, default=10.0):
+        """Observed percentiles and the recommended timeout for every host."""
+        with self.lock:
+            hosts = dict(self._load())
+        report = {}
+        for host, hist in sorted(hosts.items()):
+            samples = hist.samples
+            report[host] = {
+                'samples': samples,
+                'failures': hist.failures,
+                'mean_ms': round(hist.total_ms / samples, 1) if samples else None,
+                'p50_ms': _round(hist.percentile(0.50)),
+                'p90_ms': _round(hist.percentile(0.90)),
+                'p99_ms': _round(hist.percentile(0.99)),
+                'recommended_timeout': self.timeout(host, default),
+            }
+        return report
+
+
+def _round(value):
+    return None if value is None else round(value, 1)
+
+
+def host_of(url):
+    return urllib.parse.urlsplit(url).hostname or url
+
+
+tracker = LatencyTracker()
+
+
+def record_latency(url, elapsed_seconds, ok=True):
+    """Record one call to ``url``'s host."""
+    tracker.record(host_of(url), elapsed_seconds, ok)
+
+
+def learned_timeout(url, default):
+    """Timeout for a call to ``url``: learned from its host's latency, at most ``default``."""
+    return tracker.timeout(host_of(url), default)
+
+
+def latency_report(default=10.0):
+    return tracker.report(default)
@@ -0,0 +1,180 @@
+"""
+In-process counters and histograms, rendered in Prometheus text format.
+
+Recording is a dict update under one lock: a series is keyed by
+``(name, labels)`` where ``labels`` is a tuple of ``(key, value)`` pairs,
+counters hold a number, and histograms hold a list of per-bucket counts plus
+a running sum. Nothing is formatted until ``/api/metrics`` is scraped.
+
+- ``inc(name, amount, **labels)`` adds to a counter,
+- ``observe(name, seconds, **labels)`` adds a sample to a histogram,
+- ``stage(client, name)`` decorates a pipeline step to time it,
+- ``register_collector(fn)`` adds gauges (queue depths, in-flight counts)
+  that are read only at scrape time.
+
+``snapshot()`` is plain JSON, so pre-fork workers publish it with their other
+stats and ``merge_snapshots`` sums them for the supervisor-wide view.
+"""
+import bisect
+import functools
+import threading
+import time
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds in seconds (Prometheus' defaults); the +Inf bucket is implicit
+BUCKETS_SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0)
+
+# name -> (type, help)
+METRICS = {
+    'webhook_requests_total': ('counter', 'Requests by client, event and response status.'),
+    'webhook_request_duration_seconds': ('histogram', 'Time to produce a response, by client.'),
+    'webhook_stage_duration_seconds': ('histogram', 'Time spent in each pipeline stage, by client.'),
+    'webhook_stage_errors_total': ('counter', 'Pipeline stages that raised, by client and stage.'),
+    'webhook_dedup_checks_total': ('counter', 'Duplicate-call checks by client and result (hit = duplicate).'),
+    'webhook_dedup_errors_total': ('counter', 'Dedup store errors by backend (the next backend is used).'),
+    'webhook_outbound_request_duration_seconds': ('histogram', 'Outbound HTTP call latency by host.'),
+    'webhook_outbound_errors_total': ('counter', 'Failed outbound HTTP calls by host and kind.'),
+    'webhook_cache_requests_total': ('counter', 'Cache lookups by cache and result.'),
+    'webhook_captured_total': ('counter', 'Inbound requests written to the capture ring, by result.'),
+    'webhook_captured_bytes_total': ('counter', 'Compressed bytes written to the capture ring.'),
+    'webhook_profiles_total': ('counter', 'Requests profiled and written to PROFILE_DIR, by client.'),
+    'webhook_outbound_in_flight': ('gauge', 'Outbound calls currently holding a slot, by host.'),
+    'webhook_outbound_waiting': ('gauge', 'Outbound calls queued for a slot, by host.'),
+    'webhook_server_in_flight': ('gauge', 'Requests currently being handled.'),
+    'webhook_server_queue_depth': ('gauge', 'Requests waiting for a handler thread.'),
+    'webhook_server_coalescing': ('gauge', 'call_analyzed deliveries currently being handled (followers wait on these).'),
+    'webhook_coalesced_total': ('counter', 'Concurrent duplicate deliveries by client and outcome (shared, ack, rerun).'),
+}
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_collectors = []
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name, seconds, **labels):
+    key = _key(name, labels)
+    index = bisect.bisect_left(BUCKETS_SECONDS, seconds)
+    with _lock:
+        series = _histograms.get(key)
+        if series is None:
+            series = _histograms[key] = [[0] * (len(BUCKETS_SECONDS) + 1), 0.0]
+        series[0][index] += 1
+        series[1] += seconds
+
+
+def register_collector(collect):
+    """Add ``collect()``, returning ``[(name, labels_dict, value), ...]``, to every scrape."""
+    if collect not in _collectors:
+        _collectors.append(collect)
+
+
+def stage(client, name):
+    """Decorator timing a pipeline step into ``webhook_stage_duration_seconds``."""
+    def decorate(func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            started = time.monotonic()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                inc('webhook_stage_errors_total', client=client, stage=name)
+                raise
+            finally:
+                observe('webhook_stage_duration_seconds', time.monotonic() - started, client=client, stage=name)
+        return timed
+    return decorate
+
+
+def record_dedup(client, duplicate):
+    """Count a duplicate check and pass its result through."""
+    inc('webhook_dedup_checks_total', client=client, result='hit' if duplicate else 'miss')
+    return duplicate
+
+
+def snapshot():
+    """This process's series as JSON-friendly lists; gauges are collected now."""
+    with _lock:
+        counters = [[name, [list(pair) for pair in labels], value] for (name, labels), value in _counters.items()]
+        histograms = [[name, [list(pair) for pair in labels], list(series[0]), series[1]]
+                      for (name, labels), series in _histograms.items()]
+    gauges = []
+    for collect in list(_collectors):
+        try:
+            gauges.extend([name, sorted([k, v] for k, v in labels.items()), value] for name, labels, value in collect())
+        except Exception as e:
+            print(f"[METRICS] Collector failed: {e}")
+    return {"counters": counters, "gauges": gauges, "histograms": histograms}
+
+
+def merge_snapshots(total, other):
+    """Sum ``other`` into ``total`` (both ``snapshot()`` results); returns ``total``."""
+    for kind in ('counters', 'gauges'):
+        index = {(row[0], tuple(map(tuple, row[1]))): row for row in total.setdefault(kind, [])}
+        for name, labels, value in other.get(kind, []):
+            row = index.get((name, tuple(map(tuple, labels))))
+            if row is None:
+                total[kind].append([name, labels, value])
+            else:
+                row[2] += value
+    index = {(row[0], tuple(map(tuple, row[1]))): row for row in total.setdefault('histograms', [])}
+    for name, labels, counts, total_seconds in other.get('histograms', []):
+        row = index.get((name, tuple(map(tuple, labels))))
+        if row is None:
+            total['histograms'].append([name, labels, list(counts), total_seconds])
+        else:
+            row[2] = [a + b for a, b in zip(row[2], counts)]
+            row[3] += total_seconds
+    return total
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(pairs, extra=None):
+    pairs = list(pairs) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(snap=None):
+    """Text exposition format for ``snap`` (default: this process)."""
+    snap = snapshot() if snap is None else snap
+    by_name = {}
+    for kind in ('counters', 'gauges', 'histograms'):
+        for row in snap.get(kind, []):
+            by_name.setdefault(row[0], []).append(row)
+    lines = []
+    for name in sorted(by_name):
+        kind, help_text = METRICS.get(name, ('untyped', ''))
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for row in sorted(by_name[name], key=lambda r: r[1]):
+            if kind != 'histogram':
+                lines.append(f'{name}{_labels(row[1])} {_number(row[2])}')
+                continue
+            _, labels, counts, total_seconds = row
+            cumulative = 0
+            for bound, count in zip(BUCKETS_SECONDS + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(labels, ("le", bound))} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {_number(round(total_seconds, 6))}')
+            lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
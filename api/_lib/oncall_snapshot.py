@@ -0,0 +1,119 @@
+"""
+Last-known-good on-call assignments, persisted to disk.
+
+When an assignments API was down or slow, the tech lookups waited out their
+timeouts and then fell back to ``FALLBACK_TECH_EMAIL``/``FALLBACK_TECH_PHONE``,
+a static value that is often not who is on call. Now every successful lookup
+is snapshotted per API URL with a timestamp in ``ONCALL_SNAPSHOT_FILE``
+(default ``/tmp/oncall_snapshot.json``):
+
+- a cold instance reads the file on first use and has every snapshot
+  immediately; the file is read again whenever another process (e.g. a
+  sibling pre-fork worker) has rewritten it, so every worker sees every
+  worker's lookups,
+- when the live APIs give nothing usable, the newest snapshot younger than
+  ``ONCALL_SNAPSHOT_MAX_AGE_HOURS`` (default 72) is used before the static
+  fallback, marked ``stale: True`` with its ``snapshot_at`` time,
+- while a snapshot exists, the live call only gets
+  ``ONCALL_LIVE_BUDGET_SECONDS`` (default 3) instead of the full timeout,
+  since a slow answer is no longer worth more than the snapshot.
+"""
+import os
+import threading
+import time
+from datetime import datetime
+
+from api._lib.filestate import file_lock, read_json, write_json_atomic
+from api._lib.latency import learned_timeout
+from api._lib.metrics import inc
+from api._lib.records import TechContact
+
+SNAPSHOT_FILE = os.environ.get('ONCALL_SNAPSHOT_FILE', '/tmp/oncall_snapshot.json')
+MAX_AGE_SECONDS = float(os.environ.get('ONCALL_SNAPSHOT_MAX_AGE_HOURS', '72')) * 3600
+LIVE_BUDGET_SECONDS = float(os.environ.get('ONCALL_LIVE_BUDGET_SECONDS', '3'))
+REFRESH_SECONDS = 300
+
+_snapshots = None
+# Identity of the file version _snapshots was read from: (inode, mtime_ns), None when absent
+_file_version = None
+_lock = threading.Lock()
+
+
+def _version():
+    try:
+        stat = os.stat(SNAPSHOT_FILE)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def _load():
+    """The snapshots, re-read when the file changed since the last read (one ``stat`` otherwise)."""
+    global _snapshots, _file_version
+    version = _version() if SNAPSHOT_FILE else None
+    if _snapshots is None or version != _file_version:
+        data = read_json(SNAPSHOT_FILE, {}) if SNAPSHOT_FILE else {}
+        fresh = data if isinstance(data, dict) else {}
+        # Entries this process could not persist stay, unless the file has a newer one
+        for url, entry in (_snapshots or {}).items():
+            on_disk = fresh.get(url)
+            if not isinstance(on_disk, dict) or on_disk.get('saved_at', 0) < entry.get('saved_at', 0):
+                fresh[url] = entry
+        _snapshots = fresh
+        _file_version = version
+    return _snapshots
+
+
+def remember_tech(api_url, tech):
+    """Snapshot a successful lookup of ``api_url``; empty answers are ignored."""
+    if tech is None or not (tech.get('email') or tech.get('phone')) or tech.get('stale'):
+        return
+    entry = {
+        'tech': {'name': tech.get('name', ''), 'email': tech.get('email', ''), 'phone': tech.get('phone', '')},
+        'saved_at': time.time(),
+    }
+    with _lock:
+        snapshots = _load()
+        previous = snapshots.get(api_url)
+        # Rewrite the file only when the assignment changed or the timestamp is getting old
+        if previous and previous.get('tech') == entry['tech'] and entry['saved_at'] - previous.get('saved_at', 0) < REFRESH_SECONDS:
+            return
+        snapshots[api_url] = entry
+    if not SNAPSHOT_FILE:
+        return
+    try:
+        with file_lock(SNAPSHOT_FILE):
+            on_disk = read_json(SNAPSHOT_FILE, {}) or {}
+            on_disk[api_url] = entry
+            write_json_atomic(SNAPSHOT_FILE, on_disk)
+    except OSError as e:
+        print(f"[ONCALL SNAPSHOT] Could not persist snapshot for {api_url}: {e}")
+
+
+def has_snapshot(api_url):
+    with _lock:
+        entry = _load().get(api_url)
+    return bool(entry) and time.time() - entry.get('saved_at', 0) <= MAX_AGE_SECONDS
+
+
+def snapshot_tech(*api_urls):
+    """The newest usable snapshot among ``api_urls`` as a TechContact flagged stale, or None."""
+    with _lock:
+        entries = [_load().get(url) for url in api_urls]
+    now = time.time()
+    usable = [e for e in entries if e and now - e.get('saved_at', 0) <= MAX_AGE_SECONDS]
+    if not usable:
+        inc('webhook_cache_requests_total', cache='oncall_snapshot', result='miss')
+        return None
+    inc('webhook_cache_requests_total', cache='oncall_snapshot', result='hit')
+    entry = max(usable, key=lambda e: e['saved_at'])
+    snapshot_at = datetime.fromtimestamp(entry['saved_at']).isoformat()
+    return TechContact.from_mapping(entry['tech'], stale=True, snapshot_at=snapshot_at)
+
+
+def lookup_timeout(api_url, default):
+    """Timeout for a live lookup: the learned timeout, capped at the live budget when a snapshot can cover."""
+    timeout = learned_timeout(api_url, default)
+    if has_snapshot(api_url):
+        timeout = min(timeout, LIVE_BUDGET_SECONDS)
+    return timeout
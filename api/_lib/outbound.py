@@ -0,0 +1,278 @@
+"""
+Shared per-destination limits for outbound HTTP calls.
+
+Apps Script and SendGrid enforce quotas, and a burst of calls (a storm night
+for Braconier) used to turn into 429s that were never retried. Every outbound
+request in the handlers now goes through ``open_url``, which applies the limit
+for its destination before calling ``urllib.request.urlopen``:
+
+- a token bucket for requests per second,
+- a semaphore capping requests in flight,
+- a bounded wait: a request over the limit queues for up to ``max_wait``
+  seconds and only then fails with ``LimitExceeded``,
+- one retry after a 429, honouring ``Retry-After`` within ``max_wait``.
+
+A destination is the request URL without its query string. Limits are looked
+up by that URL first, then by host, so a client's Apps Script URL can get its
+own limit while every other Apps Script URL shares the host default. Override
+or extend the defaults, and the per-tenant ``limits`` in ``tenants.json``,
+with ``OUTBOUND_LIMITS`` (JSON), e.g.::
+
+    OUTBOUND_LIMITS='{"https://script.google.com/macros/s/ABC/exec": {"rate": 2, "concurrency": 4},
+                      "api.sendgrid.com": {"rate": 5}}'
+
+A rate or concurrency of 0 means unlimited. Counters per destination are
+returned by ``limiter_stats()`` and included in the server's worker stats.
+Every call's latency is also recorded per host in ``api._lib.latency`` and,
+with failures by kind, in ``api._lib.metrics``.
+"""
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from contextlib import contextmanager
+
+from api._lib.deadline import timeout_for
+from api._lib.latency import host_of, record_latency
+from api._lib.metrics import inc, observe, register_collector
+from api._lib.ratelimit import TokenBucket
+from api._lib.tenants import sink_limits
+
+LIMITS_ENV = 'OUTBOUND_LIMITS'
+
+DEFAULT_MAX_WAIT_SECONDS = 10.0
+
+# Apps Script allows ~30 simultaneous executions per script owner; SendGrid's
+# mail send endpoint allows 600 requests per minute.
+DEFAULT_LIMITS = {
+    'script.google.com': {'rate': 5, 'burst': 10, 'concurrency': 10},
+    'script.googleusercontent.com': {'rate': 5, 'burst': 10, 'concurrency': 10},
+    'api.sendgrid.com': {'rate': 10, 'burst': 10, 'concurrency': 8},
+}
+
+UNLIMITED = {'rate': 0, 'concurrency': 0}
+
+
+class LimitExceeded(Exception):
+    """Raised when a request waited ``max_wait`` seconds without getting a slot."""
+
+
+class Limiter:
+    """Token bucket plus in-flight cap for one destination."""
+
+    def __init__(self, name, rate=0, burst=None, concurrency=0, max_wait=DEFAULT_MAX_WAIT_SECONDS):
+        self.name = name
+        self.rate = float(rate or 0)
+        self.concurrency = int(concurrency or 0)
+        self.max_wait = float(max_wait)
+        self.bucket = TokenBucket(self.rate, burst)
+        self.slots = threading.BoundedSemaphore(self.concurrency) if self.concurrency > 0 else None
+        self.lock = threading.Lock()
+        self.stats = {
+            'requests': 0, 'in_flight': 0, 'waiting': 0, 'queued': 0, 'rejected': 0,
+            'throttled': 0, 'retried': 0, 'wait_seconds': 0.0,
+        }
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def reject(self, message):
+        self.count('rejected')
+        inc('webhook_outbound_errors_total', host=host_of(self.name), kind='limited')
+        raise LimitExceeded(message)
+
+    @contextmanager
+    def slot(self, max_wait=None):
+        """Hold one request slot, waiting up to ``max_wait`` seconds for it."""
+        max_wait = self.max_wait if max_wait is None else max_wait
+        started = time.monotonic()
+        self.count('waiting')
+        waiting = True
+        try:
+            if self.slots is not None and not self.slots.acquire(timeout=max_wait):
+                self.reject(f'{self.name}: no free slot after {max_wait:.1f}s')
+            try:
+                remaining = max(0.0, max_wait - (time.monotonic() - started))
+                if not self.bucket.acquire(timeout=remaining):
+                    self.reject(f'{self.name}: rate limit still exceeded after {max_wait:.1f}s')
+                waited = time.monotonic() - started
+                with self.lock:
+                    self.stats['waiting'] -= 1
+                    waiting = False
+                    self.stats['requests'] += 1
+                    self.stats['in_flight'] += 1
+                    if waited >= 0.001:
+                        self.stats['queued'] += 1
+                        self.stats['wait_seconds'] += waited
+                try:
+                    yield
+                finally:
+                    self.count('in_flight', -1)
+            finally:
+                if self.slots is not None:
+                    self.slots.release()
+        finally:
+            if waiting:
+                self.count('waiting', -1)
+
+    def snapshot(self):
+        with self.lock:
+            snapshot = dict(self.stats)
+        snapshot['wait_seconds'] = round(snapshot['wait_seconds'], 3)
+        snapshot['rate'] = self.rate
+        snapshot['concurrency'] = self.concurrency
+        return snapshot
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+_configured_limits = None
+
+
+def configured_limits():
+    """Default limits overlaid with ``OUTBOUND_LIMITS``; read once per process."""
+    global _configured_limits
+    if _configured_limits is None:
+        limits = {key: dict(value) for key, value in DEFAULT_LIMITS.items()}
+        # Tenants with their own limit get a bucket for their sink URL instead of sharing the host's
+        limits.update(sink_limits())
+        raw = os.environ.get(LIMITS_ENV, '')
+        if raw:
+            try:
+                overrides = json.loads(raw)
+                for key, value in overrides.items():
+                    if isinstance(value, dict):
+                        limits[key.rstrip('/')] = value
+            except (ValueError, AttributeError) as e:
+                print(f"[OUTBOUND] Ignoring invalid {LIMITS_ENV}: {e}")
+        _configured_limits = limits
+    return _configured_limits
+
+
+def destination(url):
+    """The limiter key for ``url``: scheme, host and path without query or fragment."""
+    parts = urllib.parse.urlsplit(url)
+    return urllib.parse.urlunsplit((parts.scheme, parts.netloc, parts.path, '', '')).rstrip('/')
+
+
+def limits_for(url):
+    """Limit settings for ``url``: exact destination match first, then host."""
+    limits = configured_limits()
+    dest = destination(url)
+    if dest in limits:
+        return limits[dest]
+    host = urllib.parse.urlsplit(url).hostname or ''
+    return limits.get(host, UNLIMITED)
+
+
+def limiter_for(url):
+    """Return the shared limiter for ``url``'s destination, creating it on first use."""
+    dest = destination(url)
+    with _limiters_lock:
+        limiter = _limiters.get(dest)
+        if limiter is None:
+            settings = limits_for(url)
+            limiter = _limiters[dest] = Limiter(
+                dest,
+                rate=settings.get('rate', 0),
+                burst=settings.get('burst'),
+                concurrency=settings.get('concurrency', 0),
+                max_wait=settings.get('max_wait', DEFAULT_MAX_WAIT_SECONDS),
+            )
+        return limiter
+
+
+def limiter_stats():
+    """Counters for every destination that has been called in this process."""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.snapshot() for limiter in limiters}
+
+
+def limiter_gauges():
+    """In-flight and waiting calls per host, for the metrics endpoint."""
+    per_host = {}
+    for name, snapshot in limiter_stats().items():
+        totals = per_host.setdefault(host_of(name), [0, 0])
+        totals[0] += snapshot['in_flight']
+        totals[1] += snapshot['waiting']
+    gauges = []
+    for host, (in_flight, waiting) in per_host.items():
+        gauges.append(('webhook_outbound_in_flight', {'host': host}, in_flight))
+        gauges.append(('webhook_outbound_waiting', {'host': host}, waiting))
+    return gauges
+
+
+register_collector(limiter_gauges)
+
+
+def record_call(url, elapsed_seconds, ok=True, error=None):
+    """Feed one finished call into the latency tracker and the outbound metrics."""
+    record_latency(url, elapsed_seconds, ok)
+    host = host_of(url)
+    observe('webhook_outbound_request_duration_seconds', elapsed_seconds, host=host)
+    if error:
+        inc('webhook_outbound_errors_total', host=host, kind=error)
+
+
+def retry_after_seconds(error, default=1.0):
+    """Seconds to wait from a 429's ``Retry-After`` header (delta-seconds form only)."""
+    value = error.headers.get('Retry-After') if error.headers else None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return default
+
+
+@contextmanager
+def open_url(req, timeout, context=None, deadline=None):
+    """Drop-in for ``urllib.request.urlopen(req, timeout=..., context=...)`` under the destination limit.
+
+    Use as ``with open_url(req, timeout=10) as response:``. ``req`` may be a
+    URL string or a ``urllib.request.Request``. With a ``deadline``
+    (``api._lib.deadline.Deadline``) the timeout and any queueing wait are
+    bounded by the request's remaining budget, down to ``MIN_TIMEOUT_SECONDS``.
+    """
+    url = req.full_url if isinstance(req, urllib.request.Request) else req
+    limiter = limiter_for(url)
+    kwargs = {}
+    if context is not None:
+        kwargs['context'] = context
+
+    for attempt in (1, 2):
+        # Both keep the deadline's floor, so a spent budget still queues briefly rather than failing at once
+        with limiter.slot(timeout_for(deadline, limiter.max_wait)):
+            kwargs['timeout'] = timeout_for(deadline, timeout)
+            started = time.monotonic()
+            try:
+                response = urllib.request.urlopen(req, **kwargs)
+            except urllib.error.HTTPError as e:
+                # The host answered, so this still counts as an observed latency
+                record_call(url, time.monotonic() - started, error=f'http_{e.code}')
+                if e.code != 429:
+                    raise
+                limiter.count('throttled')
+                delay = retry_after_seconds(e)
+                out_of_budget = deadline is not None and not deadline.has(delay + 1.0)
+                if attempt == 2 or delay > limiter.max_wait or out_of_budget:
+                    raise
+                print(f"[OUTBOUND] 429 from {limiter.name}, retrying in {delay:.1f}s")
+                limiter.count('retried')
+                e.close()
+            except Exception as e:
+                record_call(url, time.monotonic() - started, ok=False, error=type(e).__name__)
+                raise
+            else:
+                ok = False
+                try:
+                    with response:
+                        yield response
+                    ok = True
+                finally:
+                    record_call(url, time.monotonic() - started, ok, error=None if ok else 'read')
+                return
+        time.sleep(delay)
@@ -0,0 +1,94 @@
+"""
+Per-client call_analyzed pipelines (extract -> tech lookup -> sheet write).
+
+Each entry wraps the functions the client's handler already uses, so offline
+tools (backfill, reconciliation) push calls through exactly the same code as
+the live webhook. The entries come from the tenant registry
+(``tenants.json``). Handler modules are imported lazily so a tool that only
+touches one client does not import the rest.
+
+Only the data path is replayed: the Retell re-fetch in
+``ensure_complete_data`` (which sleeps between attempts) and Pacific
+Western's notification emails are live-webhook concerns and are skipped.
+"""
+import importlib
+
+from api._lib.projection import project
+from api._lib.records import TechContact
+from api._lib.tenants import tenants
+
+
+class Pipeline:
+    """How one client turns a Retell call object into a sheet row."""
+
+    def __init__(self, client, module_name, sink_env, extract, lookup=None, send=None):
+        self.client = client
+        self.module_name = module_name
+        self.sink_env = sink_env
+        self._extract = extract
+        self._lookup = lookup
+        self._send = send
+
+    @property
+    def module(self):
+        return importlib.import_module(self.module_name)
+
+    def project(self, call_data):
+        """Trim ``call_data`` to the handler's ``CALL_FIELDS``, as the live webhook does."""
+        return project(call_data, getattr(self.module, 'CALL_FIELDS', None))
+
+    def extract(self, call_data):
+        """Run the client's ``extract_variables_v*``."""
+        return getattr(self.module, self._extract)(call_data)
+
+    def lookup_key(self, extracted):
+        """Cache key for the tech lookup: calls with the same key get the same on-call tech."""
+        if self._lookup is None:
+            return None
+        by_type = self._lookup[1]
+        return (self.client, extracted.get('emergencyType', '') if by_type else '')
+
+    def lookup_tech(self, extracted):
+        """Resolve the on-call tech the way the live handler does."""
+        if self._lookup is None:
+            return TechContact()
+        func_name, by_type = self._lookup
+        func = getattr(self.module, func_name)
+        tech = func(extracted.get('emergencyType', '')) if by_type else func()
+        return tech if isinstance(tech, TechContact) else TechContact()
+
+    def send(self, call_data, extracted, tech_data):
+        """Write the row with the client's ``send_to_google_sheets_v*``. Returns True on success."""
+        call_summary = call_data.get('call_analysis', {}).get('call_summary', '')
+        func = getattr(self.module, self._send)
+        if self._lookup is None:
+            return func(call_data, extracted, call_summary)
+        return func(call_data, extracted, call_summary, tech_data)
+
+
+def build_pipelines():
+    """client -> Pipeline for every tenant in the registry that declares its pipeline functions."""
+    pipelines = {}
+    for tenant in tenants().values():
+        spec = tenant.pipeline
+        if not spec.get('extract') or not spec.get('send'):
+            continue
+        # Without a lookup (EliteFire) the tech is resolved inside the send function
+        lookup = (spec['lookup'], spec.get('lookup_by_type', False)) if spec.get('lookup') else None
+        pipelines[tenant.key] = Pipeline(
+            tenant.key, tenant.module, tenant.sink_env,
+            extract=spec['extract'], lookup=lookup, send=spec['send'],
+        )
+    return pipelines
+
+
+# client -> Pipeline. Client names match the ``?client=`` values of api/webhook.py.
+PIPELINES = build_pipelines()
+
+
+def get_pipeline(client):
+    """Return the pipeline for ``client`` or raise KeyError listing the valid names."""
+    try:
+        return PIPELINES[client]
+    except KeyError:
+        raise KeyError(f"Unknown client '{client}', expected one of: {', '.join(sorted(PIPELINES))}")
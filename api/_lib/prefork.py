@@ -0,0 +1,207 @@
+"""
+Pre-fork multi-process mode for the self-hosted server.
+
+One asyncio process is still GIL-bound for JSON parsing and extraction on
+large transcripts. This supervisor forks N workers that each bind their own
+listening socket on the same port with ``SO_REUSEPORT``, so the kernel spreads
+connections across all cores.
+
+The supervisor:
+- restarts workers that exit unexpectedly (with a short backoff so a crash
+  loop does not spin),
+- forwards SIGTERM/SIGINT so every worker drains gracefully,
+- aggregates per-worker request counters published to ``--stats-dir``
+  (served by any worker at ``GET /api/workers``).
+
+Dedup state stays consistent across workers because the handlers serialize
+their ``/tmp`` state files with ``api._lib.filestate.file_lock``.
+
+Usage:
+    python -m api._lib.prefork --port 8000 --workers 4
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+from api._lib.filestate import read_json, write_json_atomic
+from api._lib.server import (
+    DEFAULT_DRAIN_SECONDS,
+    DEFAULT_WORKER_THREADS,
+    WebhookServer,
+    merge_stats,
+    read_aggregate_stats,
+)
+
+RESTART_BACKOFF_SECONDS = 1.0
+AGGREGATE_INTERVAL_SECONDS = 5.0
+
+
+def bind_reuseport(host, port, backlog=1024):
+    """Create a listening socket that other workers can bind to the same port."""
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        raise RuntimeError('SO_REUSEPORT is not available on this platform')
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+def run_worker(host, port, threads, drain_seconds, stats_dir):
+    """Entry point of a forked worker. Never returns."""
+    exit_code = 0
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        sock = bind_reuseport(host, port)
+        server = WebhookServer(worker_threads=threads, drain_seconds=drain_seconds, stats_dir=stats_dir)
+        asyncio.run(server.serve(sock=sock))
+    except Exception as e:
+        print(f"[PREFORK] Worker {os.getpid()} crashed: {e}")
+        exit_code = 1
+    finally:
+        sys.stdout.flush()
+        os._exit(exit_code)
+
+
+class Supervisor:
+    """Forks, watches and restarts server workers."""
+
+    def __init__(self, host, port, workers, threads=DEFAULT_WORKER_THREADS,
+                 drain_seconds=DEFAULT_DRAIN_SECONDS, stats_dir=None):
+        self.host = host
+        self.port = port
+        self.worker_count = workers
+        self.threads = threads
+        self.drain_seconds = drain_seconds
+        self.stats_dir = stats_dir or tempfile.mkdtemp(prefix='webhook-workers-')
+        self.workers = {}
+        self.stopping = False
+        self.restarts = 0
+
+    def spawn(self):
+        """Fork one worker and remember its pid."""
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            run_worker(self.host, self.port, self.threads, self.drain_seconds, self.stats_dir)
+        self.workers[pid] = time.time()
+        print(f"[PREFORK] Started worker {pid}")
+        return pid
+
+    def retire(self, pid):
+        """Fold a dead worker's last published counters into retired.json."""
+        worker_file = os.path.join(self.stats_dir, f'worker-{pid}.json')
+        snapshot = read_json(worker_file, None)
+        if snapshot:
+            snapshot['in_flight'] = 0
+            # Gauges describe a live process; a dead worker's counters and histograms still count
+            snapshot.get('metrics', {}).pop('gauges', None)
+            retired_file = os.path.join(self.stats_dir, 'retired.json')
+            write_json_atomic(retired_file, merge_stats(read_json(retired_file, {}), snapshot))
+        try:
+            os.unlink(worker_file)
+        except OSError:
+            pass
+
+    def reap(self):
+        """Collect exited workers; restart them unless we are shutting down."""
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.workers.clear()
+                return
+            if pid == 0:
+                return
+            started_at = self.workers.pop(pid, None)
+            if started_at is None:
+                continue
+            self.retire(pid)
+            if self.stopping:
+                continue
+            code = os.waitstatus_to_exitcode(status) if hasattr(os, 'waitstatus_to_exitcode') else status
+            print(f"[PREFORK] Worker {pid} exited with {code}, restarting")
+            if time.time() - started_at < RESTART_BACKOFF_SECONDS:
+                time.sleep(RESTART_BACKOFF_SECONDS)
+            self.restarts += 1
+            self.spawn()
+
+    def request_stop(self, signum, frame):
+        if not self.stopping:
+            print(f"[PREFORK] Signal {signum} received, stopping {len(self.workers)} workers")
+            self.stopping = True
+            for pid in list(self.workers):
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+    def log_aggregate(self):
+        stats = read_aggregate_stats(self.stats_dir)
+        totals = stats['totals']
+        print(f"[PREFORK] {stats['workers']} workers, {totals.get('requests', 0)} requests, "
+              f"{totals.get('in_flight', 0)} in flight, {totals.get('errors', 0)} errors, "
+              f"{self.restarts} restarts")
+
+    def run(self):
+        """Spawn workers and supervise them until SIGTERM/SIGINT."""
+        # Fail fast in the parent if the port cannot be shared
+        bind_reuseport(self.host, self.port).close()
+        print(f"[PREFORK] Supervisor {os.getpid()} on {self.host}:{self.port}, stats in {self.stats_dir}")
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+        for _ in range(self.worker_count):
+            self.spawn()
+
+        last_report = time.time()
+        deadline = None
+        while self.workers:
+            self.reap()
+            if self.stopping:
+                deadline = deadline or time.time() + self.drain_seconds + 5
+                if time.time() > deadline:
+                    for pid in list(self.workers):
+                        print(f"[PREFORK] Worker {pid} did not drain in time, killing")
+                        try:
+                            os.kill(pid, signal.SIGKILL)
+                        except ProcessLookupError:
+                            pass
+                    deadline = time.time() + 5
+            elif time.time() - last_report >= AGGREGATE_INTERVAL_SECONDS:
+                last_report = time.time()
+                self.log_aggregate()
+            time.sleep(0.2)
+        self.log_aggregate()
+        print("[PREFORK] All workers stopped")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve all webhook handlers from N pre-forked workers.')
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', '8000')))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('SERVER_WORKERS', '0')) or os.cpu_count() or 1,
+                        help='Worker processes (default: one per CPU)')
+    parser.add_argument('--threads', type=int, default=DEFAULT_WORKER_THREADS,
+                        help='Handler threads per worker')
+    parser.add_argument('--drain-seconds', type=float, default=DEFAULT_DRAIN_SECONDS)
+    parser.add_argument('--stats-dir', default=os.environ.get('SERVER_STATS_DIR'),
+                        help='Directory where workers publish their counters')
+    args = parser.parse_args(argv)
+
+    if args.stats_dir:
+        os.makedirs(args.stats_dir, exist_ok=True)
+    Supervisor(args.host, args.port, args.workers, threads=args.threads,
+               drain_seconds=args.drain_seconds, stats_dir=args.stats_dir).run()
+
+
+if __name__ == '__main__':
+    main()
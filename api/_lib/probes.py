@@ -0,0 +1,131 @@
+"""
+Dependency probes for ``GET /api/health?deep=1``.
+
+Every configured dependency is probed concurrently with a short timeout:
+
+- every tenant's Apps Script web app (its ``sink_env`` URL) with a
+  ``HEAD``, which reaches the deployment without writing a row,
+- the tenants' on-call assignment APIs with the same ``GET`` the handlers make,
+- SendGrid's ``/v3/scopes`` with ``SENDGRID_API_KEY``, which checks the key,
+- the Retell API's ``/list-agents`` with ``RETELL_API_KEY``.
+
+A dependency is ``ok``, ``down`` (error, timeout, or an HTTP status that
+means it will not work, such as 401 or 404) or ``unconfigured``. The report
+is degraded when anything configured is down or a required URL is unset.
+
+The report is cached for ``HEALTH_CACHE_SECONDS`` (default 10). Concurrent
+callers wait for the probe run in progress instead of starting their own, so
+a burst of monitoring checks costs one round of probes. Probes call
+``urlopen`` directly rather than ``open_url``: they should not use up the
+outbound limits or feed the learned timeouts.
+"""
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+
+from api._lib.tenants import tenants
+
+PROBE_TIMEOUT_SECONDS = float(os.environ.get('HEALTH_PROBE_TIMEOUT_SECONDS', '3'))
+CACHE_SECONDS = float(os.environ.get('HEALTH_CACHE_SECONDS', '10'))
+
+SENDGRID_URL = 'https://api.sendgrid.com/v3/scopes'
+RETELL_URL = 'https://api.retellai.com/list-agents'
+
+
+class Probe:
+    """One dependency check: a request whose answer says whether the dependency is usable."""
+
+    def __init__(self, name, url, method='GET', headers=None, required=True, accept=()):
+        self.name = name
+        self.url = url
+        self.method = method
+        self.headers = headers or {}
+        self.required = required
+        # Error statuses that still prove the dependency is there (e.g. 405 for HEAD)
+        self.accept = tuple(accept)
+
+    def run(self, timeout=PROBE_TIMEOUT_SECONDS):
+        if not self.url:
+            return {"status": "unconfigured", "required": self.required}
+        req = urllib.request.Request(self.url, headers=self.headers, method=self.method)
+        started = time.monotonic()
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as response:
+                code = response.status
+            result = {"status": "ok", "http_status": code}
+        except urllib.error.HTTPError as e:
+            e.close()
+            result = {"status": "ok" if e.code in self.accept else "down", "http_status": e.code}
+        except Exception as e:
+            result = {"status": "down", "error": f"{type(e).__name__}: {e}"}
+        result["latency_ms"] = round((time.monotonic() - started) * 1000, 1)
+        result["required"] = self.required
+        return result
+
+
+def configured_probes():
+    """Probes for every dependency, built from the current environment."""
+    probes = []
+    assignment_apis = {}
+    for tenant in tenants().values():
+        probes.append(Probe(f'{tenant.key}_sheet', tenant.sink_url, method='HEAD', required=tenant.required, accept=(405,)))
+        for kind, url in tenant.tech_apis:
+            # Tenants sharing an assignment API share its probe
+            assignment_apis.setdefault(url, f"{tenant.key}_{kind.lower().replace(' ', '_')}_api")
+    for url, name in assignment_apis.items():
+        probes.append(Probe(name, url))
+    sendgrid_key = os.environ.get('SENDGRID_API_KEY', '')
+    probes.append(Probe('sendgrid', SENDGRID_URL if sendgrid_key else '', required=False,
+                        headers={'Authorization': f'Bearer {sendgrid_key}'}))
+    retell_key = os.environ.get('RETELL_API_KEY', '')
+    probes.append(Probe('retell', RETELL_URL if retell_key else '', required=False,
+                        headers={'Authorization': f'Bearer {retell_key}'}))
+    return probes
+
+
+def run_probes(probes, timeout=PROBE_TIMEOUT_SECONDS):
+    """Run ``probes`` concurrently; a probe still running after the timeout is reported down."""
+    results = {}
+    pool = ThreadPoolExecutor(max_workers=max(1, len(probes)), thread_name_prefix='probe')
+    futures = {pool.submit(probe.run, timeout): probe for probe in probes}
+    done, _ = wait(futures, timeout=timeout + 1.0)
+    # Don't wait for a probe stuck past its timeout (e.g. in DNS); it finishes in the background
+    pool.shutdown(wait=False)
+    for future, probe in futures.items():
+        if future in done:
+            results[probe.name] = future.result()
+        else:
+            results[probe.name] = {"status": "down", "error": "probe timed out", "required": probe.required}
+    return results
+
+
+def is_degraded(results):
+    return any(
+        r["status"] == "down" or (r["status"] == "unconfigured" and r.get("required"))
+        for r in results.values()
+    )
+
+
+_lock = threading.Lock()
+_cached = None
+_cached_at = 0.0
+
+
+def deep_health(max_age=CACHE_SECONDS):
+    """The dependency report, probing at most once per ``max_age`` seconds."""
+    global _cached, _cached_at
+    with _lock:
+        if _cached is not None and time.monotonic() - _cached_at < max_age:
+            return dict(_cached, cached=True)
+        results = run_probes(configured_probes())
+        _cached = {
+            "status": "degraded" if is_degraded(results) else "healthy",
+            "checked_at": datetime.now().isoformat(),
+            "dependencies": results,
+        }
+        _cached_at = time.monotonic()
+        return dict(_cached, cached=False)
@@ -0,0 +1,272 @@
+"""
+Opt-in profiling of single webhook requests.
+
+When one client's latency spikes, the metrics say which stage is slow but
+not where the CPU or memory goes. A handler's ``do_POST`` decorated with
+``profiled(client)`` runs under ``cProfile`` and/or ``tracemalloc`` when the
+request is selected by one of:
+
+- ``PROFILE_REQUESTS=1``: every request,
+- ``PROFILE_SAMPLE_RATE``: that fraction of requests (e.g. ``0.01``),
+- an ``X-Profile-Request`` header signed with ``PROFILE_TOKEN``:
+  ``<unix time>:<hex HMAC-SHA256(PROFILE_TOKEN, unix time)>``, valid for
+  five minutes (``python -m api._lib.profiling sign`` prints one).
+
+``PROFILE_KIND`` is ``cpu`` (default), ``memory`` or ``both``. Artifacts go to
+``PROFILE_DIR`` (default ``/tmp/profiles``) as
+``<time>-<client>-<call_id>.prof`` (pstats, for ``snakeviz`` or
+``python -m pstats``) plus a readable ``.txt`` summary; only the newest
+``PROFILE_KEEP`` (default 50) requests are kept. ``GET /api/profiles`` lists
+and serves them to callers with ``Authorization: Bearer <PROFILE_TOKEN>``.
+
+One request is profiled at a time per process (cProfile and tracemalloc are
+process-wide); a request selected while another is being profiled runs
+normally, as does one the handler will refuse for its Content-Length. The
+body is left to the handler's own bounded read; the artifact's call_id is
+sniffed afterwards from the first bytes it read. Memory figures include whatever other threads allocated meanwhile.
+"""
+import cProfile
+import functools
+import hashlib
+import hmac
+import io
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+
+from api._lib.body import check_body_size
+from api._lib.metrics import inc
+from api._lib.sniff import CALL_ID_LIMIT, sniff_call_id
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/tmp/profiles')
+PROFILE_KIND = os.environ.get('PROFILE_KIND', 'cpu').strip().lower()
+KEEP = int(os.environ.get('PROFILE_KEEP', '50'))
+HEADER = 'X-Profile-Request'
+SIGNATURE_MAX_AGE_SECONDS = 300
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 25
+
+# <time>-<client>-<call_id>.<ext>; call_id is '-' when the body has none
+ARTIFACT_RE = re.compile(r'^\d{8}T\d{6}\d{3}-[a-z0-9_]+-[A-Za-z0-9_\-]{1,128}\.(prof|txt)$')
+
+_busy = threading.Lock()
+
+
+def profile_token():
+    return os.environ.get('PROFILE_TOKEN', '')
+
+
+def sign(timestamp=None, token=None):
+    """An ``X-Profile-Request`` header value for ``timestamp`` (default now)."""
+    timestamp = str(int(time.time() if timestamp is None else timestamp))
+    digest = hmac.new((token or profile_token()).encode(), timestamp.encode(), hashlib.sha256).hexdigest()
+    return f'{timestamp}:{digest}'
+
+
+def header_requested(headers):
+    """True when ``headers`` carry a fresh ``X-Profile-Request`` signed with ``PROFILE_TOKEN``."""
+    token = profile_token()
+    value = (headers.get(HEADER, '') or '') if (token and headers is not None) else ''
+    timestamp = value.partition(':')[0]
+    if not timestamp.isdigit() or abs(time.time() - int(timestamp)) > SIGNATURE_MAX_AGE_SECONDS:
+        return False
+    return hmac.compare_digest(sign(timestamp, token).encode(), value.encode())
+
+
+def selected(headers):
+    if os.environ.get('PROFILE_REQUESTS', '').strip().lower() in ('1', 'true', 'yes'):
+        return True
+    try:
+        rate = float(os.environ.get('PROFILE_SAMPLE_RATE', '0') or 0)
+    except ValueError:
+        rate = 0.0
+    if rate > 0 and random.random() < rate:
+        return True
+    return header_requested(headers)
+
+
+def artifact_base(client, call_id):
+    stamp = time.strftime('%Y%m%dT%H%M%S', time.gmtime()) + f'{int(time.time() * 1000) % 1000:03d}'
+    call_id = re.sub(r'[^A-Za-z0-9_\-]', '_', call_id or '-')[:128]
+    return os.path.join(PROFILE_DIR, f'{stamp}-{client}-{call_id}')
+
+
+def write_artifacts(base, profile, snapshot, peak, elapsed, label):
+    """Write ``base.prof`` (CPU) and ``base.txt`` (summary of both); returns the paths written."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    written = []
+    summary = io.StringIO()
+    summary.write(f'{label}\nwall time: {elapsed * 1000:.1f} ms\n\n')
+    if profile is not None:
+        profile.dump_stats(base + '.prof')
+        written.append(base + '.prof')
+        stats = pstats.Stats(profile, stream=summary)
+        stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+    if snapshot is not None:
+        summary.write(f'tracemalloc peak: {peak / 1024:.1f} KiB\n')
+        summary.write(f'top {TOP_ALLOCATIONS} allocation sites still held at the end of the request:\n')
+        for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]:
+            summary.write(f'  {stat}\n')
+    with open(base + '.txt', 'w') as f:
+        f.write(summary.getvalue())
+    written.append(base + '.txt')
+    prune()
+    return written
+
+
+def prune(keep=None):
+    """Delete all but the newest ``keep`` profiled requests."""
+    keep = KEEP if keep is None else keep
+    bases = sorted({name.rsplit('.', 1)[0] for name in list_artifacts()}, reverse=True)
+    for base in bases[keep:]:
+        for ext in ('.prof', '.txt'):
+            try:
+                os.unlink(os.path.join(PROFILE_DIR, base + ext))
+            except FileNotFoundError:
+                pass
+
+
+def list_artifacts():
+    try:
+        return sorted((n for n in os.listdir(PROFILE_DIR) if ARTIFACT_RE.match(n)), reverse=True)
+    except FileNotFoundError:
+        return []
+
+
+def recent_profiles():
+    """Newest-first descriptions of the artifacts in ``PROFILE_DIR``."""
+    profiles = []
+    for name in list_artifacts():
+        stamp, client, call_id = name.rsplit('.', 1)[0].split('-', 2)
+        try:
+            size = os.path.getsize(os.path.join(PROFILE_DIR, name))
+        except FileNotFoundError:
+            continue
+        profiles.append({'name': name, 'client': client, 'call_id': call_id, 'time': stamp, 'bytes': size})
+    return profiles
+
+
+def artifact_path(name):
+    """Path of artifact ``name`` in ``PROFILE_DIR``, or None when it is not one."""
+    if not ARTIFACT_RE.match(name or ''):
+        return None
+    path = os.path.join(PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+def authorized(headers):
+    """True when ``headers`` carry ``Authorization: Bearer <PROFILE_TOKEN>``."""
+    token = profile_token()
+    supplied = headers.get('Authorization', '') or ''
+    if not token or not supplied.startswith('Bearer '):
+        return False
+    return hmac.compare_digest(supplied[len('Bearer '):].encode('utf-8', 'replace'), token.encode('utf-8'))
+
+
+class PrefixRecorder:
+    """Wraps a handler's ``rfile`` and keeps the first ``limit`` bytes read through it."""
+
+    def __init__(self, rfile, limit=CALL_ID_LIMIT):
+        self.rfile = rfile
+        self.limit = limit
+        self.prefix = bytearray()
+
+    def _keep(self, data):
+        if data and len(self.prefix) < self.limit:
+            self.prefix += data[:self.limit - len(self.prefix)]
+
+    def readinto(self, buffer):
+        read = self.rfile.readinto(buffer)
+        if read:
+            with memoryview(buffer) as view:
+                self._keep(view[:read])
+        return read
+
+    def read(self, size=-1):
+        data = self.rfile.read(size)
+        self._keep(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.rfile, name)
+
+
+def run_profiled(client, call_id, func, *args, **kwargs):
+    """Run ``func`` under the configured profilers and write its artifacts.
+
+    ``call_id`` may be a callable, evaluated once ``func`` has returned.
+    """
+    cpu = PROFILE_KIND in ('cpu', 'both')
+    memory = PROFILE_KIND in ('memory', 'both')
+    profile = cProfile.Profile() if cpu else None
+    started_tracing = memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    elif memory:
+        tracemalloc.reset_peak()
+    started = time.perf_counter()
+    try:
+        if profile is not None:
+            return profile.runcall(func, *args, **kwargs)
+        return func(*args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - started
+        snapshot, peak = None, 0
+        if memory:
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+        try:
+            if callable(call_id):
+                call_id = call_id()
+            paths = write_artifacts(artifact_base(client, call_id), profile, snapshot, peak, elapsed,
+                                    f'{client} call_id={call_id or "-"} kind={PROFILE_KIND}')
+            inc('webhook_profiles_total', client=client)
+            print(f"[PROFILE] {client} {call_id}: {elapsed * 1000:.1f} ms, wrote {', '.join(paths)}")
+        except Exception as e:
+            print(f"[PROFILE] Could not write profile: {e}")
+
+
+def profiled(client):
+    """Decorator for a handler's ``do_POST``: profile the request when it is selected."""
+    def decorate(do_post):
+        @functools.wraps(do_post)
+        def wrapper(self):
+            if not selected(self.headers) or check_body_size(self.headers) is not None:
+                # A refused body is answered before anything worth profiling happens
+                return do_post(self)
+            if not _busy.acquire(blocking=False):
+                return do_post(self)
+            rfile = self.rfile
+            try:
+                # The handler reads the body itself; keep what it read first to tag the artifact
+                recorder = self.rfile = PrefixRecorder(rfile)
+                return run_profiled(client, lambda: sniff_call_id(recorder.prefix), do_post, self)
+            finally:
+                self.rfile = rfile
+                _busy.release()
+        return wrapper
+    return decorate
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['sign']:
+        if not profile_token():
+            print('PROFILE_TOKEN must be set', file=sys.stderr)
+            return 1
+        print(f'{HEADER}: {sign()}')
+        return 0
+    for name in list_artifacts():
+        print(os.path.join(PROFILE_DIR, name))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,56 @@
+"""
+Keep only the parts of a Retell call object a pipeline actually reads.
+
+A ``call_analyzed`` payload carries ``transcript_object`` (word-level
+timestamps), every utterance in ``transcript_with_tool_calls``, latency
+stats, cost breakdowns and more, while extraction and the sheet row read a
+handful of fields. Each handler module declares ``CALL_FIELDS`` with
+``call_fields()``, and ``do_POST`` projects the call right after parsing, so
+the heavy subtrees can be garbage-collected before any slow outbound I/O.
+
+A rule is ``True`` (keep the value as is) or a function that returns the
+trimmed value, e.g. ``keep_tool_calls`` or ``keep_keys('combined_cost')``.
+"""
+
+# What extraction Methods 3 and 4 read from transcript_with_tool_calls
+TOOL_CALL_ROLES = ('tool_call_invocation', 'tool_call_result')
+TOOL_CALL_KEYS = ('role', 'name', 'tool_call_id', 'content')
+
+
+def keep_tool_calls(entries):
+    """Only tool-call invocations and results, trimmed to the keys extraction reads."""
+    if not isinstance(entries, list):
+        return entries
+    return [
+        {key: entry[key] for key in TOOL_CALL_KEYS if key in entry}
+        for entry in entries
+        if isinstance(entry, dict) and entry.get('role') in TOOL_CALL_ROLES
+    ]
+
+
+def keep_keys(*keys):
+    """Rule keeping only ``keys`` of a nested dict."""
+    def rule(value):
+        if not isinstance(value, dict):
+            return value
+        return {key: value[key] for key in keys if key in value}
+    return rule
+
+
+def call_fields(*keys, **rules):
+    """Build a projection spec: plain ``keys`` are kept whole, ``rules`` trim their field."""
+    spec = dict.fromkeys(keys, True)
+    spec.update(rules)
+    return spec
+
+
+def project(call_data, fields):
+    """A new dict with only the fields in ``fields``; anything else is returned untouched."""
+    if not isinstance(call_data, dict) or not fields:
+        return call_data
+    projected = {}
+    for key, rule in fields.items():
+        if key in call_data:
+            value = call_data[key]
+            projected[key] = value if rule is True else rule(value)
+    return projected
@@ -0,0 +1,236 @@
+"""
+Find analyzed Retell calls that never made it through the webhook.
+
+Pages through Retell's list-calls API for a time window, compares the calls
+against what the client has already processed, and writes only the missing
+``call_analyzed`` records as webhook bodies (JSONL) that ``api._lib.backfill``
+can replay. ``--process`` runs that backfill straight away.
+
+The window is split into slices that are paged concurrently; every Retell
+request (list pages and ``get_call`` re-fetches of calls whose list entry has
+no analysis yet) goes through one shared token bucket. Re-fetched calls are
+kept whole; backfill trims them to the client's own ``CALL_FIELDS``.
+
+"Already processed" is the union of:
+- the client's completion markers (``api._lib.completions``), recorded only
+  once a row was written, by the client's handler, the ``/api/webhook``
+  router or backfill: the shared store when ``DEDUP_BACKEND=redis``, plus
+  the local file, which only keeps the last 24h / 1000 calls and lives on
+  the instance that wrote the row,
+- any ``--processed`` files of call_ids, e.g. backfill checkpoints.
+
+Dedup claims are not used: a call is claimed before its sheet write, so a
+call whose write failed would never show up as missing.
+
+Usage:
+    RETELL_API_KEY=... python -m api._lib.reconcile --client braconier \
+        --agent-id agent_123 --hours 24 --out missing.jsonl
+"""
+import argparse
+import os
+import ssl
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from api._lib.backfill import Backfill, Checkpoint
+from api._lib.codec import dumps, loads
+from api._lib.completions import completions_for
+from api._lib.pipelines import PIPELINES, get_pipeline
+from api._lib.ratelimit import TokenBucket
+
+LIST_CALLS_URL = 'https://api.retellai.com/v2/list-calls'
+GET_CALL_URL = 'https://api.retellai.com/v2/get-call/'
+PAGE_SIZE = 1000
+MAX_RETRIES = 3
+
+
+def list_calls_page(api_key, lower_ms, upper_ms, agent_ids=None, pagination_key=None, limit=PAGE_SIZE, timeout=15):
+    """Fetch one page of calls started in [lower_ms, upper_ms], oldest first."""
+    filter_criteria = {'start_timestamp': {'lower_threshold': lower_ms, 'upper_threshold': upper_ms}}
+    if agent_ids:
+        filter_criteria['agent_id'] = list(agent_ids)
+    payload = {'filter_criteria': filter_criteria, 'sort_order': 'ascending', 'limit': limit}
+    if pagination_key:
+        payload['pagination_key'] = pagination_key
+
+    req = urllib.request.Request(
+        LIST_CALLS_URL,
+        data=dumps(payload),
+        headers={
+            'Authorization': f'Bearer {api_key}',
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+        },
+        method='POST'
+    )
+    ctx = ssl.create_default_context()
+    with urllib.request.urlopen(req, timeout=timeout, context=ctx) as resp:
+        data = loads(resp.read())
+    return data if isinstance(data, list) else []
+
+
+def get_call(api_key, call_id, timeout=15):
+    """Fetch one full call object, unprojected, so every client's pipeline finds its fields."""
+    req = urllib.request.Request(
+        GET_CALL_URL + call_id,
+        headers={'Authorization': f'Bearer {api_key}', 'Accept': 'application/json'},
+    )
+    ctx = ssl.create_default_context()
+    with urllib.request.urlopen(req, timeout=timeout, context=ctx) as resp:
+        return loads(resp.read())
+
+
+def with_retries(bucket, func, *args, **kwargs):
+    """Call ``func`` under the rate limit, backing off on 429/5xx responses."""
+    for attempt in range(1, MAX_RETRIES + 1):
+        bucket.acquire()
+        try:
+            return func(*args, **kwargs)
+        except urllib.error.HTTPError as e:
+            if attempt == MAX_RETRIES or (e.code != 429 and e.code < 500):
+                raise
+            retry_after = e.headers.get('Retry-After') if e.headers else None
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt
+            print(f"[RECONCILE] Retell returned {e.code}, retrying in {delay}s")
+            time.sleep(delay)
+
+
+def split_window(lower_ms, upper_ms, slices):
+    """Split [lower_ms, upper_ms] into ``slices`` contiguous, non-overlapping ranges."""
+    slices = max(1, slices)
+    step = max(1, (upper_ms - lower_ms) // slices)
+    bounds = []
+    start = lower_ms
+    while start <= upper_ms:
+        end = min(upper_ms, start + step - 1)
+        if len(bounds) == slices - 1:
+            end = upper_ms
+        bounds.append((start, end))
+        start = end + 1
+    return bounds
+
+
+def page_slice(api_key, bucket, lower_ms, upper_ms, agent_ids):
+    """Page through one slice of the window and return all its calls."""
+    calls = []
+    pagination_key = None
+    while True:
+        page = with_retries(bucket, list_calls_page, api_key, lower_ms, upper_ms,
+                            agent_ids=agent_ids, pagination_key=pagination_key)
+        calls.extend(page)
+        if len(page) < PAGE_SIZE:
+            return calls
+        pagination_key = page[-1].get('call_id')
+        if not pagination_key:
+            return calls
+
+
+def list_calls(api_key, lower_ms, upper_ms, agent_ids=None, slices=4, rate=5.0, bucket=None):
+    """List every call in the window, paging ``slices`` sub-windows concurrently."""
+    bucket = bucket or TokenBucket(rate)
+    windows = split_window(lower_ms, upper_ms, slices)
+    seen = set()
+    calls = []
+    with ThreadPoolExecutor(max_workers=len(windows), thread_name_prefix='reconcile') as pool:
+        for chunk in pool.map(lambda w: page_slice(api_key, bucket, w[0], w[1], agent_ids), windows):
+            for call in chunk:
+                call_id = call.get('call_id')
+                if call_id and call_id not in seen:
+                    seen.add(call_id)
+                    calls.append(call)
+    return calls
+
+
+def processed_call_ids(client, extra_files=()):
+    """call_ids whose row the client has written, from its completion markers and any extra id files."""
+    done = set(completions_for(client).call_ids())
+    for path in extra_files:
+        done.update(Checkpoint(path, read_only=True).done)
+    return done
+
+
+def needs_analysis_fetch(call):
+    """True when a listed call has ended but its analysis is missing from the list payload."""
+    return call.get('call_status') == 'ended' and not call.get('call_analysis')
+
+
+def find_missing(calls, processed, api_key, bucket, workers=4):
+    """Return full call objects for analyzed calls that are not in ``processed``."""
+    candidates = [c for c in calls if c.get('call_id') not in processed and c.get('call_status', 'ended') == 'ended']
+
+    def hydrate(call):
+        if not needs_analysis_fetch(call):
+            return call
+        try:
+            return with_retries(bucket, get_call, api_key, call['call_id'])
+        except Exception as e:
+            print(f"[RECONCILE] Could not fetch {call['call_id']}: {e}")
+            return call
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='reconcile-fetch') as pool:
+        hydrated = list(pool.map(hydrate, candidates))
+    return [c for c in hydrated if c.get('call_analysis')]
+
+
+def parse_time(value):
+    """Parse an ISO-8601 timestamp (local time when naive) into epoch milliseconds."""
+    return int(datetime.fromisoformat(value).timestamp() * 1000)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Enqueue analyzed Retell calls the webhook missed.')
+    parser.add_argument('--client', required=True, choices=sorted(PIPELINES))
+    parser.add_argument('--agent-id', action='append', default=[], help="Restrict to this client's agent(s)")
+    parser.add_argument('--since', help='Window start (ISO-8601)')
+    parser.add_argument('--until', help='Window end (ISO-8601, default now)')
+    parser.add_argument('--hours', type=float, default=24.0, help='Window length when --since is omitted')
+    parser.add_argument('--processed', action='append', default=[],
+                        help='File of already processed call_ids (one per line), e.g. a backfill checkpoint')
+    parser.add_argument('--slices', type=int, default=4, help='Sub-windows paged concurrently')
+    parser.add_argument('--rate', type=float, default=5.0, help='Retell requests per second')
+    parser.add_argument('--out', default='-', help='JSONL output of missing call_analyzed bodies (default stdout)')
+    parser.add_argument('--process', action='store_true', help='Run the missing calls through backfill right away')
+    args = parser.parse_args(argv)
+
+    api_key = os.environ.get('RETELL_API_KEY', '')
+    if not api_key:
+        parser.error('RETELL_API_KEY must be set')
+    if args.process and not args.out.endswith('.jsonl'):
+        parser.error('--process needs --out pointing at a .jsonl file')
+
+    upper_ms = parse_time(args.until) if args.until else int(time.time() * 1000)
+    lower_ms = parse_time(args.since) if args.since else upper_ms - int(timedelta(hours=args.hours).total_seconds() * 1000)
+
+    processed = processed_call_ids(args.client, args.processed)
+    pipeline = get_pipeline(args.client)
+    if not processed and not args.processed:
+        parser.error(f'No completion markers for {args.client}; pass --processed so every call is not re-sent')
+
+    bucket = TokenBucket(args.rate)
+    calls = list_calls(api_key, lower_ms, upper_ms, agent_ids=args.agent_id, slices=args.slices, bucket=bucket)
+    missing = find_missing(calls, processed, api_key, bucket)
+    print(f"[RECONCILE] {len(calls)} calls in window, {len(processed)} known processed, {len(missing)} missing",
+          file=sys.stderr)
+
+    out = sys.stdout.buffer if args.out == '-' else open(args.out, 'wb')
+    try:
+        for call in missing:
+            out.write(dumps({'event': 'call_analyzed', 'call': call}) + b'\n')
+    finally:
+        if out is sys.stdout.buffer:
+            out.flush()
+        else:
+            out.close()
+
+    if args.process and missing:
+        counts = Backfill(pipeline).run([args.out])
+        return 1 if counts['failed'] else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
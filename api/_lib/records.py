@@ -0,0 +1,265 @@
+"""
+Slotted record types for the values the call pipelines pass around.
+
+Extraction, tech lookup and the sheet write used to build the same dicts by
+hand: ``{'name': '', 'email': '', 'phone': ''}`` at every fallback branch, a
+7-key variables dict and a 20-odd-key ``sheet_data`` per handler. They are
+declared once here instead:
+
+- ``ExtractedVars``: the caller details the service pipelines extract
+  (``EliteFireVars`` and ``TripVars`` for the EliteFire and generic layouts),
+- ``TechContact``: an on-call technician, optionally flagged as a stale
+  snapshot,
+- ``SheetRow`` subclasses: one per Apps Script sheet layout, with the
+  constant columns as defaults.
+
+A type lists its ``FIELDS`` once. Instances keep them in ``__slots__`` (no
+per-instance ``__dict__``), and each type pre-encodes its JSON keys into one
+format string, so ``to_json()`` encodes the values and builds the document
+in a single pass, without an intermediate dict. Its bytes equal
+``json.dumps(record.to_dict()).encode()``, so sinks see the same payloads
+(with orjson installed, ``api._lib.codec`` encodes the dict instead).
+``to_row()`` gives the values in column order. Records also read like the
+dicts they replace (``rec['email']``, ``rec.get()``, ``rec.items()``, a dict
+``repr``), so extraction code and log lines keep working.
+"""
+import json
+from json.encoder import encode_basestring_ascii
+from operator import attrgetter
+
+from api._lib.codec import BACKEND, dumps, encode_default
+from api._lib.idempotency import IDEMPOTENCY_FIELD
+
+
+def encode_value(value):
+    """``value`` as ``json.dumps`` writes it inside an object."""
+    cls = value.__class__
+    if cls is str:
+        return encode_basestring_ascii(value)
+    if value is True:
+        return 'true'
+    if value is False:
+        return 'false'
+    if value is None:
+        return 'null'
+    if cls is int:
+        return int.__repr__(value)
+    return json.dumps(value, default=encode_default)
+
+
+class Record:
+    """Base for the slotted records: fixed field order, dict-style access and a JSON encoder."""
+
+    __slots__ = ()
+    FIELDS = ()
+    # Extra fields that are absent (not in to_dict()/to_json()) while None
+    OPTIONAL = ()
+    # Field -> default when not given; others default to ''
+    DEFAULTS = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.ALL_FIELDS = tuple(cls.FIELDS) + tuple(cls.OPTIONAL)
+        cls.FIELD_SET = frozenset(cls.ALL_FIELDS)
+        # '{"a": %s, "b": %s' for FIELDS; present OPTIONAL fields are appended after it
+        cls.JSON_TEMPLATE = '{' + ', '.join(
+            encode_basestring_ascii(name).replace('%', '%%') + ': %s' for name in cls.FIELDS)
+        cls.OPTIONAL_KEYS = tuple((name, encode_basestring_ascii(name) + ': ') for name in cls.OPTIONAL)
+        fields = tuple(cls.FIELDS)
+        # record -> tuple of FIELDS values (attrgetter returns a bare value for a single name)
+        cls.field_values = staticmethod(
+            attrgetter(*fields) if len(fields) > 1 else lambda record: tuple(getattr(record, n) for n in fields))
+
+    def __init__(self, *args, **values):
+        if len(args) > len(self.FIELDS):
+            raise TypeError(f'{type(self).__name__} takes at most {len(self.FIELDS)} positional values')
+        for name, value in zip(self.FIELDS, args):
+            values[name] = value
+        defaults = self.DEFAULTS
+        for name in self.FIELDS:
+            setattr(self, name, values.pop(name, defaults.get(name, '')))
+        for name in self.OPTIONAL:
+            setattr(self, name, values.pop(name, None))
+        if values:
+            raise TypeError(f"{type(self).__name__} has no field(s) {', '.join(values)}")
+
+    @classmethod
+    def from_mapping(cls, mapping, **values):
+        """A record from ``mapping``'s known fields (others ignored), overridden by ``values``."""
+        known = {k: v for k, v in mapping.items() if k in cls.FIELD_SET} if mapping else {}
+        known.update(values)
+        return cls(**known)
+
+    def _present(self):
+        for name in self.FIELDS:
+            yield name, getattr(self, name)
+        for name in self.OPTIONAL:
+            value = getattr(self, name)
+            if value is not None:
+                yield name, value
+
+    def to_dict(self):
+        return dict(self._present())
+
+    def to_row(self):
+        """Values in ``FIELDS`` order, for a positional sheet row."""
+        return list(self.field_values(self))
+
+    def to_json(self):
+        """UTF-8 JSON bytes, identical to ``json.dumps(self.to_dict()).encode()`` on the stdlib backend."""
+        if BACKEND != 'stdlib':
+            return dumps(self.to_dict())
+        text = self.JSON_TEMPLATE % tuple(map(encode_value, self.field_values(self)))
+        for name, key in self.OPTIONAL_KEYS:
+            value = getattr(self, name)
+            if value is not None:
+                text += ', ' + key + encode_value(value)
+        return (text + '}').encode()
+
+    def copy(self):
+        return type(self)(**self.to_dict())
+
+    # Dict-style access, so code written against the old dicts keeps working
+    def __getitem__(self, name):
+        if name not in self.FIELD_SET:
+            raise KeyError(name)
+        value = getattr(self, name)
+        # An unset OPTIONAL field is absent, as it is from to_dict()
+        if value is None and name in self.OPTIONAL:
+            raise KeyError(name)
+        return value
+
+    def __setitem__(self, name, value):
+        if name not in self.FIELD_SET:
+            raise KeyError(name)
+        setattr(self, name, value)
+
+    def get(self, name, default=None):
+        value = getattr(self, name, None) if name in self.FIELD_SET else None
+        if value is None and (name in self.OPTIONAL or name not in self.FIELD_SET):
+            return default
+        return value
+
+    def __contains__(self, name):
+        return name in self.FIELD_SET and (name not in self.OPTIONAL or getattr(self, name) is not None)
+
+    def keys(self):
+        return [name for name, _ in self._present()]
+
+    def values(self):
+        return [value for _, value in self._present()]
+
+    def items(self):
+        return list(self._present())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, dict)):
+            return self.to_dict() == dict(other.items())
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+class ExtractedVars(Record):
+    """Caller details extracted by the service pipelines (Braconier, Adaptive Climate, Pacific Western, router)."""
+
+    __slots__ = FIELDS = (
+        'fromNumber', 'customerName', 'serviceAddress', 'callSummary', 'email', 'isitEmergency', 'emergencyType',
+    )
+
+
+class EliteFireVars(Record):
+    """Caller details extracted by the EliteFire pipeline."""
+
+    __slots__ = FIELDS = ('fromNumber', 'customerName', 'serviceAddress', 'callSummary', 'email', 'recording_url')
+
+
+class TripVars(Record):
+    """Trip/facility variables extracted by the generic Sheets pipeline."""
+
+    __slots__ = FIELDS = (
+        'firstName', 'lastName', 'email', 'description', 'facilityName', 'doctorName', 'facilitynumber',
+        'pickupLoc', 'dropLocation', 'appointmentDate', 'tripdetails',
+    )
+
+
+class TechContact(Record):
+    """An on-call technician; ``stale``/``snapshot_at`` are set when it comes from an on-call snapshot."""
+
+    FIELDS = ('name', 'email', 'phone')
+    OPTIONAL = ('stale', 'snapshot_at')
+    __slots__ = FIELDS + OPTIONAL
+
+
+class SheetRow(Record):
+    """Base for the payloads POSTed to a client's Apps Script; one subclass per sheet layout."""
+
+    # Last in every row, and left out when the call has no call_id (so no key)
+    __slots__ = OPTIONAL = (IDEMPOTENCY_FIELD,)
+
+
+class ServiceSheetRow(SheetRow):
+    """Braconier's sheet, also written by the router (``/api/webhook``) for every client."""
+
+    __slots__ = FIELDS = (
+        'timestamp', 'call_id', 'agent_name', 'duration_ms', 'sentiment', 'successful', 'call_summary',
+        'from_number', 'customer_name', 'service_address', 'email', 'phone', 'is_emergency', 'emergency_type',
+        'transcript', 'make_call', 'response_call_id_1', 'response_call_id_2', 'response_call_id_3',
+        'call_decline_counter', 'last_call_time', 'is_email_sent', 'note',
+    )
+    # Columns the Apps Script owns: it places the calls and sends the emails
+    DEFAULTS = {
+        'duration_ms': 0, 'successful': False, 'make_call': True, 'call_decline_counter': 0, 'is_email_sent': False,
+    }
+
+
+class AdaptiveSheetRow(SheetRow):
+    """Adaptive Climate's sheet."""
+
+    __slots__ = FIELDS = (
+        'timestamp', 'call_id', 'agent_name', 'call_duration', 'user_sentiment', 'call_successful', 'call_summary',
+        'transcript', 'fromNumber', 'customerName', 'serviceAddress', 'callSummary', 'email', 'phone', 'techName',
+        'isitEmergency', 'emergencyType', 'start_timestamp',
+    )
+    DEFAULTS = {'call_duration': 0, 'call_successful': False}
+
+
+class PacificSheetRow(SheetRow):
+    """Pacific Western's sheet."""
+
+    __slots__ = FIELDS = (
+        'timestamp', 'call_id', 'agent_name', 'call_duration', 'user_sentiment', 'call_successful', 'call_summary',
+        'transcript', 'fromNumber', 'customerName', 'serviceAddress', 'callSummary', 'email', 'phone',
+        'isitEmergency', 'emergencyType', 'rateApproved', 'callType',
+    )
+    DEFAULTS = {'call_duration': 0, 'call_successful': False}
+
+
+class EliteFireSheetRow(SheetRow):
+    """EliteFire's sheet."""
+
+    __slots__ = FIELDS = (
+        'timestamp', 'call_id', 'agent_name', 'call_duration', 'call_cost', 'user_sentiment', 'call_successful',
+        'call_summary', 'fromNumber', 'customerName', 'serviceAddress', 'callSummary', 'email', 'recording_url',
+    )
+    DEFAULTS = {'call_duration': 0, 'call_cost': 0, 'call_successful': False}
+
+
+class TripSheetRow(SheetRow):
+    """The generic Sheets pipeline's trip/facility sheet."""
+
+    __slots__ = FIELDS = (
+        'timestamp', 'call_id', 'agent_name', 'call_duration', 'call_cost', 'user_sentiment', 'call_successful',
+        'call_summary', 'firstName', 'lastName', 'email', 'description', 'facilityName', 'doctorName',
+        'facilitynumber', 'pickupLoc', 'dropLocation', 'appointmentDate', 'tripdetails',
+    )
+    DEFAULTS = {'call_duration': 0, 'call_cost': 0, 'call_successful': False}
@@ -0,0 +1,419 @@
+"""
+Deterministic replay of captured webhooks through the handlers, with diffs.
+
+Before changing ``extract_variables_v3`` and friends, record what the
+current code does with a corpus, then check the change produces the same:
+
+    python -m api._lib.replay $CAPTURE_DIR --out baseline.jsonl
+    # ...edit...
+    python -m api._lib.replay $CAPTURE_DIR --baseline baseline.jsonl --out candidate.jsonl
+
+Every payload is run through its handler class (``run_handler``, as the
+self-hosted server does) with the outside world stubbed:
+
+- ``open_url`` is replaced in every module that uses it. Sheet writes and
+  SendGrid mails are recorded and answered 200/202, assignment APIs return a
+  fixed technician, the Retell re-fetch returns the payload's own call, the
+  API gateway forward is recorded, and anything else gets a 404.
+- ``datetime.now()`` returns the capture time (or a fixed time), and
+  ``time.sleep`` advances a virtual clock that ``time.monotonic`` (so the
+  request ``Deadline``) follows. The re-fetch back-off costs no real time.
+- Signatures are not checked, responses are verbose, capture is off, and
+  dedup, completion-marker and on-call snapshot state start empty in a
+  temporary directory for each run, so replayed techs and calls never reach
+  the live files.
+
+For each payload the run records the response status and body, the sheet
+rows, emails, outbound requests and the handler's wall time. With
+``--baseline``, outputs are compared field by field, followed by per-payload
+timing deltas; the exit status is 1 when any output differs.
+
+Input is capture segments (``api._lib.capture``; each record knows its
+path), or JSONL/JSON webhook bodies sent to ``--route``.
+"""
+import argparse
+import importlib
+import io
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+
+from api._lib import capture, completions, oncall_snapshot, outbound
+from api._lib.dedup import Deduper, FileBackend
+from api._lib.server import ROUTES, load_rewrites, resolve_target, run_handler
+from api._lib.tenants import tenants
+
+SINK_HOST = 'sink.replay.invalid'
+GATEWAY_URL = 'https://gateway.replay.invalid/'
+SENDGRID_HOST = 'api.sendgrid.com'
+RETELL_GET_CALL = 'https://api.retellai.com/v2/get-call/'
+FIXED_NOW = datetime(2024, 1, 1, 12, 0, 0)
+REPLAY_TECH = {"name": "Replay Tech", "email": "tech@replay.invalid", "phone": "+15550100"}
+
+# Keys that describe the run rather than the pipeline's output
+UNCOMPARED = ('source', 'elapsed_ms')
+
+
+class StubResponse(io.BytesIO):
+    def __init__(self, url, status, body):
+        super().__init__(body)
+        self.url = url
+        self.status = status
+        self.headers = {}
+
+    def getcode(self):
+        return self.status
+
+
+class Stubs:
+    """Answers outbound requests for one payload and records what was sent."""
+
+    def __init__(self):
+        self.tech_urls = {url for tenant in tenants().values() for _, url in tenant.tech_apis}
+        # Virtual seconds slept over the whole run; time.monotonic() is shifted by this
+        self.clock_offset = 0.0
+        self.reset(None, None)
+
+    def reset(self, call, captured_at):
+        self.call = call
+        self.now = datetime.fromtimestamp(captured_at) if captured_at else FIXED_NOW
+        self.slept = 0.0
+        self.sheet_rows = []
+        self.emails = []
+        self.forwards = []
+        self.outbound = []
+
+    def answer(self, method, url, body):
+        host = urllib.parse.urlsplit(url).hostname or ''
+        if host == SINK_HOST:
+            self.sheet_rows.append(parse(body))
+            return 200, b'{"status": "success"}'
+        if host == SENDGRID_HOST:
+            self.emails.append(parse(body))
+            return 202, b''
+        if url == GATEWAY_URL:
+            self.forwards.append(len(body or b''))
+            return 200, b'{}'
+        if url in self.tech_urls:
+            return 200, json.dumps({"assignments": [{"techs": [REPLAY_TECH]}]}).encode()
+        if url.startswith(RETELL_GET_CALL) and self.call:
+            return 200, json.dumps(self.call).encode()
+        return 404, b'{"error": "not stubbed"}'
+
+    @contextmanager
+    def open_url(self, req, timeout, context=None, deadline=None):
+        if isinstance(req, urllib.request.Request):
+            url, method, body = req.full_url, req.get_method(), req.data
+        else:
+            url, method, body = req, 'GET', None
+        self.outbound.append(f'{method} {url}')
+        status, payload = self.answer(method, url, body)
+        if status >= 400:
+            raise urllib.error.HTTPError(url, status, 'Replay stub', {}, io.BytesIO(payload))
+        with StubResponse(url, status, payload) as response:
+            yield response
+
+
+def parse(body):
+    try:
+        return json.loads(body)
+    except (TypeError, ValueError):
+        return (body or b'').decode('utf-8', 'replace')
+
+
+def handler_modules():
+    """Every handler module behind ``ROUTES``, imported."""
+    return [importlib.import_module(name) for name in dict.fromkeys(ROUTES.values())]
+
+
+@contextmanager
+def patched(obj, name, value):
+    original = getattr(obj, name)
+    setattr(obj, name, value)
+    try:
+        yield
+    finally:
+        setattr(obj, name, original)
+
+
+@contextmanager
+def isolated(stubs, state_dir):
+    """Stub the network, the clock and local state for the duration of a replay run."""
+    modules = handler_modules()
+    env = {'RETELL_VERIFY_SIGNATURE': 'off', 'RESPONSE_PROFILE': 'verbose', 'API_GATEWAY_URL': GATEWAY_URL}
+    for tenant in tenants().values():
+        if tenant.sink_env:
+            env[tenant.sink_env] = f'https://{SINK_HOST}/{tenant.key}'
+    saved_env = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)
+
+    real_monotonic = time.monotonic
+
+    class ReplayDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return stubs.now
+
+    def sleep(seconds):
+        stubs.slept += seconds
+        stubs.clock_offset += seconds
+
+    patches = [
+        patched(time, 'sleep', sleep),
+        patched(time, 'monotonic', lambda: real_monotonic() + stubs.clock_offset),
+        patched(capture, 'CAPTURE_DIR', ''),
+        patched(oncall_snapshot, 'SNAPSHOT_FILE', os.path.join(state_dir, 'oncall_snapshot.json')),
+        patched(oncall_snapshot, '_snapshots', None),
+        patched(oncall_snapshot, '_file_version', None),
+        # Completion markers go to the state dir only, never to a shared store
+        patched(completions, '_stores', {}),
+        patched(completions, 'COMPLETIONS_DIR', state_dir),
+        patched(completions, 'build_completions',
+                lambda client: completions.Completions(FileBackend(completions.completions_file(client)))),
+    ]
+    for module in [m for name, m in sys.modules.items() if name.startswith('api') and m is not None]:
+        if getattr(module, 'open_url', None) is outbound.open_url:
+            patches.append(patched(module, 'open_url', stubs.open_url))
+        if getattr(module, 'datetime', None) is datetime:
+            patches.append(patched(module, 'datetime', ReplayDatetime))
+    for module in modules:
+        if getattr(module, 'SENDGRID_API_KEY', None) == '':
+            patches.append(patched(module, 'SENDGRID_API_KEY', 'SG.replay'))
+        dedup = getattr(module, 'DEDUP', None)
+        if dedup is not None:
+            path = os.path.join(state_dir, f'{module.__name__}.json')
+            patches.append(patched(module, 'DEDUP', Deduper(FileBackend(path), tag=dedup.tag)))
+    try:
+        with ExitStack() as stack:
+            for patch in patches:
+                stack.enter_context(patch)
+            yield
+    finally:
+        for key, value in saved_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def iter_payloads(paths, route=None):
+    """Yield ``(source, path, captured_at, raw_body)`` from captures and JSONL/JSON files."""
+    for path in paths:
+        files = sorted(os.path.join(path, n) for n in os.listdir(path)) if os.path.isdir(path) else [path]
+        for name in files:
+            if name.endswith(capture.SEGMENT_SUFFIX):
+                for offset, meta, body in capture.iter_segment(name):
+                    yield f'{name}@{offset}', meta.get('path') or route, meta.get('ts'), body
+            elif name.endswith('.jsonl'):
+                with open(name, 'rb') as f:
+                    for line_no, line in enumerate(f, 1):
+                        if line.strip():
+                            yield f'{name}:{line_no}', route, None, line.strip()
+            elif name.endswith('.json'):
+                with open(name, 'rb') as f:
+                    yield name, route, None, f.read()
+
+
+def build_request(target, body):
+    head = (f'POST {target} HTTP/1.1\r\nHost: replay\r\nContent-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\n\r\n')
+    return head.encode('latin-1') + bytes(body)
+
+
+def split_response(raw):
+    head, _, body = raw.partition(b'\r\n\r\n')
+    status = int(head[9:12] or 0)
+    return status, parse(body)
+
+
+def replay(paths, route=None, repeat=1):
+    """Run every payload through its handler; returns one record per payload."""
+    rewrites = load_rewrites()
+    stubs = Stubs()
+    handlers = {}
+    records = []
+    state_dir = tempfile.mkdtemp(prefix='replay-')
+    try:
+        with isolated(stubs, state_dir):
+            for source, target, captured_at, body in iter_payloads(paths, route):
+                if not target:
+                    print(f"[REPLAY] Skipping {source}: no route (pass --route)")
+                    continue
+                target = resolve_target(target, rewrites)
+                path = urllib.parse.urlsplit(target).path.rstrip('/') or '/'
+                if path not in handlers:
+                    handlers[path] = importlib.import_module(ROUTES[path]).handler if path in ROUTES else None
+                if handlers[path] is None:
+                    print(f"[REPLAY] Skipping {source}: no handler for {path}")
+                    continue
+                try:
+                    call = json.loads(body).get('call')
+                except (ValueError, AttributeError):
+                    call = None
+                dedup = getattr(sys.modules[handlers[path].__module__], 'DEDUP', None)
+                timings = []
+                for attempt in range(repeat):
+                    # Extra runs are for timing only: they start from, and leave, the same dedup state
+                    saved = save_dedup(dedup) if attempt < repeat - 1 else None
+                    stubs.reset(call, captured_at)
+                    started = time.perf_counter()
+                    raw = run_handler(handlers[path], build_request(target, body), ('127.0.0.1', 0))
+                    timings.append((time.perf_counter() - started) * 1000)
+                    if saved is not None:
+                        restore_dedup(dedup, saved)
+                status, response = split_response(raw)
+                record = {
+                    'source': source,
+                    'target': target,
+                    'call_id': call.get('call_id') if isinstance(call, dict) else None,
+                    'status': status,
+                    'response': response,
+                    'sheet_rows': stubs.sheet_rows,
+                    'emails': stubs.emails,
+                    'forwards': len(stubs.forwards),
+                    'outbound': stubs.outbound,
+                    'slept_s': stubs.slept,
+                    'elapsed_ms': round(min(timings), 3),
+                }
+                records.append(record)
+    finally:
+        shutil.rmtree(state_dir, ignore_errors=True)
+    return records
+
+
+def save_dedup(dedup):
+    """The replay Deduper's file contents and front cache, for ``restore_dedup``."""
+    if dedup is None:
+        return None
+    try:
+        with open(dedup.backend.path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        data = None
+    return data, OrderedDict(dedup.cache._entries)
+
+
+def restore_dedup(dedup, saved):
+    if dedup is None or saved is None:
+        return
+    data, entries = saved
+    if data is None:
+        try:
+            os.unlink(dedup.backend.path)
+        except FileNotFoundError:
+            pass
+    else:
+        with open(dedup.backend.path, 'wb') as f:
+            f.write(data)
+    dedup.cache._entries = entries
+
+
+def flatten(value, prefix=''):
+    """``{dotted.path: leaf}`` for nested dicts and lists."""
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = ((str(i), v) for i, v in enumerate(value))
+    else:
+        return {prefix: value}
+    flat = {}
+    for key, child in items:
+        flat.update(flatten(child, f'{prefix}.{key}' if prefix else str(key)))
+    if not flat and prefix:
+        flat[prefix] = value
+    return flat
+
+
+def diff_record(baseline, candidate):
+    """``[(field, baseline_value, candidate_value), ...]`` for the fields that differ."""
+    old = flatten({k: v for k, v in baseline.items() if k not in UNCOMPARED})
+    new = flatten({k: v for k, v in candidate.items() if k not in UNCOMPARED})
+    missing = object()
+    return [(key, old.get(key, missing), new.get(key, missing)) for key in sorted(set(old) | set(new))
+            if old.get(key, missing) != new.get(key, missing)]
+
+
+def short(value, limit=80):
+    text = '<absent>' if not isinstance(value, (str, int, float, bool, type(None), list, dict)) else json.dumps(value)
+    return text if len(text) <= limit else text[:limit - 3] + '...'
+
+
+def compare(baseline, candidate, out=sys.stdout, top=10):
+    """Print output diffs and timing deltas; returns the number of payloads whose output changed."""
+    by_source = {record['source']: record for record in baseline}
+    changed = 0
+    deltas = []
+    for record in candidate:
+        base = by_source.get(record['source'])
+        if base is None:
+            out.write(f"NEW      {record['source']}\n")
+            continue
+        differences = diff_record(base, record)
+        if differences:
+            changed += 1
+            out.write(f"CHANGED  {record['source']} ({record.get('call_id')})\n")
+            for key, old, new in differences:
+                out.write(f"    {key}: {short(old)} -> {short(new)}\n")
+        deltas.append((record['elapsed_ms'] - base['elapsed_ms'], base['elapsed_ms'], record))
+    for source in set(by_source) - {record['source'] for record in candidate}:
+        out.write(f"MISSING  {source}\n")
+
+    if deltas:
+        out.write("\nTiming (handler wall time, min of repeats), largest changes first:\n")
+        for delta, base_ms, record in sorted(deltas, key=lambda d: -abs(d[0]))[:top]:
+            percent = (delta / base_ms * 100) if base_ms else 0.0
+            out.write(f"    {delta:+9.3f} ms ({percent:+6.1f}%)  {base_ms:9.3f} -> {record['elapsed_ms']:9.3f}  "
+                      f"{record['source']}\n")
+        base_total = sum(d[1] for d in deltas)
+        new_total = sum(d[2]['elapsed_ms'] for d in deltas)
+        out.write(f"    total {base_total:.1f} -> {new_total:.1f} ms, "
+                  f"median delta {statistics.median(d[0] for d in deltas):+.3f} ms\n")
+    out.write(f"\n{len(candidate)} payloads, {changed} with changed output\n")
+    return changed
+
+
+def load_records(path):
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay captured webhooks through the handlers with outbound calls stubbed.')
+    parser.add_argument('paths', nargs='+', help='Capture segments, JSONL/JSON bodies, or directories of them')
+    parser.add_argument('--route', help='Handler path for bodies without a captured path, e.g. /api/braconier')
+    parser.add_argument('--out', help='Write this run (JSONL) for use as a later --baseline')
+    parser.add_argument('--baseline', help='Earlier --out to diff against')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per payload; the fastest is reported')
+    parser.add_argument('--quiet', action='store_true', help="Silence the handlers' own logging")
+    args = parser.parse_args(argv)
+
+    if args.quiet:
+        stdout, sys.stdout = sys.stdout, io.StringIO()
+    try:
+        records = replay(args.paths, route=args.route, repeat=max(1, args.repeat))
+    finally:
+        if args.quiet:
+            sys.stdout = stdout
+    if args.out:
+        with open(args.out, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record, sort_keys=True) + '\n')
+    print(f"[REPLAY] {len(records)} payloads replayed" + (f", written to {args.out}" if args.out else ''),
+          file=sys.stderr)
+    if args.baseline:
+        return 1 if compare(load_records(args.baseline), records) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""
+Response profiles for the webhook handlers.
+
+Retell only looks at the status code, but successful ``call_analyzed``
+responses used to echo ``extracted_variables``, the full ``transcript``,
+``tech_data`` and ``call_metadata``, so every response was about as large as
+the request. ``RESPONSE_PROFILE`` picks what is sent:
+
+- ``slim`` (default): ``{"status": ..., "call_id": ...}`` only, built from
+  pre-serialized fragments;
+- ``verbose``: the handler's full ``response_data``, as before.
+
+A single request can ask for the verbose body with an ``X-Debug-Response``
+header equal to ``DEBUG_RESPONSE_TOKEN``; without a configured token the
+header is ignored. Bodies without a ``status`` (errors) are always sent as is.
+"""
+import hmac
+import os
+
+from api._lib.codec import dumps
+
+DEBUG_HEADER = 'X-Debug-Response'
+SLIM_KEYS = ('status', 'call_id')
+
+# '{"status": "<status>"' for every status the handlers return; others are added on first use
+_status_prefixes = {
+    status: b'{"status": ' + dumps(status)
+    for status in ('success', 'partial_success', 'skipped', 'ignored', 'error')
+}
+
+
+def response_profile():
+    profile = os.environ.get('RESPONSE_PROFILE', 'slim').strip().lower()
+    return profile if profile in ('slim', 'verbose') else 'slim'
+
+
+def debug_requested(headers):
+    """True when ``headers`` carry the configured debug token."""
+    token = os.environ.get('DEBUG_RESPONSE_TOKEN', '')
+    if not token or headers is None:
+        return False
+    supplied = headers.get(DEBUG_HEADER, '') or ''
+    return hmac.compare_digest(supplied.encode('utf-8', 'replace'), token.encode('utf-8'))
+
+
+def slim_body(status, call_id=None):
+    """``{"status": status, "call_id": call_id}`` as bytes, without serializing a dict."""
+    prefix = _status_prefixes.get(status)
+    if prefix is None:
+        prefix = _status_prefixes[status] = b'{"status": ' + dumps(status)
+    if call_id is None:
+        return prefix + b'}'
+    return prefix + b', "call_id": ' + dumps(call_id) + b'}'
+
+
+def encode_response(response_data, headers=None):
+    """The bytes to send for ``response_data`` under the active profile."""
+    if 'status' not in response_data or response_profile() == 'verbose' or debug_requested(headers):
+        return dumps(response_data)
+    return slim_body(response_data['status'], response_data.get('call_id'))
@@ -0,0 +1,436 @@
+"""
+Standalone asyncio HTTP server hosting every Vercel handler in one process.
+
+The ``handler(BaseHTTPRequestHandler)`` classes in ``api/`` are written for
+Vercel's one-request-per-invocation model. This module mounts them behind a
+stdlib asyncio server for self-hosted deployments:
+
+- Connections are accepted and parsed on the event loop.
+- Each request is run through the unmodified handler class in a thread pool,
+  so the blocking urllib calls inside the handlers never stall the loop.
+- The rewrites from ``vercel.json`` are honoured, so ``/braconier`` etc.
+  behave the same as on Vercel.
+- SIGTERM/SIGINT stop accepting new connections and drain in-flight requests
+  before exiting.
+
+Usage:
+    python -m api._lib.server --host 0.0.0.0 --port 8000
+"""
+import argparse
+import asyncio
+import importlib
+import io
+import json
+import os
+import signal
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from api._lib.body import max_body_bytes
+from api._lib.codec import dumps
+from api._lib.filestate import read_json, write_json_atomic
+from api._lib.latency import latency_report
+from api._lib.metrics import inc, merge_snapshots, observe, register_collector, snapshot as metrics_snapshot
+from api._lib.outbound import limiter_stats
+from api._lib.singleflight import Group, LeaderFailed, follower_wait
+from api._lib.sniff import sniff_call_id, sniff_event
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Path -> module exposing a ``handler`` class
+ROUTES = {
+    '/api/webhook': 'api.webhook',
+    '/api/braconier': 'api.braconier',
+    '/api/pacificwestern': 'api.pacificwestern',
+    '/api/adaptiveclimate': 'api.adaptiveclimate',
+    '/api/elitefire': 'api.elitefire',
+    '/api/sheets': 'api.sheets',
+    '/api/health': 'api.health',
+    '/api/overview': 'api.overview',
+    '/api/metrics': 'api.metrics',
+    '/api/profiles': 'api.profiles',
+}
+
+# Built-in route reporting request counters (per worker when pre-forked)
+WORKERS_PATH = '/api/workers'
+STATS_INTERVAL_SECONDS = 2.0
+
+MAX_HEADER_BYTES = 64 * 1024
+DEFAULT_WORKER_THREADS = int(os.environ.get('SERVER_WORKER_THREADS', '64'))
+DEFAULT_DRAIN_SECONDS = float(os.environ.get('SERVER_DRAIN_SECONDS', '30'))
+
+
+def load_rewrites(path=None):
+    """Load the ``rewrites`` table from vercel.json as a {source: destination} dict."""
+    path = path or os.path.join(ROOT_DIR, 'vercel.json')
+    try:
+        with open(path, 'r') as f:
+            config = json.load(f)
+        return {r['source']: r['destination'] for r in config.get('rewrites', [])}
+    except Exception as e:
+        print(f"[SERVER] Could not load rewrites from {path}: {e}")
+        return {}
+
+
+def resolve_target(target, rewrites):
+    """Apply vercel.json rewrites to a request target, keeping the caller's query string."""
+    parsed = urllib.parse.urlsplit(target)
+    destination = rewrites.get(parsed.path)
+    if not destination:
+        return target
+    dest = urllib.parse.urlsplit(destination)
+    query = '&'.join(q for q in (dest.query, parsed.query) if q)
+    return urllib.parse.urlunsplit(('', '', dest.path, query, ''))
+
+
+def merge_stats(totals, snapshot):
+    """Add one worker's counters into ``totals`` in place."""
+    for key in ('requests', 'errors', 'in_flight'):
+        totals[key] = totals.get(key, 0) + snapshot.get(key, 0)
+    status = totals.setdefault('status', {})
+    for code, count in snapshot.get('status', {}).items():
+        status[code] = status.get(code, 0) + count
+    outbound = totals.setdefault('outbound', {})
+    for dest, counters in snapshot.get('outbound', {}).items():
+        merged = outbound.setdefault(dest, {})
+        for key, value in counters.items():
+            if key in ('rate', 'concurrency'):
+                merged[key] = value
+            else:
+                merged[key] = merged.get(key, 0) + value
+    merge_snapshots(totals.setdefault('metrics', {}), snapshot.get('metrics', {}))
+    return totals
+
+
+def read_aggregate_stats(stats_dir):
+    """Sum the counters published by every live worker plus those retired by the supervisor."""
+    retired = read_json(os.path.join(stats_dir, 'retired.json'), {})
+    totals = merge_stats({}, retired)
+    per_worker = []
+    for name in sorted(os.listdir(stats_dir)):
+        if name.startswith('worker-') and name.endswith('.json'):
+            snapshot = read_json(os.path.join(stats_dir, name), None)
+            if snapshot:
+                per_worker.append(snapshot)
+                merge_stats(totals, snapshot)
+    return {"workers": len(per_worker), "totals": totals, "retired": retired, "per_worker": per_worker}
+
+
+class RequestError(Exception):
+    """Raised while reading a request that must be rejected before reaching a handler."""
+
+    def __init__(self, status, reason, message):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+
+
+_adapted_handlers = {}
+
+
+def adapt_handler(handler_cls):
+    """Return a subclass of ``handler_cls`` that talks to in-memory streams instead of a socket."""
+    adapted = _adapted_handlers.get(handler_cls)
+    if adapted is None:
+        class InMemoryHandler(handler_cls):
+            def setup(self):
+                self.rfile, self.wfile = self.request
+
+            def finish(self):
+                pass
+
+        InMemoryHandler.__name__ = f'InMemory{handler_cls.__name__}'
+        adapted = _adapted_handlers[handler_cls] = InMemoryHandler
+    return adapted
+
+
+def run_handler(handler_cls, raw_request, client_address, server=None):
+    """Run one raw HTTP request through a BaseHTTPRequestHandler class and return the raw response."""
+    rfile = io.BytesIO(raw_request)
+    wfile = io.BytesIO()
+    adapt_handler(handler_cls)((rfile, wfile), client_address, server)
+    return wfile.getvalue()
+
+
+def request_client(path, target):
+    """Client label for metrics: ``?client=`` on the router, else the route's last segment."""
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(target).query)
+    client = query.get('client', [''])[0]
+    return client or path.rsplit('/', 1)[-1] or 'root'
+
+
+def simple_response(status, reason, payload):
+    """Build a minimal JSON HTTP/1.0 response for errors raised before a handler runs."""
+    body = dumps(payload)
+    head = (
+        f'HTTP/1.0 {status} {reason}\r\n'
+        'Content-type: application/json\r\n'
+        'Access-Control-Allow-Origin: *\r\n'
+        f'Content-Length: {len(body)}\r\n'
+        '\r\n'
+    )
+    return head.encode('latin-1') + body
+
+
+class WebhookServer:
+    """Asyncio front-end that dispatches requests to the Vercel handler classes."""
+
+    def __init__(self, routes=None, rewrites=None, worker_threads=DEFAULT_WORKER_THREADS,
+                 drain_seconds=DEFAULT_DRAIN_SECONDS, stats_dir=None):
+        self.routes = dict(ROUTES if routes is None else routes)
+        self.rewrites = load_rewrites() if rewrites is None else dict(rewrites)
+        self.drain_seconds = drain_seconds
+        self.executor = ThreadPoolExecutor(max_workers=worker_threads, thread_name_prefix='webhook')
+        self.handlers = {}
+        self.inflight = set()
+        self.server = None
+        self.stopping = None
+        self.stats_dir = stats_dir
+        self.stats_task = None
+        self.stats = {'requests': 0, 'errors': 0, 'status': {}, 'started_at': time.time()}
+        # call_analyzed deliveries being handled, by (path, client, call_id)
+        self.flights = Group()
+        register_collector(self.metrics_gauges)
+
+    def get_handler(self, path):
+        """Import (once) and return the handler class mounted at ``path``."""
+        handler_cls = self.handlers.get(path)
+        if handler_cls is None:
+            module_name = self.routes.get(path)
+            if not module_name:
+                return None
+            handler_cls = self.handlers[path] = importlib.import_module(module_name).handler
+        return handler_cls
+
+    async def read_request(self, reader):
+        """Read one request off the wire. Returns (method, target, version, head_lines, body) or None."""
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError:
+            raise RequestError(431, 'Request Header Fields Too Large', 'Request header too large')
+
+        lines = head[:-4].decode('latin-1').split('\r\n')
+        parts = lines[0].split()
+        if len(parts) != 3:
+            raise RequestError(400, 'Bad Request', 'Malformed request line')
+        method, target, version = parts
+
+        content_length = 0
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            name = name.strip().lower()
+            if name == 'content-length':
+                try:
+                    content_length = int(value.strip())
+                except ValueError:
+                    raise RequestError(400, 'Bad Request', 'Invalid Content-Length')
+            elif name == 'transfer-encoding' and value.strip().lower() != 'identity':
+                raise RequestError(411, 'Length Required', 'Chunked request bodies are not supported')
+        if content_length < 0:
+            raise RequestError(400, 'Bad Request', 'Invalid Content-Length')
+        if content_length > max_body_bytes():
+            raise RequestError(413, 'Payload Too Large', 'Request body too large')
+
+        try:
+            body = await reader.readexactly(content_length) if content_length else b''
+        except asyncio.IncompleteReadError:
+            raise RequestError(400, 'Bad Request', 'Request body shorter than Content-Length')
+        return method, target, version, lines[1:], body
+
+    def respond(self, writer, response):
+        """Write a raw response and count it by status code."""
+        status = response[9:12].decode('latin-1', 'replace')
+        self.stats['status'][status] = self.stats['status'].get(status, 0) + 1
+        writer.write(response)
+
+    async def handle_connection(self, reader, writer):
+        """Serve a single request on a connection, then close it (handlers speak HTTP/1.0)."""
+        task = asyncio.current_task()
+        self.inflight.add(task)
+        self.stats['requests'] += 1
+        try:
+            try:
+                request = await self.read_request(reader)
+            except RequestError as e:
+                self.respond(writer, simple_response(e.status, e.reason, {"error": str(e)}))
+                return
+            if request is None:
+                return
+
+            method, target, version, header_lines, body = request
+            target = resolve_target(target, self.rewrites)
+            path = urllib.parse.urlsplit(target).path.rstrip('/') or '/'
+            if path == WORKERS_PATH and method == 'GET':
+                self.respond(writer, simple_response(200, 'OK', self.worker_stats()))
+                return
+            handler_cls = self.get_handler(path)
+            if handler_cls is None:
+                self.respond(writer, simple_response(404, 'Not Found', {"error": "Not Found"}))
+                return
+
+            started = time.monotonic()
+            raw_request = '\r\n'.join([f'{method} {target} {version}'] + header_lines + ['', '']).encode('latin-1') + body
+            peer = writer.get_extra_info('peername') or ('0.0.0.0', 0)
+            client = request_client(path, target)
+            event = (sniff_event(body) or 'unknown') if method == 'POST' and body else ''
+            call_id = sniff_call_id(body) if event == 'call_analyzed' else None
+            key = (path, client, call_id) if call_id else None
+            response = await self.dispatch(handler_cls, raw_request, peer[:2], key)
+            self.respond(writer, response)
+            inc('webhook_requests_total', client=client, event=event, status=response[9:12].decode('latin-1', 'replace'))
+            observe('webhook_request_duration_seconds', time.monotonic() - started, client=client)
+        except Exception as e:
+            print(f"[SERVER ERROR] Request failed: {e}")
+            self.stats['errors'] += 1
+            try:
+                self.respond(writer, simple_response(500, 'Internal Server Error', {"error": "Internal Server Error"}))
+            except Exception:
+                pass
+        finally:
+            try:
+                await writer.drain()
+                writer.close()
+                await writer.wait_closed()
+            except Exception:
+                pass
+            self.inflight.discard(task)
+
+    async def dispatch(self, handler_cls, raw_request, peer, key=None, rerun=True):
+        """Run the handler in the thread pool, coalescing concurrent requests that share ``key``."""
+        loop = asyncio.get_running_loop()
+
+        def run():
+            return loop.run_in_executor(self.executor, run_handler, handler_cls, raw_request, peer, self)
+
+        wait = follower_wait()
+        if key is None or wait is None:
+            return await run()
+        _, client, call_id = key
+        try:
+            response, shared = await self.flights.do(key, run, wait=wait)
+        except (TimeoutError, asyncio.TimeoutError):
+            # The first delivery is still running; it will write the row
+            inc('webhook_coalesced_total', client=client, result='ack')
+            return simple_response(200, 'OK', {"status": "skipped", "message": "Call already being processed", "call_id": call_id})
+        except LeaderFailed:
+            # The first delivery failed outright; followers retry it, coalesced once more
+            inc('webhook_coalesced_total', client=client, result='rerun')
+            return await self.dispatch(handler_cls, raw_request, peer, key if rerun else None, rerun=False)
+        if not shared:
+            return response
+        if response[9:10] == b'2':
+            inc('webhook_coalesced_total', client=client, result='shared')
+            return response
+        inc('webhook_coalesced_total', client=client, result='rerun')
+        return await self.dispatch(handler_cls, raw_request, peer, key if rerun else None, rerun=False)
+
+    def stats_snapshot(self):
+        """Return this process's request counters."""
+        snapshot = dict(self.stats)
+        snapshot['status'] = dict(self.stats['status'])
+        snapshot['in_flight'] = len(self.inflight)
+        snapshot['pid'] = os.getpid()
+        snapshot['outbound'] = limiter_stats()
+        snapshot['latency'] = latency_report()
+        snapshot['metrics'] = metrics_snapshot()
+        return snapshot
+
+    def metrics_gauges(self):
+        """Requests being handled and requests waiting for a handler thread."""
+        work_queue = getattr(self.executor, '_work_queue', None)
+        return [
+            ('webhook_server_in_flight', {}, len(self.inflight)),
+            ('webhook_server_queue_depth', {}, work_queue.qsize() if work_queue is not None else 0),
+            ('webhook_server_coalescing', {}, len(self.flights)),
+        ]
+
+    def worker_stats(self):
+        """Stats for ``GET /api/workers``: aggregated across pre-fork workers when running under one."""
+        if self.stats_dir:
+            self.flush_stats()
+            return read_aggregate_stats(self.stats_dir)
+        snapshot = self.stats_snapshot()
+        return {"workers": 1, "totals": snapshot, "per_worker": [snapshot]}
+
+    def flush_stats(self):
+        """Publish this worker's counters to the shared stats directory."""
+        if self.stats_dir:
+            write_json_atomic(os.path.join(self.stats_dir, f'worker-{os.getpid()}.json'), self.stats_snapshot())
+
+    async def publish_stats(self):
+        """Periodically flush counters so the pre-fork supervisor can aggregate them."""
+        while True:
+            await asyncio.sleep(STATS_INTERVAL_SECONDS)
+            try:
+                self.flush_stats()
+            except Exception as e:
+                print(f"[SERVER] Failed to publish worker stats: {e}")
+
+    async def start(self, host='0.0.0.0', port=8000, sock=None):
+        """Start listening, either on host/port or on an already-bound socket."""
+        self.stopping = asyncio.Event()
+        if sock is not None:
+            self.server = await asyncio.start_server(self.handle_connection, sock=sock, limit=MAX_HEADER_BYTES)
+        else:
+            self.server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_HEADER_BYTES)
+        addresses = ', '.join(str(s.getsockname()) for s in self.server.sockets)
+        print(f"[SERVER] Listening on {addresses} ({len(self.routes)} routes)")
+        if self.stats_dir:
+            self.stats_task = asyncio.ensure_future(self.publish_stats())
+
+    def request_stop(self):
+        """Signal handler hook: begin a graceful shutdown."""
+        if self.stopping is not None and not self.stopping.is_set():
+            print("[SERVER] Shutdown requested, draining in-flight requests...")
+            self.stopping.set()
+
+    async def drain(self):
+        """Stop accepting connections and wait for in-flight requests to finish."""
+        self.server.close()
+        await self.server.wait_closed()
+        pending = [t for t in self.inflight if not t.done()]
+        if pending:
+            print(f"[SERVER] Waiting up to {self.drain_seconds}s for {len(pending)} in-flight requests")
+            done, still_running = await asyncio.wait(pending, timeout=self.drain_seconds)
+            for task in still_running:
+                task.cancel()
+            if still_running:
+                print(f"[SERVER] Drain timeout, cancelled {len(still_running)} requests")
+        self.executor.shutdown(wait=False)
+        if self.stats_dir:
+            self.stats_task.cancel()
+            self.flush_stats()
+        print("[SERVER] Drained, exiting")
+
+    async def serve(self, host='0.0.0.0', port=8000, sock=None):
+        """Run until SIGTERM/SIGINT, then drain."""
+        await self.start(host, port, sock=sock)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.request_stop)
+            except (NotImplementedError, RuntimeError):
+                pass
+        await self.stopping.wait()
+        await self.drain()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve all webhook handlers from one asyncio process.')
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', '8000')))
+    parser.add_argument('--threads', type=int, default=DEFAULT_WORKER_THREADS,
+                        help='Worker threads running handlers (outbound I/O is blocking)')
+    parser.add_argument('--drain-seconds', type=float, default=DEFAULT_DRAIN_SECONDS,
+                        help='How long to wait for in-flight requests on shutdown')
+    args = parser.parse_args(argv)
+
+    server = WebhookServer(worker_threads=args.threads, drain_seconds=args.drain_seconds)
+    asyncio.run(server.serve(args.host, args.port))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+Early HMAC check of Retell's ``x-retell-signature`` header.
+
+The handlers used to read the signature only to pass it on to the gateway, so
+any POST triggered extraction, tech lookups and a sheet write. Now the raw
+body bytes are verified before anything is parsed:
+
+    x-retell-signature: v=<unix ms>,d=<hex HMAC-SHA256(key, body + timestamp)>
+
+- the digest is compared in constant time,
+- the timestamp must be within ``REPLAY_WINDOW_SECONDS`` of now,
+- a signature already seen inside the window is a replay and is skipped.
+
+A signature is only remembered once its delivery has been handled: the
+handler calls ``accept_signature`` after the sheet write succeeds. A delivery
+that fails (500, timeout, failed write) is retried by Retell with the same
+signed body, and that retry has to be processed, not skipped.
+
+``RETELL_VERIFY_SIGNATURE`` controls the gate: ``off`` (default), ``log``
+(verify and log failures, but let requests through, for rollout) or
+``enforce``. The key is ``RETELL_WEBHOOK_SECRET`` if set, else
+``RETELL_API_KEY`` (the API key that has webhook permission).
+"""
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+
+SIGNATURE_HEADER = 'x-retell-signature'
+REPLAY_WINDOW_SECONDS = 300
+REPLAY_CACHE_SIZE = 10000
+
+
+def verify_mode():
+    mode = os.environ.get('RETELL_VERIFY_SIGNATURE', 'off').strip().lower()
+    if mode in ('1', 'true', 'yes', 'on'):
+        return 'enforce'
+    return mode if mode in ('log', 'enforce') else 'off'
+
+
+def signing_key():
+    return os.environ.get('RETELL_WEBHOOK_SECRET', '') or os.environ.get('RETELL_API_KEY', '')
+
+
+def parse_signature(header):
+    """Split ``v=<ts>,d=<digest>`` into (timestamp_ms, digest); None when malformed."""
+    parts = {}
+    for item in (header or '').split(','):
+        key, sep, value = item.strip().partition('=')
+        if sep:
+            parts[key] = value
+    try:
+        return int(parts['v']), parts['d']
+    except (KeyError, ValueError):
+        return None
+
+
+def compute_digest(key, body, timestamp_ms):
+    # Fed in two parts so the (possibly large) body buffer is never copied
+    mac = hmac.new(key.encode('utf-8'), body, hashlib.sha256)
+    mac.update(str(timestamp_ms).encode('ascii'))
+    return mac.hexdigest()
+
+
+class ReplayCache:
+    """Signatures seen within the replay window, oldest evicted first."""
+
+    def __init__(self, window=REPLAY_WINDOW_SECONDS, size=REPLAY_CACHE_SIZE):
+        self.window = window
+        self.size = size
+        self.seen = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _evict(self, now):
+        while self.seen:
+            oldest, expires = next(iter(self.seen.items()))
+            if expires > now and len(self.seen) < self.size:
+                break
+            self.seen.popitem(last=False)
+
+    def contains(self, digest, now=None):
+        """True if ``digest`` was recorded inside the window."""
+        now = time.time() if now is None else now
+        with self.lock:
+            self._evict(now)
+            return digest in self.seen
+
+    def add(self, digest, now=None):
+        """Record ``digest`` as handled for the rest of the window."""
+        now = time.time() if now is None else now
+        with self.lock:
+            self._evict(now)
+            self.seen[digest] = now + self.window
+
+
+replay_cache = ReplayCache()
+
+
+def verify_signature(body, header, key, now=None):
+    """Return '' when the signature is valid, else the reason it is not."""
+    if not key:
+        return 'no signing key configured'
+    parsed = parse_signature(header)
+    if parsed is None:
+        return 'missing or malformed signature'
+    timestamp_ms, digest = parsed
+    now = time.time() if now is None else now
+    if abs(now * 1000 - timestamp_ms) > REPLAY_WINDOW_SECONDS * 1000:
+        return 'signature timestamp outside the replay window'
+    expected = compute_digest(key, body, timestamp_ms).encode('ascii')
+    if not hmac.compare_digest(expected, digest.lower().encode('utf-8', 'replace')):
+        return 'signature mismatch'
+    if replay_cache.contains(digest.lower(), now):
+        return 'replayed signature'
+    return ''
+
+
+def check_retell_signature(body, headers):
+    """Gate a webhook on its signature. Returns None to proceed, else (status, response_data)."""
+    mode = verify_mode()
+    if mode == 'off':
+        return None
+    reason = verify_signature(body, headers.get(SIGNATURE_HEADER, ''), signing_key())
+    if not reason:
+        return None
+    if mode != 'enforce':
+        print(f"[SIGNATURE] Would reject webhook: {reason}")
+        return None
+    print(f"[SIGNATURE] Rejecting webhook: {reason}")
+    if reason == 'replayed signature':
+        # A replay of a delivery we already accepted; acknowledge it so it is not retried
+        return 200, {"status": "skipped", "message": "Replayed webhook ignored"}
+    return 401, {"error": "Invalid signature"}
+
+
+def accept_signature(headers, now=None):
+    """Remember the request's signature once it has been handled, so a later replay is skipped."""
+    if verify_mode() == 'off':
+        return
+    parsed = parse_signature(headers.get(SIGNATURE_HEADER, ''))
+    if parsed is not None:
+        replay_cache.add(parsed[1].lower(), now)
@@ -0,0 +1,88 @@
+"""
+Coalesce concurrent deliveries of the same call in the self-hosted server.
+
+Processing a ``call_analyzed`` webhook takes seconds (re-fetch, tech lookup,
+sheet write, email), long enough for Retell to retry while the first attempt
+is still running. The retry used to start the same work in parallel. Now the
+server keys each ``call_analyzed`` POST by route, client and ``call_id``:
+the first request runs the handler and any request for the same key that
+arrives meanwhile is a follower. ``SINGLEFLIGHT_MODE`` picks what a follower
+does:
+
+- ``wait`` (default): wait on the event loop, without holding a handler
+  thread, for up to ``SINGLEFLIGHT_WAIT_SECONDS`` (default 25) and send the
+  leader's response. A follower whose leader failed (non-2xx) runs the
+  handler itself; one that runs out of time gets the ``ack`` answer.
+- ``ack``: answer ``200 {"status": "skipped"}`` at once.
+- ``off``: no coalescing.
+
+This covers one process. Across pre-fork workers and instances, the dedup
+claim (``api._lib.dedup``) still stops the second write.
+"""
+import asyncio
+import os
+
+MODE = os.environ.get('SINGLEFLIGHT_MODE', 'wait').strip().lower()
+WAIT_SECONDS = float(os.environ.get('SINGLEFLIGHT_WAIT_SECONDS', '25'))
+
+
+class LeaderFailed(Exception):
+    """Raised to followers when the call they waited on raised."""
+
+
+class Flight:
+    """One running call for a key; followers wait on ``done``."""
+
+    def __init__(self):
+        self.done = asyncio.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class Group:
+    """Runs at most one coroutine per key at a time (on one event loop)."""
+
+    def __init__(self):
+        self._flights = {}
+
+    def __len__(self):
+        return len(self._flights)
+
+    def running(self, key):
+        return key in self._flights
+
+    async def do(self, key, fn, wait=None):
+        """Await ``fn()``, or the call already running for ``key``.
+
+        Returns ``(result, shared)``. A follower raises LeaderFailed when the
+        leader raised, and TimeoutError once ``wait`` seconds pass (or at once
+        when ``wait`` is 0); the leader keeps running either way.
+        """
+        flight = self._flights.get(key)
+        if flight is not None:
+            flight.followers += 1
+            if wait is not None and wait <= 0:
+                raise TimeoutError(f'{key} is already running')
+            await asyncio.wait_for(flight.done.wait(), wait)
+            if flight.error is not None:
+                raise LeaderFailed(f'{key} failed: {flight.error}') from flight.error
+            return flight.result, True
+
+        flight = self._flights[key] = Flight()
+        try:
+            flight.result = await fn()
+            return flight.result, False
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            del self._flights[key]
+            flight.done.set()
+
+
+def follower_wait():
+    """How long a follower waits under the current mode; None when coalescing is off."""
+    if MODE == 'off':
+        return None
+    return 0 if MODE == 'ack' else WAIT_SECONDS
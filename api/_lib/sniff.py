@@ -0,0 +1,59 @@
+"""
+Read a webhook's top-level ``event`` without parsing the whole document.
+
+Only ``call_analyzed`` does real work, but ``call_started`` and
+``call_ended`` (which carries the full transcript) used to be fully
+``json.loads``-ed just to be ignored. Retell puts ``event`` first, so
+``sniff_event`` reads only the opening ``{"event": "..."`` of the raw bytes.
+It returns None when the first key is something else or the prefix does not
+look like that, and the caller falls back to a full parse.
+
+``sniff_call_id`` is a best-effort regex over a bounded prefix, used only to
+label the log line and the response for ignored events.
+"""
+import json
+import re
+from json.decoder import scanstring
+
+SNIFF_LIMIT = 512
+CALL_ID_LIMIT = 4096
+
+_CALL_ID_RE = re.compile(rb'"call_id"\s*:\s*"([A-Za-z0-9_\-]{1,128})"')
+
+
+def _skip_ws(text, pos):
+    while pos < len(text) and text[pos] in ' \t\r\n':
+        pos += 1
+    return pos
+
+
+def sniff_event(raw, limit=SNIFF_LIMIT):
+    """The top-level ``event`` value if it is the first key of ``raw``, else None."""
+    # The limit may cut a multi-byte character; everything up to the value is ASCII anyway
+    text = bytes(raw[:limit]).decode('utf-8', 'ignore')
+    pos = _skip_ws(text, 0)
+    if text[pos:pos + 1] != '{':
+        return None
+    pos = _skip_ws(text, pos + 1)
+    if text[pos:pos + 1] != '"':
+        return None
+    try:
+        key, pos = scanstring(text, pos + 1)
+        if key != 'event':
+            return None
+        pos = _skip_ws(text, pos)
+        if text[pos:pos + 1] != ':':
+            return None
+        pos = _skip_ws(text, pos + 1)
+        if text[pos:pos + 1] != '"':
+            return None
+        value, _ = scanstring(text, pos + 1)
+        return value
+    except json.JSONDecodeError:
+        return None
+
+
+def sniff_call_id(raw, limit=CALL_ID_LIMIT):
+    """First ``"call_id": "..."`` in the first ``limit`` bytes, or ''."""
+    match = _CALL_ID_RE.search(bytes(raw[:limit]))
+    return match.group(1).decode('ascii') if match else ''
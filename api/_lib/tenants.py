@@ -0,0 +1,140 @@
+"""
+Tenant registry: everything that differs between clients, in one config file.
+
+Adding a client used to mean copying a handler module and then editing
+``CLIENT_URLS`` in ``webhook.py``, the env lists in ``overview.py``, the
+backfill pipelines and the health probes. Those now all read ``tenants.json``
+(or the file named by ``TENANTS_FILE``), loaded once per process:
+
+- ``sink_env``: env var holding the Apps Script URL rows are written to,
+- ``tech_apis``: on-call assignment APIs by emergency type, in default
+  priority order; the API for the call's type is tried first,
+- ``email``: notification rules (SendGrid sender and recipients),
+- ``dedup_namespace``: names the tenant's processed-calls file,
+- ``pipeline``: the handler functions the backfill replays through,
+- ``fields``: ``custom_analysis_data`` aliases per extracted variable, on
+  top of ``defaults.fields``,
+- ``limits``: optional outbound limit for the tenant's sink URL, so one
+  tenant's burst cannot use up another's Apps Script quota.
+
+    python -m api._lib.tenants            # list tenants and their config status
+    python -m api._lib.tenants rewrites   # the vercel.json rewrites for the router
+"""
+import json
+import os
+import sys
+import threading
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+TENANTS_FILE = os.environ.get('TENANTS_FILE', os.path.join(ROOT_DIR, 'tenants.json'))
+ROUTER_PATH = '/api/webhook'
+
+
+class Tenant:
+    """One client's configuration from the registry."""
+
+    def __init__(self, key, config, defaults=None):
+        defaults = defaults or {}
+        self.key = key
+        self.company = config.get('company', key)
+        self.description = config.get('description', '')
+        self.module = config.get('module', '')
+        self.route = config.get('route', '')
+        self.rewrite = config.get('rewrite', '')
+        self.sink_env = config.get('sink_env', '')
+        self.required = config.get('required', True)
+        self.pipeline_version = config.get('pipeline_version', f'{key}-v1')
+        self.dedup_namespace = config.get('dedup_namespace', '')
+        self.pipeline = config.get('pipeline', {})
+        self.tech_apis = [(api['type'], api['url']) for api in config.get('tech_apis', [])]
+        self.email = config.get('email') or {}
+        self.limits = config.get('limits') or {}
+        self.fields = dict(defaults.get('fields', {}))
+        self.fields.update(config.get('fields', {}))
+
+    def __repr__(self):
+        return f'Tenant({self.key!r})'
+
+    @property
+    def sink_url(self):
+        return os.environ.get(self.sink_env, '').strip() if self.sink_env else ''
+
+    @property
+    def dedup_file(self):
+        return f'/tmp/processed_calls_{self.dedup_namespace}.json' if self.dedup_namespace else None
+
+    def tech_api(self, emergency_type=''):
+        """URL of the assignment API for ``emergency_type``, else the default (first) one."""
+        order = self.tech_api_order(emergency_type)
+        return order[0][1] if order else ''
+
+    def tech_api_order(self, emergency_type=''):
+        """``[(type, url), ...]`` with the API for ``emergency_type`` first, then the rest in priority order."""
+        primary = [api for api in self.tech_apis if api[0] == emergency_type]
+        return primary + [api for api in self.tech_apis if api[0] != emergency_type]
+
+
+_lock = threading.Lock()
+_registry = None
+
+
+def load_registry(path=None):
+    """Parse a registry file into ``{key: Tenant}``, keeping the file's order."""
+    with open(path or TENANTS_FILE, 'r') as f:
+        config = json.load(f)
+    defaults = config.get('defaults', {})
+    return {key: Tenant(key, entry, defaults) for key, entry in config.get('tenants', {}).items()}
+
+
+def tenants():
+    """The registry, loaded on first use."""
+    global _registry
+    if _registry is None:
+        with _lock:
+            if _registry is None:
+                _registry = load_registry()
+    return _registry
+
+
+def get_tenant(key):
+    """Return the tenant ``key`` or raise KeyError listing the valid names."""
+    registry = tenants()
+    try:
+        return registry[key]
+    except KeyError:
+        raise KeyError(f"Unknown client '{key}', expected one of: {', '.join(registry)}")
+
+
+def router_clients():
+    """Tenants reachable through ``/api/webhook?client=...`` (those with a rewrite)."""
+    return [tenant for tenant in tenants().values() if tenant.rewrite]
+
+
+def rewrites():
+    """The ``vercel.json`` rewrites: ``/`` to the router plus one per router client."""
+    entries = [{"source": "/", "destination": ROUTER_PATH}]
+    for tenant in router_clients():
+        entries.append({"source": tenant.rewrite, "destination": f'{ROUTER_PATH}?client={tenant.key}'})
+    return entries
+
+
+def sink_limits():
+    """``{sink_url: limits}`` for tenants with their own outbound limit and a configured sink."""
+    return {tenant.sink_url.rstrip('/'): dict(tenant.limits)
+            for tenant in tenants().values() if tenant.limits and tenant.sink_url}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['rewrites']:
+        print(json.dumps({"rewrites": rewrites()}, indent=2))
+        return 0
+    for tenant in tenants().values():
+        status = 'set' if tenant.sink_url else ('MISSING' if tenant.required else 'unset')
+        apis = ', '.join(kind for kind, _ in tenant.tech_apis) or '-'
+        print(f'{tenant.key:<10} {tenant.route:<22} {tenant.sink_env}={status:<8} tech: {apis}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
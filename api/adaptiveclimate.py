@@ -1,15 +1,49 @@
 from http.server import BaseHTTPRequestHandler
-import json
 import os
 import time
 from datetime import datetime
 import urllib.request
 import urllib.parse
 import ssl
-import hashlib
+
+from api._lib.body import check_body_size, read_body
+from api._lib.capture import capture_request
+from api._lib.classifier import infer_emergency_type
+from api._lib.codec import JSONDecodeError, dumps, loads
+from api._lib.completions import mark_completed
+from api._lib.deadline import MIN_TIMEOUT_SECONDS, RESERVE_SECONDS, Deadline
+from api._lib.dedup import deduper
+from api._lib.idempotency import IDEMPOTENCY_FIELD, idempotency_key, sheet_headers
+from api._lib.latency import latency_report
+from api._lib.metrics import record_dedup, stage
+from api._lib.oncall_snapshot import lookup_timeout, remember_tech, snapshot_tech
+from api._lib.outbound import open_url
+from api._lib.profiling import profiled
+from api._lib.projection import call_fields, keep_tool_calls, project
+from api._lib.records import AdaptiveSheetRow, ExtractedVars, TechContact
+from api._lib.responses import encode_response
+from api._lib.signature import accept_signature, check_retell_signature
+from api._lib.sniff import sniff_call_id, sniff_event
+from api._lib.tenants import get_tenant
+
+TENANT = get_tenant('adaptive')
 
 # Simple file-based deduplication to persist across serverless invocations
-PROCESSED_CALLS_FILE = '/tmp/processed_calls_sheets4.json'
+PROCESSED_CALLS_FILE = TENANT.dedup_file
+# Shared across instances when DEDUP_BACKEND=redis, else the file above
+DEDUP = deduper(TENANT, 'SHEETS4')
+
+# Part of every row's idempotency key; bump it in tenants.json when the row layout or meaning changes
+SHEETS_PIPELINE_VERSION = TENANT.pipeline_version
+
+# The parts of a call this pipeline reads; the rest is dropped at parse time
+CALL_FIELDS = call_fields(
+    'call_id', 'agent_name', 'duration_ms', 'call_analysis', 'collected_dynamic_variables',
+    'from_number', 'start_timestamp', 'transcript',
+    # Method 5 reads the extracted variables straight off the call object
+    'fromNumber', 'customerName', 'serviceAddress', 'callSummary', 'email', 'isitEmergency', 'emergencyType',
+    transcript_with_tool_calls=keep_tool_calls,
+)
 
 def normalize_phone_number(value):
     """Return a normalized E.164-like phone number when possible."""
@@ -36,7 +70,7 @@ def pick_best_from_number(*candidates):
 
 CRITICAL_FIELDS = ['isitEmergency', 'customerName', 'fromNumber']
 
-def fetch_call_from_retell(call_id, api_key):
+def fetch_call_from_retell(call_id, api_key, deadline=None):
     """Fetch the full call object from the Retell API."""
     url = f"https://api.retellai.com/v2/get-call/{call_id}"
     req = urllib.request.Request(url, headers={
@@ -44,10 +78,11 @@ def fetch_call_from_retell(call_id, api_key):
         "Accept": "application/json",
     })
     ctx = ssl.create_default_context()
-    with urllib.request.urlopen(req, timeout=8, context=ctx) as resp:
-        return json.loads(resp.read().decode("utf-8"))
+    with open_url(req, timeout=8, context=ctx, deadline=deadline) as resp:
+        return project(loads(resp.read()), CALL_FIELDS)
 
-def ensure_complete_data(call_data, extracted_vars):
+@stage('adaptive', 'refetch')
+def ensure_complete_data(call_data, extracted_vars, deadline=None):
     """
     If critical extracted fields are missing, re-fetch the call from
     the Retell API after a short delay so the analysis has time to finish.
@@ -64,9 +99,13 @@ def ensure_complete_data(call_data, extracted_vars):
 
     for attempt in range(1, 4):
         delay = 3 * attempt
+        # Each re-fetch is optional: stop once it would eat into the sheet write's budget
+        if deadline is not None and not deadline.has(delay + MIN_TIMEOUT_SECONDS + RESERVE_SECONDS):
+            print(f"[RETRY] Skipping attempt {attempt}, request budget too low: {deadline}")
+            break
         time.sleep(delay)
         try:
-            fresh = fetch_call_from_retell(call_id, api_key)
+            fresh = fetch_call_from_retell(call_id, api_key, deadline=deadline)
             fresh_vars = extract_variables_v4(fresh)
             still_missing = [f for f in CRITICAL_FIELDS if not fresh_vars.get(f)]
             print(f"[RETRY] Attempt {attempt} after {delay}s – still missing: {still_missing}")
@@ -80,26 +119,29 @@ def ensure_complete_data(call_data, extracted_vars):
     print(f"[RETRY] Exhausted retries, proceeding with best available data")
     return call_data, extracted_vars
 
-def forward_to_api_gateway(body_str, signature_header):
+@stage('adaptive', 'forward')
+def forward_to_api_gateway(body, signature_header, deadline=None, event_type=None):
     """Forward webhook to API gateway synchronously before responding.
-    Must complete within the serverless request lifecycle."""
+    Must complete within the serverless request lifecycle.
+    ``body`` is the raw request body; pass ``event_type`` when it is already known."""
     api_gateway_url = os.environ.get('API_GATEWAY_URL', '').strip()
     if not api_gateway_url:
         return
 
-    event_type = None
-    try:
-        body_dict = json.loads(body_str)
-        event_type = body_dict.get("event", "")
-    except:
-        pass
+    if event_type is None:
+        event_type = sniff_event(body)
+    if event_type is None:
+        try:
+            event_type = loads(body).get("event", "")
+        except:
+            pass
 
     # Only forward call_started, call_ended, and call_analyzed events
     if event_type not in ["call_started", "call_ended", "call_analyzed"]:
         return
 
     try:
-        data = body_str.encode('utf-8')
+        data = body.encode('utf-8') if isinstance(body, str) else body
         req = urllib.request.Request(
             api_gateway_url,
             data=data,
@@ -108,26 +150,19 @@ def forward_to_api_gateway(body_str, signature_header):
                 'x-retell-signature': signature_header or ''
             }
         )
-        with urllib.request.urlopen(req, timeout=3) as response:
+        with open_url(req, timeout=3, deadline=deadline) as response:
             print(f"[API_GATEWAY] Forwarded {event_type} event, status: {response.status}")
     except Exception as e:
         # Swallow errors — forward failures must never block the main webhook response
         print(f"[API_GATEWAY] Error forwarding webhook: {e}")
 
+@stage('adaptive', 'extract')
 def extract_variables_v4(call_data):
     """
     Extract dynamic variables for the fourth webhook (Adaptive Climate)
     Variables: fromNumber, customerName, serviceAddress, callSummary, email, isitEmergency, emergencyType
     """
-    variables = {
-        'fromNumber': '',
-        'customerName': '',
-        'serviceAddress': '',
-        'callSummary': '',
-        'email': '',
-        'isitEmergency': '',
-        'emergencyType': ''
-    }
+    variables = ExtractedVars()
     analysis = call_data.get('call_analysis', {})
     custom_data = analysis.get('custom_analysis_data', {})
     
@@ -242,12 +277,11 @@ def extract_variables_v4(call_data):
 
         # Adaptive is HVAC-focused; infer emergency type if still missing
         if not variables['emergencyType']:
-            issue_text = (
-                str(custom_data.get('issue_description', '')) + ' ' +
-                str(analysis.get('call_summary', ''))
-            ).lower()
-            if any(token in issue_text for token in ['hvac', 'air conditioner', 'ac', 'furnace', 'heating', 'cooling']):
-                variables['emergencyType'] = 'HVAC'
+            variables['emergencyType'] = infer_emergency_type(
+                'adaptive',
+                custom_data.get('issue_description', ''),
+                analysis.get('call_summary', '')
+            )
 
         if has_values(variables):
             return finalize(variables)
@@ -271,7 +305,7 @@ def extract_variables_v4(call_data):
                     content = entry.get('content', '')
                     if content:
                         try:
-                            result = json.loads(content)
+                            result = loads(content)
                             if isinstance(result, dict):
                                 source_vars = result.get('variables', result)
                                 for key in variables.keys():
@@ -279,7 +313,7 @@ def extract_variables_v4(call_data):
                                         variables[key] = str(source_vars[key])
                                 if has_values(variables):
                                     return finalize(variables)
-                        except (json.JSONDecodeError, TypeError):
+                        except (JSONDecodeError, TypeError):
                             continue
     
     # Method 4: Look for any tool_call_result with variables (broader search)
@@ -289,7 +323,7 @@ def extract_variables_v4(call_data):
                 content = entry.get('content', '')
                 if content:
                     try:
-                        result = json.loads(content)
+                        result = loads(content)
                         if isinstance(result, dict):
                             found_vars = False
                             for key in variables.keys():
@@ -298,7 +332,7 @@ def extract_variables_v4(call_data):
                                     found_vars = True
                             if found_vars:
                                 return finalize(variables)
-                    except (json.JSONDecodeError, TypeError):
+                    except (JSONDecodeError, TypeError):
                         continue
     
     # Method 5: Direct fields in call_data (last resort)
@@ -316,7 +350,8 @@ def extract_variables_v4(call_data):
     
     return finalize(variables)
 
-def get_tech_data_from_adaptive_climate_api():
+@stage('adaptive', 'tech_lookup')
+def get_tech_data_from_adaptive_climate_api(deadline=None):
     """
     Get tech data (name, email and phone) from the Adaptive Climate API
     
@@ -333,29 +368,29 @@ def get_tech_data_from_adaptive_climate_api():
             ssl_context.check_hostname = False
             ssl_context.verify_mode = ssl.CERT_NONE
             
-            with urllib.request.urlopen(api_url, timeout=10, context=ssl_context) as response:
-                data = response.read().decode('utf-8')
+            with open_url(api_url, timeout=lookup_timeout(api_url, 10), context=ssl_context, deadline=deadline) as response:
+                data = response.read()
                 
                 try:
-                    json_data = json.loads(data)
+                    json_data = loads(data)
                     print(f"[{api_name}] Received data: {json_data}")
                     
                     # Handle case where API returns null or non-dict
                     if not isinstance(json_data, dict):
                         print(f"[{api_name}] API returned non-dict data: {type(json_data)}")
-                        return {'name': '', 'email': '', 'phone': ''}
+                        return TechContact()
                     
                     # Check if this is just a status message
                     if 'message' in json_data and 'status' in json_data:
                         print(f"[{api_name}] API returned status message: {json_data.get('message')}")
-                        return {'name': '', 'email': '', 'phone': ''}
+                        return TechContact()
                     
                     # Check if assignments exist and is not empty
                     assignments = json_data.get('assignments', [])
                     
                     if not assignments or len(assignments) == 0:
                         print(f"[{api_name}] No assignments found - empty array")
-                        return {'name': '', 'email': '', 'phone': ''}
+                        return TechContact()
                     
                     # Look through assignments for techs with emails and phones
                     for assignment in assignments:
@@ -374,27 +409,28 @@ def get_tech_data_from_adaptive_climate_api():
                                 email = tech.get('email', '')
                                 phone = tech.get('phone', '')
                                 print(f"[{api_name}] Found - name: {name}, email: {email}, phone: {phone}")
-                                return {'name': name, 'email': email, 'phone': phone}
+                                return TechContact(name, email, phone)
                     
                     print(f"[{api_name}] No valid email or phone found in assignments")
-                    return {'name': '', 'email': '', 'phone': ''}
+                    return TechContact()
                     
-                except json.JSONDecodeError as e:
+                except JSONDecodeError as e:
                     print(f"[{api_name} ERROR] Failed to parse JSON: {e}")
                     # If not JSON, check if the response itself is an email
+                    data = data.decode('utf-8')
                     if '@' in data and '.' in data:
                         email = data.strip()
                         print(f"[{api_name}] Found direct email: {email}")
-                        return {'name': '', 'email': email, 'phone': ''}
-                    return {'name': '', 'email': '', 'phone': ''}
+                        return TechContact(email=email)
+                    return TechContact()
                     
         except Exception as e:
             print(f"[{api_name} ERROR] Failed to fetch data: {e}")
-            return {'name': '', 'email': '', 'phone': ''}
+            return TechContact()
     
     try:
-        # Define Adaptive Climate API endpoint
-        adaptive_climate_api = "https://adaptive-climate.vercel.app/api/assignments"
+        # Define Adaptive Climate API endpoint (from the tenant registry)
+        adaptive_climate_api = TENANT.tech_api()
         
         print(f"[API] Trying Adaptive Climate API...")
         
@@ -402,14 +438,21 @@ def get_tech_data_from_adaptive_climate_api():
         result = try_api_endpoint(adaptive_climate_api, "ADAPTIVE CLIMATE API")
         
         # Ensure result is a dict
-        if not isinstance(result, dict):
-            result = {'name': '', 'email': '', 'phone': ''}
+        if not isinstance(result, TechContact):
+            result = TechContact()
         
         if result.get('email') or result.get('phone'):
+            remember_tech(adaptive_climate_api, result)
             print(f"[API] SUCCESS: Got data from Adaptive Climate API - name: {result.get('name', '')}, email: {result.get('email', '')}, phone: {result.get('phone', '')}")
             return result
         
         print("[API] No email or phone found from Adaptive Climate API")
+
+        # A recent snapshot of a live answer beats the static fallback
+        snapshot = snapshot_tech(adaptive_climate_api)
+        if snapshot:
+            print(f"[API] Using stale on-call snapshot from {snapshot['snapshot_at']} - name: {snapshot['name']}, email: {snapshot['email']}, phone: {snapshot['phone']}")
+            return snapshot
         
         # Fallback to environment variables if API doesn't have data
         fallback_email = os.environ.get('FALLBACK_TECH_EMAIL', '')
@@ -417,9 +460,9 @@ def get_tech_data_from_adaptive_climate_api():
         
         if fallback_email or fallback_phone:
             print(f"[API] Using fallback data - email: {fallback_email}, phone: {fallback_phone}")
-            return {'name': '', 'email': fallback_email, 'phone': fallback_phone}
+            return TechContact(email=fallback_email, phone=fallback_phone)
         
-        return {'name': '', 'email': '', 'phone': ''}
+        return TechContact()
         
     except Exception as e:
         print(f"[API ERROR] Exception in get_tech_data_from_adaptive_climate_api: {e}")
@@ -430,11 +473,12 @@ def get_tech_data_from_adaptive_climate_api():
         
         if fallback_email or fallback_phone:
             print(f"[API] Using fallback data after error - email: {fallback_email}, phone: {fallback_phone}")
-            return {'name': '', 'email': fallback_email, 'phone': fallback_phone}
+            return TechContact(email=fallback_email, phone=fallback_phone)
         
-        return {'name': '', 'email': '', 'phone': ''}
+        return TechContact()
 
-def send_to_google_sheets_v4(call_data, extracted_vars, call_summary, tech_data):
+@stage('adaptive', 'sheet_write')
+def send_to_google_sheets_v4(call_data, extracted_vars, call_summary, tech_data, deadline=None):
     """
     Send call analysis data to the fourth Google Sheets using Google Apps Script Web App (Adaptive Climate)
     """
@@ -452,28 +496,30 @@ def send_to_google_sheets_v4(call_data, extracted_vars, call_summary, tech_data)
         transcript = call_data.get('transcript', '')
         
         # Prepare data for Google Sheets with the new variables
-        sheet_data = {
-            'timestamp': datetime.now().isoformat(),
-            'call_id': call_data.get('call_id', ''),
-            'agent_name': call_data.get('agent_name', ''),
-            'call_duration': call_data.get('duration_ms', 0),
-            'user_sentiment': call_data.get('call_analysis', {}).get('user_sentiment', ''),
-            'call_successful': call_data.get('call_analysis', {}).get('call_successful', False),
-            'call_summary': call_summary,
-            'transcript': transcript,
+        sheet_data = AdaptiveSheetRow(
+            timestamp=datetime.now().isoformat(),
+            call_id=call_data.get('call_id', ''),
+            agent_name=call_data.get('agent_name', ''),
+            call_duration=call_data.get('duration_ms', 0),
+            user_sentiment=call_data.get('call_analysis', {}).get('user_sentiment', ''),
+            call_successful=call_data.get('call_analysis', {}).get('call_successful', False),
+            call_summary=call_summary,
+            transcript=transcript,
             # New variables for this webhook
-            'fromNumber': extracted_vars.get('fromNumber', ''),
-            'customerName': extracted_vars.get('customerName', ''),
-            'serviceAddress': extracted_vars.get('serviceAddress', ''),
-            'callSummary': extracted_vars.get('callSummary', call_summary),  # Fallback to call_summary
-            'email': tech_data.get('email', '') or extracted_vars.get('email', ''),  # Prefer API email
-            'phone': tech_data.get('phone', ''),  # Tech phone from API
-            'techName': tech_data.get('name', ''),  # Tech name from API
+            fromNumber=extracted_vars.get('fromNumber', ''),
+            customerName=extracted_vars.get('customerName', ''),
+            serviceAddress=extracted_vars.get('serviceAddress', ''),
+            callSummary=extracted_vars.get('callSummary', call_summary),  # Fallback to call_summary
+            email=tech_data.get('email', '') or extracted_vars.get('email', ''),  # Prefer API email
+            phone=tech_data.get('phone', ''),  # Tech phone from API
+            techName=tech_data.get('name', ''),  # Tech name from API
             # Emergency variables
-            'isitEmergency': extracted_vars.get('isitEmergency', ''),
-            'emergencyType': extracted_vars.get('emergencyType', ''),
-            'start_timestamp': call_data.get('start_timestamp', '')
-        }
+            isitEmergency=extracted_vars.get('isitEmergency', ''),
+            emergencyType=extracted_vars.get('emergencyType', ''),
+            start_timestamp=call_data.get('start_timestamp', ''),
+            # Deterministic per call + pipeline so retried/backfilled writes can be dropped by Apps Script
+            idempotency_key=idempotency_key(call_data.get('call_id', ''), SHEETS_PIPELINE_VERSION),
+        )
         
         # Log the data being sent for debugging
         print(f"[SHEETS4] Data being sent:")
@@ -486,19 +532,21 @@ def send_to_google_sheets_v4(call_data, extracted_vars, call_summary, tech_data)
         print(f"[SHEETS4] Tech data used - name: '{tech_data.get('name', '')}', email: '{tech_data.get('email', '')}', phone: '{tech_data.get('phone', '')}'")
         
         # Convert to JSON and encode
-        data = json.dumps(sheet_data).encode('utf-8')
+        data = sheet_data.to_json()
         
         # Create request
         req = urllib.request.Request(
             sheets_url,
             data=data,
-            headers={'Content-Type': 'application/json'}
+            headers=sheet_headers(sheet_data.get(IDEMPOTENCY_FIELD))
         )
         
         # Send request
-        with urllib.request.urlopen(req, timeout=10) as response:
+        with open_url(req, timeout=10, deadline=deadline) as response:
             result = response.read().decode('utf-8')
             print(f"[SHEETS4] Data sent successfully: {result}")
+            # Written: this is what reconcile counts as processed (a dedup claim alone is not)
+            mark_completed(TENANT.key, sheet_data['call_id'], sheet_data.get(IDEMPOTENCY_FIELD))
             return True
             
     except Exception as e:
@@ -508,96 +556,12 @@ def send_to_google_sheets_v4(call_data, extracted_vars, call_summary, tech_data)
 class handler(BaseHTTPRequestHandler):
     def is_duplicate_call(self, call_data):
         """Check if this call has already been processed using content hash"""
-        try:
-            # Create a hash of the relevant call data
-            call_id = call_data.get('call_id', '')
-            call_analysis = call_data.get('call_analysis', {})
-            custom_data = call_analysis.get('custom_analysis_data', {})
-            collected_vars = call_data.get('collected_dynamic_variables', {})
-            
-            # Create hash from call_id + variables + timestamp (rounded to minute)
-            hash_content = {
-                'call_id': call_id,
-                'custom_data': str(custom_data),
-                'collected_vars': str(collected_vars),
-                'timestamp_minute': int(call_data.get('start_timestamp', 0) / 60000)  # Round to minute
-            }
-            
-            content_hash = hashlib.md5(json.dumps(hash_content, sort_keys=True).encode()).hexdigest()
-            
-            # Load processed calls
-            processed_calls = self.load_processed_calls()
-            
-            # Check if already processed
-            if content_hash in processed_calls:
-                print(f"[SHEETS4] Found duplicate hash: {content_hash}")
-                return True
-            
-            # Mark as processed
-            processed_calls[content_hash] = {
-                'call_id': call_id,
-                'processed_at': datetime.now().isoformat(),
-                'timestamp': call_data.get('start_timestamp', 0)
-            }
-            
-            # Clean old entries (keep only last 1000 and last 24 hours)
-            self.cleanup_processed_calls(processed_calls)
-            
-            # Save updated list
-            self.save_processed_calls(processed_calls)
-            
-            print(f"[SHEETS4] New call hash: {content_hash}")
-            return False
-            
-        except Exception as e:
-            print(f"[SHEETS4 ERROR] Error checking duplicate: {e}")
-            return False  # If error, allow processing to continue
+        return DEDUP.is_duplicate(call_data)
 
-    def load_processed_calls(self):
-        """Load processed calls from file"""
-        try:
-            if os.path.exists(PROCESSED_CALLS_FILE):
-                with open(PROCESSED_CALLS_FILE, 'r') as f:
-                    return json.load(f)
-        except Exception as e:
-            print(f"[SHEETS4 ERROR] Error loading processed calls: {e}")
-        return {}
-
-    def save_processed_calls(self, processed_calls):
-        """Save processed calls to file"""
-        try:
-            with open(PROCESSED_CALLS_FILE, 'w') as f:
-                json.dump(processed_calls, f)
-        except Exception as e:
-            print(f"[SHEETS4 ERROR] Error saving processed calls: {e}")
-
-    def cleanup_processed_calls(self, processed_calls):
-        """Clean up old processed calls to prevent file from growing too large"""
-        try:
-            current_time = datetime.now()
-            cutoff_time = current_time.timestamp() * 1000 - (24 * 60 * 60 * 1000)  # 24 hours ago in milliseconds
-            
-            # Remove entries older than 24 hours
-            to_remove = []
-            for hash_key, data in processed_calls.items():
-                if data.get('timestamp', 0) < cutoff_time:
-                    to_remove.append(hash_key)
-            
-            for key in to_remove:
-                del processed_calls[key]
-            
-            # Keep only the most recent 1000 entries
-            if len(processed_calls) > 1000:
-                sorted_items = sorted(processed_calls.items(), 
-                                    key=lambda x: x[1].get('timestamp', 0), 
-                                    reverse=True)
-                processed_calls.clear()
-                processed_calls.update(dict(sorted_items[:1000]))
-                
-            print(f"[SHEETS4] Cleaned up processed calls, {len(processed_calls)} entries remaining")
-            
-        except Exception as e:
-            print(f"[SHEETS4 ERROR] Error cleaning up processed calls: {e}")
+    def release_call(self, call_data):
+        """Give up this request's dedup claim after a failure, so Retell's retry is processed"""
+        if call_data is not None:
+            DEDUP.release(call_data)
 
     def do_GET(self):
         """Handle GET requests (health check)"""
@@ -614,34 +578,62 @@ class handler(BaseHTTPRequestHandler):
             "escalation_flow": "On-call tech → John McLean → Alex Kovachev → John McLean (2 numbers) → Brian Kerr → John McLean (continuous)",
             "endpoints": {
                 "POST /": "Process call analysis data and send to Google Sheets v4 with escalation automation"
-            }
+            },
+            # Observed dependency latency and the timeouts learned from it
+            "latency": latency_report()
         }
-        self.wfile.write(json.dumps(response).encode())
+        self.wfile.write(dumps(response))
 
+    @profiled('adaptive')
     def do_POST(self):
         """Handle POST requests - process call analysis and send to Google Sheets v4"""
+        deadline = Deadline()
+        # The call this request holds a dedup claim on, released if processing fails
+        claimed = None
         try:
             # Read the request body
-            content_length = int(self.headers.get('Content-Length', 0))
-            if content_length > 0:
-                post_data = self.rfile.read(content_length)
-                body_str = post_data.decode('utf-8')
-                body = json.loads(body_str)
-            else:
-                body_str = '{}'
+            # Oversized bodies are refused before a byte is read; the rest is read into one buffer
+            rejection = check_body_size(self.headers)
+            post_data = read_body(self.rfile, self.headers) if rejection is None else b''
+
+            # Reject forged or replayed webhooks before parsing or any outbound work
+            rejection = rejection or check_retell_signature(post_data, self.headers)
+            if rejection:
+                status, response_data = rejection
+                self.send_response(status)
+                self.send_header('Content-type', 'application/json')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                self.wfile.write(encode_response(response_data, self.headers))
+                return
+
+            # Keep the accepted request as it arrived when CAPTURE_DIR is set
+            capture_request(self.path, self.headers, post_data)
+
+            # Only call_analyzed needs the whole document; other events are answered from the sniffed `event`
+            event_hint = sniff_event(post_data) if post_data else None
+            if not post_data:
                 body = {}
+            elif event_hint is not None and event_hint != 'call_analyzed':
+                body = {"event": event_hint, "call": {"call_id": sniff_call_id(post_data) or "unknown"}}
+            else:
+                body = loads(post_data)
             
             # Forward to API gateway (non-blocking, only for call_started, call_ended, and call_analyzed)
             signature_header = self.headers.get('x-retell-signature', '') or self.headers.get('X-Retell-Signature', '')
             try:
-                forward_to_api_gateway(body_str, signature_header)
+                forward_to_api_gateway(post_data, signature_header, deadline=deadline, event_type=body.get("event", ""))
             except Exception as fwd_err:
                 # Isolated guard — forwarding errors must never affect the main response
                 print(f"[API_GATEWAY] Unexpected forwarding error (ignored): {fwd_err}")
+            # Forwarded and parsed: the raw bytes are no longer needed
+            del post_data
             
             # Extract event information
             event_type = body.get("event", "unknown")
-            call_data = body.get("call", {})
+            # Keep only what the pipeline reads so transcripts, word timings and tool chatter can be freed early
+            call_data = project(body.get("call", {}), CALL_FIELDS)
+            del body
             call_id = call_data.get("call_id", "unknown")
             
             print(f"[SHEETS4 API] Received event: {event_type}, Call ID: {call_id}")
@@ -649,7 +641,7 @@ class handler(BaseHTTPRequestHandler):
             # Only process call_analyzed events
             if event_type == "call_analyzed":
                 # Check for duplicate processing
-                if self.is_duplicate_call(call_data):
+                if record_dedup('adaptive', self.is_duplicate_call(call_data)):
                     print(f"[SHEETS4] Duplicate call detected, skipping processing for {call_id}")
                     response_data = {
                         "status": "skipped",
@@ -660,8 +652,9 @@ class handler(BaseHTTPRequestHandler):
                     self.send_header('Content-type', 'application/json')
                     self.send_header('Access-Control-Allow-Origin', '*')
                     self.end_headers()
-                    self.wfile.write(json.dumps(response_data).encode())
+                    self.wfile.write(encode_response(response_data, self.headers))
                     return
+                claimed = call_data
                 
                 analysis = call_data.get("call_analysis", {})
                 call_summary = analysis.get("call_summary", "")
@@ -673,7 +666,7 @@ class handler(BaseHTTPRequestHandler):
                 print(f"[SHEETS4 API] INITIAL EXTRACTED VARIABLES: {extracted_vars}")
 
                 # Re-fetch from Retell API if critical fields are missing
-                call_data, extracted_vars = ensure_complete_data(call_data, extracted_vars)
+                call_data, extracted_vars = ensure_complete_data(call_data, extracted_vars, deadline=deadline)
                 analysis = call_data.get("call_analysis", {})
                 call_summary = analysis.get("call_summary", "") or call_summary
                 print(f"[SHEETS4 API] FINAL EXTRACTED VARIABLES: {extracted_vars}")
@@ -681,16 +674,16 @@ class handler(BaseHTTPRequestHandler):
                 # Get tech data from Adaptive Climate API
                 try:
                     print(f"[SHEETS4] Calling get_tech_data_from_adaptive_climate_api()...")
-                    tech_data = get_tech_data_from_adaptive_climate_api()
-                    if not isinstance(tech_data, dict):
-                        tech_data = {'name': '', 'email': '', 'phone': ''}
+                    tech_data = get_tech_data_from_adaptive_climate_api(deadline=deadline)
+                    if not isinstance(tech_data, TechContact):
+                        tech_data = TechContact()
                     print(f"[SHEETS4] Tech data from API: {tech_data}")
                     print(f"[SHEETS4] Tech data name: '{tech_data.get('name', '')}'")
                     print(f"[SHEETS4] Tech data email: '{tech_data.get('email', '')}'")
                     print(f"[SHEETS4] Tech data phone: '{tech_data.get('phone', '')}'")
                 except Exception as e:
                     print(f"[SHEETS4] Error getting tech data: {e}")
-                    tech_data = {'name': '', 'email': '', 'phone': ''}
+                    tech_data = TechContact()
                 
                 # Log successful extractions
                 non_empty_vars = {k: v for k, v in extracted_vars.items() if v}
@@ -701,9 +694,11 @@ class handler(BaseHTTPRequestHandler):
                 
                 # Send to Google Sheets
                 try:
-                    success = send_to_google_sheets_v4(call_data, extracted_vars, call_summary, tech_data)
+                    success = send_to_google_sheets_v4(call_data, extracted_vars, call_summary, tech_data, deadline=deadline)
                     
                     if success:
+                        # Only a handled delivery makes its signature a replay; a failed one is retried
+                        accept_signature(self.headers)
                         response_data = {
                             "status": "success",
                             "message": "Data sent to Google Sheets v4 (Adaptive Climate)",
@@ -720,6 +715,8 @@ class handler(BaseHTTPRequestHandler):
                         }
                         self.send_response(200)
                     else:
+                        # The row carries an idempotency key, so a retry cannot duplicate it
+                        self.release_call(claimed)
                         response_data = {
                             "status": "partial_success",
                             "message": "Data may have been sent to Google Sheets but response failed",
@@ -730,6 +727,7 @@ class handler(BaseHTTPRequestHandler):
                         
                 except Exception as e:
                     print(f"[SHEETS4 API ERROR] Exception in Google Sheets operation: {e}")
+                    self.release_call(claimed)
                     response_data = {
                         "status": "partial_success", 
                         "message": "Data processing completed but response generation failed",
@@ -741,7 +739,7 @@ class handler(BaseHTTPRequestHandler):
                 self.send_header('Content-type', 'application/json')
                 self.send_header('Access-Control-Allow-Origin', '*')
                 self.end_headers()
-                self.wfile.write(json.dumps(response_data).encode())
+                self.wfile.write(encode_response(response_data, self.headers))
                 
             else:
                 # Not a call_analyzed event, return success but no action
@@ -754,25 +752,26 @@ class handler(BaseHTTPRequestHandler):
                 self.send_header('Content-type', 'application/json')
                 self.send_header('Access-Control-Allow-Origin', '*')
                 self.end_headers()
-                self.wfile.write(json.dumps(response_data).encode())
+                self.wfile.write(encode_response(response_data, self.headers))
             
-        except json.JSONDecodeError as e:
+        except JSONDecodeError as e:
             print(f"[SHEETS4 API ERROR] Invalid JSON payload: {e}")
             self.send_response(400)
             self.send_header('Content-type', 'application/json')
             self.send_header('Access-Control-Allow-Origin', '*')
             self.end_headers()
             error_response = {"error": "Invalid JSON payload"}
-            self.wfile.write(json.dumps(error_response).encode())
+            self.wfile.write(dumps(error_response))
             
         except Exception as e:
             print(f"[SHEETS4 API ERROR] Processing failed: {e}")
+            self.release_call(claimed)
             self.send_response(500)
             self.send_header('Content-type', 'application/json')
             self.send_header('Access-Control-Allow-Origin', '*')
             self.end_headers()
             error_response = {"error": "Internal Server Error"}
-            self.wfile.write(json.dumps(error_response).encode())
+            self.wfile.write(dumps(error_response))
 
     def do_OPTIONS(self):
         """Handle OPTIONS requests (CORS preflight)"""
@@ -1,30 +1,64 @@
 from http.server import BaseHTTPRequestHandler
-import json
 import os
 from datetime import datetime
 import urllib.request
 import urllib.parse
 
-def forward_to_api_gateway(body_str, signature_header):
+from api._lib.body import check_body_size, read_body
+from api._lib.capture import capture_request
+from api._lib.codec import JSONDecodeError, dumps, loads
+from api._lib.completions import mark_completed
+from api._lib.deadline import Deadline
+from api._lib.idempotency import IDEMPOTENCY_FIELD, idempotency_key, sheet_headers
+from api._lib.latency import latency_report
+from api._lib.metrics import stage
+from api._lib.oncall_snapshot import lookup_timeout, remember_tech, snapshot_tech
+from api._lib.outbound import open_url
+from api._lib.profiling import profiled
+from api._lib.projection import call_fields, keep_keys, keep_tool_calls, project
+from api._lib.records import EliteFireSheetRow, EliteFireVars, TechContact
+from api._lib.responses import encode_response
+from api._lib.signature import accept_signature, check_retell_signature
+from api._lib.sniff import sniff_call_id, sniff_event
+from api._lib.tenants import get_tenant
+
+TENANT = get_tenant('elitefire')
+
+# Part of every row's idempotency key; bump it in tenants.json when the row layout or meaning changes
+SHEETS_PIPELINE_VERSION = TENANT.pipeline_version
+
+# The parts of a call this pipeline reads; the rest is dropped at parse time
+CALL_FIELDS = call_fields(
+    'call_id', 'agent_name', 'duration_ms', 'call_analysis', 'collected_dynamic_variables', 'recording_url',
+    # Method 5 reads the extracted variables straight off the call object
+    'fromNumber', 'customerName', 'serviceAddress', 'callSummary', 'email',
+    call_cost=keep_keys('combined_cost'),
+    transcript_with_tool_calls=keep_tool_calls,
+)
+
+@stage('elitefire', 'forward')
+def forward_to_api_gateway(body, signature_header, deadline=None, event_type=None):
     """Forward webhook to API gateway synchronously before responding.
-    Must complete within the serverless request lifecycle."""
+    Must complete within the serverless request lifecycle.
+    ``body`` is the raw request body; pass ``event_type`` when it is already known."""
     api_gateway_url = os.environ.get('API_GATEWAY_URL', '').strip()
     if not api_gateway_url:
         return
 
-    event_type = None
-    try:
-        body_dict = json.loads(body_str)
-        event_type = body_dict.get("event", "")
-    except:
-        pass
+    if event_type is None:
+        event_type = sniff_event(body)
+    if event_type is None:
+        try:
+            event_type = loads(body).get("event", "")
+        except:
+            pass
 
     # Only forward call_started, call_ended, and call_analyzed events
     if event_type not in ["call_started", "call_ended", "call_analyzed"]:
         return
 
     try:
-        data = body_str.encode('utf-8')
+        data = body.encode('utf-8') if isinstance(body, str) else body
         req = urllib.request.Request(
             api_gateway_url,
             data=data,
@@ -33,25 +67,19 @@ def forward_to_api_gateway(body_str, signature_header):
                 'x-retell-signature': signature_header or ''
             }
         )
-        with urllib.request.urlopen(req, timeout=3) as response:
+        with open_url(req, timeout=3, deadline=deadline) as response:
             print(f"[API_GATEWAY] Forwarded {event_type} event, status: {response.status}")
     except Exception as e:
         # Swallow errors — forward failures must never block the main webhook response
         print(f"[API_GATEWAY] Error forwarding webhook: {e}")
 
+@stage('elitefire', 'extract')
 def extract_variables_v5(call_data):
     """
     Extract dynamic variables for the fifth webhook (EliteFire)
     Variables: fromNumber, customerName, serviceAddress, callSummary, email, recording_url
     """
-    variables = {
-        'fromNumber': '',
-        'customerName': '',
-        'serviceAddress': '',
-        'callSummary': '',
-        'email': '',
-        'recording_url': ''
-    }
+    variables = EliteFireVars()
     
     # Method 1: collected_dynamic_variables (primary location)
     collected_vars = call_data.get('collected_dynamic_variables', {})
@@ -94,14 +122,14 @@ def extract_variables_v5(call_data):
                         content = entry.get('content', '')
                         if content:
                             try:
-                                result = json.loads(content)
+                                result = loads(content)
                                 if isinstance(result, dict):
                                     source_vars = result.get('variables', result)
                                     for key in ['fromNumber', 'customerName', 'serviceAddress', 'callSummary', 'email']:
                                         if key in source_vars and source_vars[key]:
                                             variables[key] = str(source_vars[key])
                                     break
-                            except (json.JSONDecodeError, TypeError):
+                            except (JSONDecodeError, TypeError):
                                 continue
     
     # Method 4: Look for any tool_call_result with variables (broader search)
@@ -113,7 +141,7 @@ def extract_variables_v5(call_data):
                     content = entry.get('content', '')
                     if content:
                         try:
-                            result = json.loads(content)
+                            result = loads(content)
                             if isinstance(result, dict):
                                 found_vars = False
                                 for key in ['fromNumber', 'customerName', 'serviceAddress', 'callSummary', 'email']:
@@ -122,7 +150,7 @@ def extract_variables_v5(call_data):
                                         found_vars = True
                                 if found_vars:
                                     break
-                        except (json.JSONDecodeError, TypeError):
+                        except (JSONDecodeError, TypeError):
                             continue
     
     # Method 5: Direct fields in call_data (last resort)
@@ -132,19 +160,19 @@ def extract_variables_v5(call_data):
     
     return variables
 
-def get_email_from_api_v5():
+@stage('elitefire', 'tech_lookup')
+def get_email_from_api_v5(deadline=None):
     """
     Get email from the EliteFire API endpoint
     Uses the EliteFire API endpoint
     """
+    api_url = TENANT.tech_api()
     try:
-        api_url = "https://elitefire-dwa7rawf3-mahees-projects-2df6704a.vercel.app/api/assignments"
-        
-        with urllib.request.urlopen(api_url, timeout=10) as response:
-            data = response.read().decode('utf-8')
+        with open_url(api_url, timeout=lookup_timeout(api_url, 10), deadline=deadline) as response:
+            data = response.read()
             
             try:
-                json_data = json.loads(data)
+                json_data = loads(data)
                 print(f"[EMAIL API V5] Received data: {json_data}")
                 
                 # Check if assignments exist and is not empty
@@ -161,23 +189,31 @@ def get_email_from_api_v5():
                         if tech and tech.get('email'):
                             email = tech['email']
                             print(f"[EMAIL API V5] Found email: {email}")
+                            remember_tech(api_url, TechContact(email=email))
                             return email
                 
                 print("[EMAIL API V5] No valid email found in assignments")
                 return ''
                 
-            except json.JSONDecodeError as e:
+            except JSONDecodeError as e:
                 print(f"[EMAIL API V5 ERROR] Failed to parse JSON: {e}")
                 # If not JSON, check if the response itself is an email
+                data = data.decode('utf-8')
                 if '@' in data and '.' in data:
                     return data.strip()
                 return ''
                 
     except Exception as e:
         print(f"[EMAIL API V5 ERROR] Failed to fetch email: {e}")
+        # Fall back to the last email the API returned, if it is recent enough
+        snapshot = snapshot_tech(api_url)
+        if snapshot and snapshot['email']:
+            print(f"[EMAIL API V5] Using stale snapshot from {snapshot['snapshot_at']}: {snapshot['email']}")
+            return snapshot['email']
         return ''
 
-def send_to_google_sheets_v5(call_data, extracted_vars, call_summary):
+@stage('elitefire', 'sheet_write')
+def send_to_google_sheets_v5(call_data, extracted_vars, call_summary, deadline=None):
     """
     Send call analysis data to the fifth Google Sheets using Google Apps Script Web App (EliteFire)
     """
@@ -192,27 +228,29 @@ def send_to_google_sheets_v5(call_data, extracted_vars, call_summary):
             return False
         
         # Get email from external API
-        email_from_api = get_email_from_api_v5()
+        email_from_api = get_email_from_api_v5(deadline=deadline)
         print(f"[SHEETS5] Email from API: {email_from_api}")
         
         # Prepare data for Google Sheets with the new variables
-        sheet_data = {
-            'timestamp': datetime.now().isoformat(),
-            'call_id': call_data.get('call_id', ''),
-            'agent_name': call_data.get('agent_name', ''),
-            'call_duration': call_data.get('duration_ms', 0),
-            'call_cost': call_data.get('call_cost', {}).get('combined_cost', 0),
-            'user_sentiment': call_data.get('call_analysis', {}).get('user_sentiment', ''),
-            'call_successful': call_data.get('call_analysis', {}).get('call_successful', False),
-            'call_summary': call_summary,
+        sheet_data = EliteFireSheetRow(
+            timestamp=datetime.now().isoformat(),
+            call_id=call_data.get('call_id', ''),
+            agent_name=call_data.get('agent_name', ''),
+            call_duration=call_data.get('duration_ms', 0),
+            call_cost=call_data.get('call_cost', {}).get('combined_cost', 0),
+            user_sentiment=call_data.get('call_analysis', {}).get('user_sentiment', ''),
+            call_successful=call_data.get('call_analysis', {}).get('call_successful', False),
+            call_summary=call_summary,
             # Variables for this webhook (same as v2 plus recording_url)
-            'fromNumber': extracted_vars.get('fromNumber', ''),
-            'customerName': extracted_vars.get('customerName', ''),
-            'serviceAddress': extracted_vars.get('serviceAddress', ''),
-            'callSummary': extracted_vars.get('callSummary', call_summary),  # Fallback to call_summary
-            'email': email_from_api or extracted_vars.get('email', ''),  # Prefer API email
-            'recording_url': extracted_vars.get('recording_url', '')  # New variable
-        }
+            fromNumber=extracted_vars.get('fromNumber', ''),
+            customerName=extracted_vars.get('customerName', ''),
+            serviceAddress=extracted_vars.get('serviceAddress', ''),
+            callSummary=extracted_vars.get('callSummary', call_summary),  # Fallback to call_summary
+            email=email_from_api or extracted_vars.get('email', ''),  # Prefer API email
+            recording_url=extracted_vars.get('recording_url', ''),  # New variable
+            # Deterministic per call + pipeline so retried/backfilled writes can be dropped by Apps Script
+            idempotency_key=idempotency_key(call_data.get('call_id', ''), SHEETS_PIPELINE_VERSION),
+        )
         
         # Log the data being sent for debugging
         print(f"[SHEETS5] Data being sent:")
@@ -223,19 +261,21 @@ def send_to_google_sheets_v5(call_data, extracted_vars, call_summary):
         print(f"[SHEETS5] recording_url: '{sheet_data.get('recording_url')}'")
         
         # Convert to JSON and encode
-        data = json.dumps(sheet_data).encode('utf-8')
+        data = sheet_data.to_json()
         
         # Create request
         req = urllib.request.Request(
             sheets_url,
             data=data,
-            headers={'Content-Type': 'application/json'}
+            headers=sheet_headers(sheet_data.get(IDEMPOTENCY_FIELD))
         )
         
         # Send request
-        with urllib.request.urlopen(req, timeout=10) as response:
+        with open_url(req, timeout=10, deadline=deadline) as response:
             result = response.read().decode('utf-8')
             print(f"[SHEETS5] Data sent successfully: {result}")
+            # Written: this is what reconcile counts as processed (a dedup claim alone is not)
+            mark_completed(TENANT.key, sheet_data['call_id'], sheet_data.get(IDEMPOTENCY_FIELD))
             return True
             
     except Exception as e:
@@ -254,37 +294,63 @@ class handler(BaseHTTPRequestHandler):
             "message": "Google Sheets Integration API v5 (EliteFire)",
             "status": "healthy",
             "variables": ["fromNumber", "customerName", "serviceAddress", "callSummary", "email", "recording_url"],
-            "api_endpoint": "https://elitefire-dwa7rawf3-mahees-projects-2df6704a.vercel.app/api/assignments",
+            "api_endpoint": TENANT.tech_api(),
             "endpoints": {
                 "POST /": "Process call analysis data and send to Google Sheets v5"
-            }
+            },
+            # Observed dependency latency and the timeouts learned from it
+            "latency": latency_report()
         }
-        self.wfile.write(json.dumps(response).encode())
+        self.wfile.write(dumps(response))
 
+    @profiled('elitefire')
     def do_POST(self):
         """Handle POST requests - process call analysis and send to Google Sheets v5"""
+        deadline = Deadline()
         try:
             # Read the request body
-            content_length = int(self.headers.get('Content-Length', 0))
-            if content_length > 0:
-                post_data = self.rfile.read(content_length)
-                body_str = post_data.decode('utf-8')
-                body = json.loads(body_str)
-            else:
-                body_str = '{}'
+            # Oversized bodies are refused before a byte is read; the rest is read into one buffer
+            rejection = check_body_size(self.headers)
+            post_data = read_body(self.rfile, self.headers) if rejection is None else b''
+
+            # Reject forged or replayed webhooks before parsing or any outbound work
+            rejection = rejection or check_retell_signature(post_data, self.headers)
+            if rejection:
+                status, response_data = rejection
+                self.send_response(status)
+                self.send_header('Content-type', 'application/json')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                self.wfile.write(encode_response(response_data, self.headers))
+                return
+
+            # Keep the accepted request as it arrived when CAPTURE_DIR is set
+            capture_request(self.path, self.headers, post_data)
+
+            # Only call_analyzed needs the whole document; other events are answered from the sniffed `event`
+            event_hint = sniff_event(post_data) if post_data else None
+            if not post_data:
                 body = {}
+            elif event_hint is not None and event_hint != 'call_analyzed':
+                body = {"event": event_hint, "call": {"call_id": sniff_call_id(post_data) or "unknown"}}
+            else:
+                body = loads(post_data)
             
             # Forward to API gateway (non-blocking, only for call_started, call_ended, and call_analyzed)
             signature_header = self.headers.get('x-retell-signature', '') or self.headers.get('X-Retell-Signature', '')
             try:
-                forward_to_api_gateway(body_str, signature_header)
+                forward_to_api_gateway(post_data, signature_header, deadline=deadline, event_type=body.get("event", ""))
             except Exception as fwd_err:
                 # Isolated guard — forwarding errors must never affect the main response
                 print(f"[API_GATEWAY] Unexpected forwarding error (ignored): {fwd_err}")
+            # Forwarded and parsed: the raw bytes are no longer needed
+            del post_data
             
             # Extract event information
             event_type = body.get("event", "unknown")
-            call_data = body.get("call", {})
+            # Keep only what the pipeline reads so transcripts, word timings and tool chatter can be freed early
+            call_data = project(body.get("call", {}), CALL_FIELDS)
+            del body
             call_id = call_data.get("call_id", "unknown")
             
             print(f"[SHEETS5 API] Received event: {event_type}, Call ID: {call_id}")
@@ -324,9 +390,11 @@ class handler(BaseHTTPRequestHandler):
                     print(f"[SHEETS5 API] ERROR: No variables extracted for call {call_id}")
                 
                 # Send to Google Sheets
-                success = send_to_google_sheets_v5(call_data, extracted_vars, call_summary)
+                success = send_to_google_sheets_v5(call_data, extracted_vars, call_summary, deadline=deadline)
                 
                 if success:
+                    # Only a handled delivery makes its signature a replay; a failed one is retried
+                    accept_signature(self.headers)
                     response_data = {
                         "status": "success",
                         "message": "Data sent to Google Sheets v5 (EliteFire)",
@@ -345,7 +413,7 @@ class handler(BaseHTTPRequestHandler):
                 self.send_header('Content-type', 'application/json')
                 self.send_header('Access-Control-Allow-Origin', '*')
                 self.end_headers()
-                self.wfile.write(json.dumps(response_data).encode())
+                self.wfile.write(encode_response(response_data, self.headers))
                 
             else:
                 # Not a call_analyzed event, return success but no action
@@ -358,16 +426,16 @@ class handler(BaseHTTPRequestHandler):
                 self.send_header('Content-type', 'application/json')
                 self.send_header('Access-Control-Allow-Origin', '*')
                 self.end_headers()
-                self.wfile.write(json.dumps(response_data).encode())
+                self.wfile.write(encode_response(response_data, self.headers))
             
-        except json.JSONDecodeError as e:
+        except JSONDecodeError as e:
             print(f"[SHEETS5 API ERROR] Invalid JSON payload: {e}")
             self.send_response(400)
             self.send_header('Content-type', 'application/json')
             self.send_header('Access-Control-Allow-Origin', '*')
             self.end_headers()
             error_response = {"error": "Invalid JSON payload"}
-            self.wfile.write(json.dumps(error_response).encode())
+            self.wfile.write(dumps(error_response))
             
         except Exception as e:
             print(f"[SHEETS5 API ERROR] Processing failed: {e}")
@@ -376,7 +444,7 @@ class handler(BaseHTTPRequestHandler):
             self.send_header('Access-Control-Allow-Origin', '*')
             self.end_headers()
             error_response = {"error": "Internal Server Error"}
-            self.wfile.write(json.dumps(error_response).encode())
+            self.wfile.write(dumps(error_response))
 
     def do_OPTIONS(self):
         """Handle OPTIONS requests (CORS preflight)"""
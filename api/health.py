@@ -1,19 +1,29 @@
 from http.server import BaseHTTPRequestHandler
-import json
+import urllib.parse
+
+from api._lib.codec import dumps
+from api._lib.probes import deep_health
 
 
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
-        self.send_response(200)
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        if query.get('deep', [''])[0] in ('1', 'true', 'yes'):
+            response = deep_health()
+            response["service"] = "vercel-webhook-integration"
+            status = 503 if response["status"] == "degraded" else 200
+        else:
+            response = {
+                "status": "healthy",
+                "service": "vercel-webhook-integration"
+            }
+            status = 200
+
+        self.send_response(status)
         self.send_header('Content-type', 'application/json')
         self.send_header('Access-Control-Allow-Origin', '*')
         self.end_headers()
-
-        response = {
-            "status": "healthy",
-            "service": "vercel-webhook-integration"
-        }
-        self.wfile.write(json.dumps(response).encode())
+        self.wfile.write(dumps(response))
 
     def do_OPTIONS(self):
         self.send_response(200)
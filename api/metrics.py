@@ -0,0 +1,28 @@
+from http.server import BaseHTTPRequestHandler
+
+from api._lib.metrics import CONTENT_TYPE, render, snapshot
+
+
+def collect(server):
+    """Series to expose: summed across pre-fork workers under the self-hosted server, else this process."""
+    worker_stats = getattr(server, 'worker_stats', None)
+    if worker_stats is not None:
+        return worker_stats()['totals'].get('metrics', {})
+    return snapshot()
+
+
+class handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render(collect(self.server)).encode()
+        self.send_response(200)
+        self.send_header('Content-type', CONTENT_TYPE)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_OPTIONS(self):
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+        self.end_headers()
@@ -1,5 +1,7 @@
 from http.server import BaseHTTPRequestHandler
-import json
+
+from api._lib.codec import dumps
+from api._lib.tenants import tenants
 
 
 class handler(BaseHTTPRequestHandler):
@@ -9,6 +11,7 @@ class handler(BaseHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Origin', '*')
         self.end_headers()
 
+        registry = tenants()
         response = {
             "service": "CLARA lead capture webhook integration",
             "purpose": "Processes Retell call analysis events and sends normalized data into company-specific Google Sheets automations.",
@@ -17,38 +20,29 @@ class handler(BaseHTTPRequestHandler):
                 "request_type": "JSON webhook payload",
                 "response_behavior": "Returns success when payload is processed or safely skipped."
             },
+            # Generated from the tenant registry (tenants.json)
             "configuration": {
                 "required_environment_variables": [
-                    "PACIFIC_EXEC_URL",
-                    "BRACONIER_EXEC_URL",
-                    "ADAPTIVE_EXEC_URL",
-                    "ELITEFIRE_EXEC_URL"
+                    tenant.sink_env for tenant in registry.values() if tenant.sink_env and tenant.required
                 ],
                 "optional_environment_variables": [
+                    tenant.sink_env for tenant in registry.values() if tenant.sink_env and not tenant.required
+                ] + sorted({tenant.email['key_env'] for tenant in registry.values() if tenant.email.get('key_env')}) + [
                     "FALLBACK_TECH_EMAIL",
                     "FALLBACK_TECH_PHONE"
                 ]
             },
             "company_workflows": [
                 {
-                    "company": "Pacific Western",
-                    "what_it_does": "Extracts caller and job context, resolves technician details, and writes the result into the Pacific workflow sheet."
-                },
-                {
-                    "company": "Braconier",
-                    "what_it_does": "Processes plumbing/HVAC call data, applies fallback logic, and posts structured records into the Braconier workflow sheet."
-                },
-                {
-                    "company": "Adaptive Climate",
-                    "what_it_does": "Handles Adaptive Climate calls, enriches records with technician assignment data, and forwards to the Adaptive sheet flow."
-                },
-                {
-                    "company": "EliteFire",
-                    "what_it_does": "Processes EliteFire calls, includes recording context, and sends final payloads into the EliteFire automation sheet."
+                    "company": tenant.company,
+                    "what_it_does": tenant.description,
+                    "route": tenant.route,
+                    "configured": bool(tenant.sink_url)
                 }
+                for tenant in registry.values()
             ]
         }
-        self.wfile.write(json.dumps(response).encode())
+        self.wfile.write(dumps(response))
 
     def do_OPTIONS(self):
         self.send_response(200)
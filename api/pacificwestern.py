@@ -1,39 +1,76 @@
 from http.server import BaseHTTPRequestHandler
-import json
 import os
 from datetime import datetime
 import urllib.request
 import urllib.parse
 import ssl
-import hashlib
+
+from api._lib.body import check_body_size, read_body
+from api._lib.capture import capture_request
+from api._lib.classifier import infer_emergency_type
+from api._lib.codec import JSONDecodeError, dumps, loads
+from api._lib.completions import mark_completed
+from api._lib.deadline import RESERVE_SECONDS, Deadline
+from api._lib.dedup import deduper
+from api._lib.idempotency import IDEMPOTENCY_FIELD, idempotency_key, sheet_headers
+from api._lib.latency import latency_report
+from api._lib.metrics import record_dedup, stage
+from api._lib.oncall_snapshot import lookup_timeout, remember_tech, snapshot_tech
+from api._lib.outbound import open_url
+from api._lib.profiling import profiled
+from api._lib.projection import call_fields, keep_tool_calls, project
+from api._lib.records import ExtractedVars, PacificSheetRow, TechContact
+from api._lib.responses import encode_response
+from api._lib.signature import accept_signature, check_retell_signature
+from api._lib.sniff import sniff_call_id, sniff_event
+from api._lib.tenants import get_tenant
+
+TENANT = get_tenant('pacific')
 
 # Simple file-based deduplication to persist across serverless invocations
-PROCESSED_CALLS_FILE = '/tmp/processed_calls_sheets2.json'
+PROCESSED_CALLS_FILE = TENANT.dedup_file
+# Shared across instances when DEDUP_BACKEND=redis, else the file above
+DEDUP = deduper(TENANT, 'SHEETS2')
+
+# Part of every row's idempotency key; bump it in tenants.json when the row layout or meaning changes
+SHEETS_PIPELINE_VERSION = TENANT.pipeline_version
+
+# The parts of a call this pipeline reads; the rest is dropped at parse time
+CALL_FIELDS = call_fields(
+    'call_id', 'agent_name', 'duration_ms', 'call_analysis', 'collected_dynamic_variables',
+    'from_number', 'start_timestamp', 'transcript',
+    # Method 5 reads the extracted variables straight off the call object
+    'fromNumber', 'customerName', 'serviceAddress', 'callSummary', 'email', 'isitEmergency', 'emergencyType',
+    transcript_with_tool_calls=keep_tool_calls,
+)
 
-# SendGrid Configuration for Pacific Western emails
-SENDGRID_API_KEY = os.environ.get('SENDGRID_API_KEY', '')
-SENDGRID_FROM_EMAIL = 'developer@justclara.ai'
+# SendGrid Configuration for Pacific Western emails (sender and recipients live in tenants.json)
+SENDGRID_API_KEY = os.environ.get(TENANT.email.get('key_env', 'SENDGRID_API_KEY'), '')
+SENDGRID_FROM_EMAIL = TENANT.email.get('from_email', '')
 
-def forward_to_api_gateway(body_str, signature_header):
+@stage('pacific', 'forward')
+def forward_to_api_gateway(body, signature_header, deadline=None, event_type=None):
     """Forward webhook to API gateway synchronously before responding.
-    Must complete within the serverless request lifecycle."""
+    Must complete within the serverless request lifecycle.
+    ``body`` is the raw request body; pass ``event_type`` when it is already known."""
     api_gateway_url = os.environ.get('API_GATEWAY_URL', '').strip()
     if not api_gateway_url:
         return
 
-    event_type = None
-    try:
-        body_dict = json.loads(body_str)
-        event_type = body_dict.get("event", "")
-    except:
-        pass
+    if event_type is None:
+        event_type = sniff_event(body)
+    if event_type is None:
+        try:
+            event_type = loads(body).get("event", "")
+        except:
+            pass
 
     # Only forward call_started, call_ended, and call_analyzed events
     if event_type not in ["call_started", "call_ended", "call_analyzed"]:
         return
 
     try:
-        data = body_str.encode('utf-8')
+        data = body.encode('utf-8') if isinstance(body, str) else body
         req = urllib.request.Request(
             api_gateway_url,
             data=data,
@@ -42,13 +79,14 @@ def forward_to_api_gateway(body_str, signature_header):
                 'x-retell-signature': signature_header or ''
             }
         )
-        with urllib.request.urlopen(req, timeout=3) as response:
+        with open_url(req, timeout=3, deadline=deadline) as response:
             print(f"[API_GATEWAY] Forwarded {event_type} event, status: {response.status}")
     except Exception as e:
         # Swallow errors — forward failures must never block the main webhook response
         print(f"[API_GATEWAY] Error forwarding webhook: {e}")
-SENDGRID_FROM_NAME = 'Pacific Western - Clara AI'
+SENDGRID_FROM_NAME = TENANT.email.get('from_name', '')
 
+@stage('pacific', 'extract')
 def extract_variables_v2(call_data):
     """
     Extract dynamic variables for the second webhook for Pacific Western
@@ -56,15 +94,7 @@ def extract_variables_v2(call_data):
     
     ENHANCED VERSION: Uses better fallback mappings for caller_phone and other fields
     """
-    variables = {
-        'fromNumber': '',
-        'customerName': '',
-        'serviceAddress': '',
-        'callSummary': '',
-        'email': '',
-        'isitEmergency': '',
-        'emergencyType': ''
-    }
+    variables = ExtractedVars()
     
     def has_values(var_dict):
         """Return True when at least one extracted variable has data."""
@@ -111,6 +141,16 @@ def extract_variables_v2(call_data):
         elif not is_valid_phone(extracted_from_number) and actual_from_number:
             # If extracted phone is invalid but we have from_number, use it
             var_dict['fromNumber'] = str(actual_from_number)
+
+        # Tech routing depends on emergencyType, so infer it from the call text when missing
+        if not var_dict.get('emergencyType'):
+            call_analysis = call_data.get('call_analysis', {})
+            var_dict['emergencyType'] = infer_emergency_type(
+                'pacific',
+                var_dict.get('callSummary', ''),
+                call_analysis.get('custom_analysis_data', {}).get('issue_description', ''),
+                call_analysis.get('call_summary', '')
+            )
         
         return var_dict
     
@@ -249,7 +289,7 @@ def extract_variables_v2(call_data):
                     content = entry.get('content', '')
                     if content:
                         try:
-                            result = json.loads(content)
+                            result = loads(content)
                             if isinstance(result, dict):
                                 source_vars = result.get('variables', result)
                                 for key in variables.keys():
@@ -257,7 +297,7 @@ def extract_variables_v2(call_data):
                                         variables[key] = str(source_vars[key])
                                 if has_values(variables):
                                     return finalize(variables)
-                        except (json.JSONDecodeError, TypeError):
+                        except (JSONDecodeError, TypeError):
                             continue
     
     # Method 4: Look for any tool_call_result with variables (broader search)
@@ -267,7 +307,7 @@ def extract_variables_v2(call_data):
                 content = entry.get('content', '')
                 if content:
                     try:
-                        result = json.loads(content)
+                        result = loads(content)
                         if isinstance(result, dict):
                             found_vars = False
                             for key in variables.keys():
@@ -276,7 +316,7 @@ def extract_variables_v2(call_data):
                                     found_vars = True
                             if found_vars:
                                 return finalize(variables)
-                    except (json.JSONDecodeError, TypeError):
+                    except (JSONDecodeError, TypeError):
                         continue
     
     # Method 5: Direct fields in call_data (last resort)
@@ -297,7 +337,8 @@ def extract_variables_v2(call_data):
 # EMAIL FUNCTIONS FOR PACIFIC WESTERN
 # ============================================
 
-def send_email_via_sendgrid(to_email, cc_emails, subject, html_content):
+@stage('pacific', 'email')
+def send_email_via_sendgrid(to_email, cc_emails, subject, html_content, deadline=None):
     """Send email using SendGrid API"""
     try:
         if not SENDGRID_API_KEY:
@@ -325,7 +366,7 @@ def send_email_via_sendgrid(to_email, cc_emails, subject, html_content):
             "content": [{"type": "text/html", "value": html_content}]
         }
         
-        data = json.dumps(payload).encode('utf-8')
+        data = dumps(payload)
         
         req = urllib.request.Request(
             'https://api.sendgrid.com/v3/mail/send',
@@ -336,7 +377,7 @@ def send_email_via_sendgrid(to_email, cc_emails, subject, html_content):
             }
         )
         
-        with urllib.request.urlopen(req, timeout=15) as response:
+        with open_url(req, timeout=15, deadline=deadline) as response:
             if response.getcode() == 202:
                 print(f"[EMAIL] Successfully sent to {to_email}")
                 return True
@@ -352,7 +393,7 @@ def send_email_via_sendgrid(to_email, cc_emails, subject, html_content):
         return False
 
 
-def send_scheduling_email(caller_name, callback_number, service_address, emergency_type, call_summary):
+def send_scheduling_email(caller_name, callback_number, service_address, emergency_type, call_summary, deadline=None):
     """Send email to scheduling@pwfire.ca when caller declines after-hours rate"""
     html_content = f'''
     <!DOCTYPE html>
@@ -402,14 +443,15 @@ def send_scheduling_email(caller_name, callback_number, service_address, emergen
     '''
     
     return send_email_via_sendgrid(
-        to_email='scheduling@pwfire.ca',
-        cc_emails=['bharath.valusa@justclara.ai'],
+        to_email=TENANT.email['scheduling']['to'],
+        cc_emails=TENANT.email['scheduling'].get('cc', []),
         subject=f'After-Hours Call - Rate Declined - {caller_name or "Customer"}',
-        html_content=html_content
+        html_content=html_content,
+        deadline=deadline
     )
 
 
-def send_reception_email(caller_name, callback_number, inquiry_summary):
+def send_reception_email(caller_name, callback_number, inquiry_summary, deadline=None):
     """Send email to reception@pwfire.ca for general inquiries"""
     html_content = f'''
     <!DOCTYPE html>
@@ -453,14 +495,16 @@ def send_reception_email(caller_name, callback_number, inquiry_summary):
     '''
     
     return send_email_via_sendgrid(
-        to_email='reception@pwfire.ca',
-        cc_emails=['bharath.valusa@justclara.ai'],
+        to_email=TENANT.email['reception']['to'],
+        cc_emails=TENANT.email['reception'].get('cc', []),
         subject=f'After-Hours Message - {caller_name or "Customer"}',
-        html_content=html_content
+        html_content=html_content,
+        deadline=deadline
     )
 
 
-def get_tech_data_from_api(emergency_type=''):
+@stage('pacific', 'tech_lookup')
+def get_tech_data_from_api(emergency_type='', deadline=None):
     """
     Get tech data (email and phone) from the external API endpoints based on emergency type
     Priority based on emergencyType:
@@ -483,29 +527,29 @@ def get_tech_data_from_api(emergency_type=''):
             ssl_context.check_hostname = False
             ssl_context.verify_mode = ssl.CERT_NONE
             
-            with urllib.request.urlopen(api_url, timeout=10, context=ssl_context) as response:
-                data = response.read().decode('utf-8')
+            with open_url(api_url, timeout=lookup_timeout(api_url, 10), context=ssl_context, deadline=deadline) as response:
+                data = response.read()
                 
                 try:
-                    json_data = json.loads(data)
+                    json_data = loads(data)
                     print(f"[{api_name}] Received data: {json_data}")
                     
                     # Handle case where API returns null or non-dict
                     if not isinstance(json_data, dict):
                         print(f"[{api_name}] API returned non-dict data: {type(json_data)}")
-                        return {'email': '', 'phone': ''}
+                        return TechContact()
                     
                     # Check if this is just a status message
                     if 'message' in json_data and 'status' in json_data:
                         print(f"[{api_name}] API returned status message: {json_data.get('message')}")
-                        return {'email': '', 'phone': ''}
+                        return TechContact()
                     
                     # Check if assignments exist and is not empty
                     assignments = json_data.get('assignments', [])
                     
                     if not assignments or len(assignments) == 0:
                         print(f"[{api_name}] No assignments found - empty array")
-                        return {'email': '', 'phone': ''}
+                        return TechContact()
                     
                     # Look through assignments for techs with emails and phones
                     for assignment in assignments:
@@ -524,28 +568,29 @@ def get_tech_data_from_api(emergency_type=''):
                                 email = tech.get('email', '')
                                 phone = tech.get('phone', '')
                                 print(f"[{api_name}] Found - name: {name}, email: {email}, phone: {phone}")
-                                return {'name': name, 'email': email, 'phone': phone}
+                                return TechContact(name, email, phone)
                     
                     print(f"[{api_name}] No valid email or phone found in assignments")
-                    return {'name': '', 'email': '', 'phone': ''}
+                    return TechContact()
                     
-                except json.JSONDecodeError as e:
+                except JSONDecodeError as e:
                     print(f"[{api_name} ERROR] Failed to parse JSON: {e}")
                     # If not JSON, check if the response itself is an email
+                    data = data.decode('utf-8')
                     if '@' in data and '.' in data:
                         email = data.strip()
                         print(f"[{api_name}] Found direct email: {email}")
-                        return {'name': '', 'email': email, 'phone': ''}
-                    return {'name': '', 'email': '', 'phone': ''}
+                        return TechContact(email=email)
+                    return TechContact()
                     
         except Exception as e:
             print(f"[{api_name} ERROR] Failed to fetch data: {e}")
-            return {'name': '', 'email': '', 'phone': ''}
+            return TechContact()
     
     try:
-        # Define API endpoints (unified fetchoncall API)
-        fire_alarm_api = "https://fetchoncall.vercel.app/api/assignments?service=fire-alarm"
-        sprinkler_api = "https://fetchoncall.vercel.app/api/assignments?service=sprinkler"
+        # Define API endpoints (unified fetchoncall API, from the tenant registry)
+        fire_alarm_api = TENANT.tech_api('Fire Alarm')
+        sprinkler_api = TENANT.tech_api('Sprinkler')
         
         # Determine API priority based on emergency type
         if emergency_type == 'Sprinkler':
@@ -572,26 +617,38 @@ def get_tech_data_from_api(emergency_type=''):
         result = try_api_endpoint(primary_api, primary_name)
         
         # Ensure result is a dict
-        if not isinstance(result, dict):
-            result = {'name': '', 'email': '', 'phone': ''}
+        if not isinstance(result, TechContact):
+            result = TechContact()
         
         if result.get('email') or result.get('phone'):
+            remember_tech(primary_api, result)
             print(f"[API] SUCCESS: Got data from {primary_name} - name: {result.get('name', '')}, email: {result.get('email', '')}, phone: {result.get('phone', '')}")
             return result
         
-        # If no data from primary, try fallback API
-        print(f"[API] No data from {primary_name}, trying {fallback_name}...")
-        result = try_api_endpoint(fallback_api, fallback_name)
+        # If no data from primary, try fallback API (optional when the request budget is low)
+        if deadline is not None and not deadline.has(RESERVE_SECONDS):
+            print(f"[API] No data from {primary_name}, skipping {fallback_name}: {deadline}")
+            result = TechContact()
+        else:
+            print(f"[API] No data from {primary_name}, trying {fallback_name}...")
+            result = try_api_endpoint(fallback_api, fallback_name)
         
         # Ensure result is a dict
-        if not isinstance(result, dict):
-            result = {'name': '', 'email': '', 'phone': ''}
+        if not isinstance(result, TechContact):
+            result = TechContact()
         
         if result.get('email') or result.get('phone'):
+            remember_tech(fallback_api, result)
             print(f"[API] SUCCESS: Got data from {fallback_name} - name: {result.get('name', '')}, email: {result.get('email', '')}, phone: {result.get('phone', '')}")
             return result
         
         print("[API] No email or phone found from either API")
+
+        # A recent snapshot of a live answer beats the static fallback
+        snapshot = snapshot_tech(primary_api, fallback_api)
+        if snapshot:
+            print(f"[API] Using stale on-call snapshot from {snapshot['snapshot_at']} - name: {snapshot['name']}, email: {snapshot['email']}, phone: {snapshot['phone']}")
+            return snapshot
         
         # Fallback to environment variables if APIs don't have data
         fallback_email = os.environ.get('FALLBACK_TECH_EMAIL', '')
@@ -599,9 +656,9 @@ def get_tech_data_from_api(emergency_type=''):
         
         if fallback_email or fallback_phone:
             print(f"[API] Using fallback data - email: {fallback_email}, phone: {fallback_phone}")
-            return {'name': '', 'email': fallback_email, 'phone': fallback_phone}
+            return TechContact(email=fallback_email, phone=fallback_phone)
         
-        return {'name': '', 'email': '', 'phone': ''}
+        return TechContact()
         
     except Exception as e:
         print(f"[API ERROR] Exception in get_tech_data_from_api: {e}")
@@ -612,11 +669,12 @@ def get_tech_data_from_api(emergency_type=''):
         
         if fallback_email or fallback_phone:
             print(f"[API] Using fallback data after error - email: {fallback_email}, phone: {fallback_phone}")
-            return {'name': '', 'email': fallback_email, 'phone': fallback_phone}
+            return TechContact(email=fallback_email, phone=fallback_phone)
         
-        return {'name': '', 'email': '', 'phone': ''}
+        return TechContact()
 
-def send_to_google_sheets_v2(call_data, extracted_vars, call_summary, tech_data):
+@stage('pacific', 'sheet_write')
+def send_to_google_sheets_v2(call_data, extracted_vars, call_summary, tech_data, deadline=None):
     """
     Send call analysis data to the second Google Sheets using Google Apps Script Web App
     """
@@ -639,29 +697,31 @@ def send_to_google_sheets_v2(call_data, extracted_vars, call_summary, tech_data)
         rate_approved = collected_vars.get('rateApproved', '')
         call_type = collected_vars.get('callType', '')
         
-        sheet_data = {
-            'timestamp': datetime.now().isoformat(),
-            'call_id': call_data.get('call_id', ''),
-            'agent_name': call_data.get('agent_name', ''),
-            'call_duration': call_data.get('duration_ms', 0),
-            'user_sentiment': call_data.get('call_analysis', {}).get('user_sentiment', ''),
-            'call_successful': call_data.get('call_analysis', {}).get('call_successful', False),
-            'call_summary': call_summary,
-            'transcript': transcript,
+        sheet_data = PacificSheetRow(
+            timestamp=datetime.now().isoformat(),
+            call_id=call_data.get('call_id', ''),
+            agent_name=call_data.get('agent_name', ''),
+            call_duration=call_data.get('duration_ms', 0),
+            user_sentiment=call_data.get('call_analysis', {}).get('user_sentiment', ''),
+            call_successful=call_data.get('call_analysis', {}).get('call_successful', False),
+            call_summary=call_summary,
+            transcript=transcript,
             # New variables for this webhook
-            'fromNumber': extracted_vars.get('fromNumber', ''),
-            'customerName': extracted_vars.get('customerName', ''),
-            'serviceAddress': extracted_vars.get('serviceAddress', ''),
-            'callSummary': extracted_vars.get('callSummary', call_summary),  # Fallback to call_summary
-            'email': tech_data.get('email', ''),  # ONLY from API - no fallback to customer
-            'phone': tech_data.get('phone', ''),  # ONLY from API - no fallback to customer
+            fromNumber=extracted_vars.get('fromNumber', ''),
+            customerName=extracted_vars.get('customerName', ''),
+            serviceAddress=extracted_vars.get('serviceAddress', ''),
+            callSummary=extracted_vars.get('callSummary', call_summary),  # Fallback to call_summary
+            email=tech_data.get('email', ''),  # ONLY from API - no fallback to customer
+            phone=tech_data.get('phone', ''),  # ONLY from API - no fallback to customer
             # Emergency variables
-            'isitEmergency': extracted_vars.get('isitEmergency', ''),
-            'emergencyType': extracted_vars.get('emergencyType', ''),
+            isitEmergency=extracted_vars.get('isitEmergency', ''),
+            emergencyType=extracted_vars.get('emergencyType', ''),
             # Rate approval and call type from LLM dynamic variables
-            'rateApproved': rate_approved,
-            'callType': call_type
-        }
+            rateApproved=rate_approved,
+            callType=call_type,
+            # Deterministic per call + pipeline so retried/backfilled writes can be dropped by Apps Script
+            idempotency_key=idempotency_key(call_data.get('call_id', ''), SHEETS_PIPELINE_VERSION),
+        )
         
         # Log the data being sent for debugging
         print(f"[SHEETS2] Data being sent:")
@@ -682,13 +742,13 @@ def send_to_google_sheets_v2(call_data, extracted_vars, call_summary, tech_data)
         print(f"[SHEETS2] Tech data used - email: '{tech_data.get('email', '')}', phone: '{tech_data.get('phone', '')}'")
         
         # Convert to JSON and encode
-        data = json.dumps(sheet_data).encode('utf-8')
+        data = sheet_data.to_json()
         
         # Create request
         req = urllib.request.Request(
             sheets_url,
             data=data,
-            headers={'Content-Type': 'application/json'}
+            headers=sheet_headers(sheet_data.get(IDEMPOTENCY_FIELD))
         )
         
         # Send request - use longer timeout for Google Apps Script
@@ -697,9 +757,11 @@ def send_to_google_sheets_v2(call_data, extracted_vars, call_summary, tech_data)
         ssl_context.check_hostname = False
         ssl_context.verify_mode = ssl.CERT_NONE
         
-        with urllib.request.urlopen(req, timeout=20, context=ssl_context) as response:
+        with open_url(req, timeout=20, context=ssl_context, deadline=deadline) as response:
             result = response.read().decode('utf-8')
             print(f"[SHEETS2] Data sent successfully: {result}")
+            # Written: this is what reconcile counts as processed (a dedup claim alone is not)
+            mark_completed(TENANT.key, sheet_data['call_id'], sheet_data.get(IDEMPOTENCY_FIELD))
             return True
             
     except Exception as e:
@@ -709,96 +771,12 @@ def send_to_google_sheets_v2(call_data, extracted_vars, call_summary, tech_data)
 class handler(BaseHTTPRequestHandler):
     def is_duplicate_call(self, call_data):
         """Check if this call has already been processed using content hash"""
-        try:
-            # Create a hash of the relevant call data
-            call_id = call_data.get('call_id', '')
-            call_analysis = call_data.get('call_analysis', {})
-            custom_data = call_analysis.get('custom_analysis_data', {})
-            collected_vars = call_data.get('collected_dynamic_variables', {})
-            
-            # Create hash from call_id + variables + timestamp (rounded to minute)
-            hash_content = {
-                'call_id': call_id,
-                'custom_data': str(custom_data),
-                'collected_vars': str(collected_vars),
-                'timestamp_minute': int(call_data.get('start_timestamp', 0) / 60000)  # Round to minute
-            }
-            
-            content_hash = hashlib.md5(json.dumps(hash_content, sort_keys=True).encode()).hexdigest()
-            
-            # Load processed calls
-            processed_calls = self.load_processed_calls()
-            
-            # Check if already processed
-            if content_hash in processed_calls:
-                print(f"[SHEETS2] Found duplicate hash: {content_hash}")
-                return True
-            
-            # Mark as processed
-            processed_calls[content_hash] = {
-                'call_id': call_id,
-                'processed_at': datetime.now().isoformat(),
-                'timestamp': call_data.get('start_timestamp', 0)
-            }
-            
-            # Clean old entries (keep only last 1000 and last 24 hours)
-            self.cleanup_processed_calls(processed_calls)
-            
-            # Save updated list
-            self.save_processed_calls(processed_calls)
-            
-            print(f"[SHEETS2] New call hash: {content_hash}")
-            return False
-            
-        except Exception as e:
-            print(f"[SHEETS2 ERROR] Error checking duplicate: {e}")
-            return False  # If error, allow processing to continue
-
-    def load_processed_calls(self):
-        """Load processed calls from file"""
-        try:
-            if os.path.exists(PROCESSED_CALLS_FILE):
-                with open(PROCESSED_CALLS_FILE, 'r') as f:
-                    return json.load(f)
-        except Exception as e:
-            print(f"[SHEETS2 ERROR] Error loading processed calls: {e}")
-        return {}
-
-    def save_processed_calls(self, processed_calls):
-        """Save processed calls to file"""
-        try:
-            with open(PROCESSED_CALLS_FILE, 'w') as f:
-                json.dump(processed_calls, f)
-        except Exception as e:
-            print(f"[SHEETS2 ERROR] Error saving processed calls: {e}")
+        return DEDUP.is_duplicate(call_data)
 
-    def cleanup_processed_calls(self, processed_calls):
-        """Clean up old processed calls to prevent file from growing too large"""
-        try:
-            current_time = datetime.now()
-            cutoff_time = current_time.timestamp() - (24 * 60 * 60 * 1000)  # 24 hours ago in milliseconds
-            
-            # Remove entries older than 24 hours
-            to_remove = []
-            for hash_key, data in processed_calls.items():
-                if data.get('timestamp', 0) < cutoff_time:
-                    to_remove.append(hash_key)
-            
-            for key in to_remove:
-                del processed_calls[key]
-            
-            # Keep only the most recent 1000 entries
-            if len(processed_calls) > 1000:
-                sorted_items = sorted(processed_calls.items(), 
-                                    key=lambda x: x[1].get('timestamp', 0), 
-                                    reverse=True)
-                processed_calls.clear()
-                processed_calls.update(dict(sorted_items[:1000]))
-                
-            print(f"[SHEETS2] Cleaned up processed calls, {len(processed_calls)} entries remaining")
-            
-        except Exception as e:
-            print(f"[SHEETS2 ERROR] Error cleaning up processed calls: {e}")
+    def release_call(self, call_data):
+        """Give up this request's dedup claim after a failure, so Retell's retry is processed"""
+        if call_data is not None:
+            DEDUP.release(call_data)
 
     def do_GET(self):
         """Handle GET requests (health check)"""
@@ -813,34 +791,62 @@ class handler(BaseHTTPRequestHandler):
             "variables": ["fromNumber", "customerName", "serviceAddress", "callSummary", "email"],
             "endpoints": {
                 "POST /": "Process call analysis data and send to Google Sheets v2"
-            }
+            },
+            # Observed dependency latency and the timeouts learned from it
+            "latency": latency_report()
         }
-        self.wfile.write(json.dumps(response).encode())
+        self.wfile.write(dumps(response))
 
+    @profiled('pacific')
     def do_POST(self):
         """Handle POST requests - process call analysis and send to Google Sheets v2"""
+        deadline = Deadline()
+        # The call this request holds a dedup claim on, released if processing fails
+        claimed = None
         try:
             # Read the request body
-            content_length = int(self.headers.get('Content-Length', 0))
-            if content_length > 0:
-                post_data = self.rfile.read(content_length)
-                body_str = post_data.decode('utf-8')
-                body = json.loads(body_str)
-            else:
-                body_str = '{}'
+            # Oversized bodies are refused before a byte is read; the rest is read into one buffer
+            rejection = check_body_size(self.headers)
+            post_data = read_body(self.rfile, self.headers) if rejection is None else b''
+
+            # Reject forged or replayed webhooks before parsing or any outbound work
+            rejection = rejection or check_retell_signature(post_data, self.headers)
+            if rejection:
+                status, response_data = rejection
+                self.send_response(status)
+                self.send_header('Content-type', 'application/json')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                self.wfile.write(encode_response(response_data, self.headers))
+                return
+
+            # Keep the accepted request as it arrived when CAPTURE_DIR is set
+            capture_request(self.path, self.headers, post_data)
+
+            # Only call_analyzed needs the whole document; other events are answered from the sniffed `event`
+            event_hint = sniff_event(post_data) if post_data else None
+            if not post_data:
                 body = {}
+            elif event_hint is not None and event_hint != 'call_analyzed':
+                body = {"event": event_hint, "call": {"call_id": sniff_call_id(post_data) or "unknown"}}
+            else:
+                body = loads(post_data)
             
             # Forward to API gateway (non-blocking, only for call_started, call_ended, and call_analyzed)
             signature_header = self.headers.get('x-retell-signature', '') or self.headers.get('X-Retell-Signature', '')
             try:
-                forward_to_api_gateway(body_str, signature_header)
+                forward_to_api_gateway(post_data, signature_header, deadline=deadline, event_type=body.get("event", ""))
             except Exception as fwd_err:
                 # Isolated guard — forwarding errors must never affect the main response
                 print(f"[API_GATEWAY] Unexpected forwarding error (ignored): {fwd_err}")
+            # Forwarded and parsed: the raw bytes are no longer needed
+            del post_data
             
             # Extract event information
             event_type = body.get("event", "unknown")
-            call_data = body.get("call", {})
+            # Keep only what the pipeline reads so transcripts, word timings and tool chatter can be freed early
+            call_data = project(body.get("call", {}), CALL_FIELDS)
+            del body
             call_id = call_data.get("call_id", "unknown")
             
             print(f"[SHEETS2 API] Received event: {event_type}, Call ID: {call_id}")
@@ -848,7 +854,7 @@ class handler(BaseHTTPRequestHandler):
             # Only process call_analyzed events
             if event_type == "call_analyzed":
                 # Check for duplicate processing
-                if self.is_duplicate_call(call_data):
+                if record_dedup('pacific', self.is_duplicate_call(call_data)):
                     print(f"[SHEETS2] Duplicate call detected, skipping processing for {call_id}")
                     response_data = {
                         "status": "skipped",
@@ -859,8 +865,9 @@ class handler(BaseHTTPRequestHandler):
                     self.send_header('Content-type', 'application/json')
                     self.send_header('Access-Control-Allow-Origin', '*')
                     self.end_headers()
-                    self.wfile.write(json.dumps(response_data).encode())
+                    self.wfile.write(encode_response(response_data, self.headers))
                     return
+                claimed = call_data
                 
                 analysis = call_data.get("call_analysis", {})
                 call_summary = analysis.get("call_summary", "")
@@ -889,16 +896,16 @@ class handler(BaseHTTPRequestHandler):
                     emergency_type = extracted_vars.get('emergencyType', '')
                     print(f"[SHEETS2] Emergency type detected: '{emergency_type}'")
                     print(f"[SHEETS2] Calling get_tech_data_from_api() with emergency_type='{emergency_type}'...")
-                    tech_data = get_tech_data_from_api(emergency_type)
-                    if not isinstance(tech_data, dict):
-                        tech_data = {'name': '', 'email': '', 'phone': ''}
+                    tech_data = get_tech_data_from_api(emergency_type, deadline=deadline)
+                    if not isinstance(tech_data, TechContact):
+                        tech_data = TechContact()
                     print(f"[SHEETS2] Tech data from API: {tech_data}")
                     print(f"[SHEETS2] Tech data name: '{tech_data.get('name', '')}'")
                     print(f"[SHEETS2] Tech data email: '{tech_data.get('email', '')}'")
                     print(f"[SHEETS2] Tech data phone: '{tech_data.get('phone', '')}'")
                 except Exception as e:
                     print(f"[SHEETS2] Error getting tech data: {e}")
-                    tech_data = {'name': '', 'email': '', 'phone': ''}
+                    tech_data = TechContact()
                 
                 # Log successful extractions
                 non_empty_vars = {k: v for k, v in extracted_vars.items() if v}
@@ -915,37 +922,54 @@ class handler(BaseHTTPRequestHandler):
                 print(f"[SHEETS2] Rate approved: '{rate_approved}', Is emergency: '{is_emergency}', Call type: '{call_type}'")
                 
                 # Determine if we need to send scheduling or reception email
-                email_sent_type = None
+                def send_notification_email():
+                    email_sent_type = None
                 
-                # If emergency but rate was declined -> email scheduling@pwfire.ca
-                if is_emergency == 'TRUE' and rate_approved in ['no', 'false', 'declined']:
-                    print(f"[SHEETS2] Rate declined for emergency - sending email to scheduling@pwfire.ca")
-                    email_result = send_scheduling_email(
-                        caller_name=extracted_vars.get('customerName', ''),
-                        callback_number=extracted_vars.get('fromNumber', ''),
-                        service_address=extracted_vars.get('serviceAddress', ''),
-                        emergency_type=extracted_vars.get('emergencyType', ''),
-                        call_summary=extracted_vars.get('callSummary', '') or call_summary
-                    )
-                    email_sent_type = 'scheduling' if email_result else None
-                    print(f"[SHEETS2] Scheduling email sent: {email_result}")
+                    # If emergency but rate was declined -> email scheduling@pwfire.ca
+                    if is_emergency == 'TRUE' and rate_approved in ['no', 'false', 'declined']:
+                        print(f"[SHEETS2] Rate declined for emergency - sending email to scheduling@pwfire.ca")
+                        email_result = send_scheduling_email(
+                            caller_name=extracted_vars.get('customerName', ''),
+                            callback_number=extracted_vars.get('fromNumber', ''),
+                            service_address=extracted_vars.get('serviceAddress', ''),
+                            emergency_type=extracted_vars.get('emergencyType', ''),
+                            call_summary=extracted_vars.get('callSummary', '') or call_summary,
+                            deadline=deadline
+                        )
+                        email_sent_type = 'scheduling' if email_result else None
+                        print(f"[SHEETS2] Scheduling email sent: {email_result}")
                 
-                # If non-emergency / general inquiry -> email reception@pwfire.ca
-                elif is_emergency != 'TRUE' or call_type in ['inquiry', 'general', 'question', 'other']:
-                    print(f"[SHEETS2] Non-emergency call - sending email to reception@pwfire.ca")
-                    email_result = send_reception_email(
-                        caller_name=extracted_vars.get('customerName', ''),
-                        callback_number=extracted_vars.get('fromNumber', ''),
-                        inquiry_summary=extracted_vars.get('callSummary', '') or call_summary
-                    )
-                    email_sent_type = 'reception' if email_result else None
-                    print(f"[SHEETS2] Reception email sent: {email_result}")
+                    # If non-emergency / general inquiry -> email reception@pwfire.ca
+                    elif is_emergency != 'TRUE' or call_type in ['inquiry', 'general', 'question', 'other']:
+                        print(f"[SHEETS2] Non-emergency call - sending email to reception@pwfire.ca")
+                        email_result = send_reception_email(
+                            caller_name=extracted_vars.get('customerName', ''),
+                            callback_number=extracted_vars.get('fromNumber', ''),
+                            inquiry_summary=extracted_vars.get('callSummary', '') or call_summary,
+                            deadline=deadline
+                        )
+                        email_sent_type = 'reception' if email_result else None
+                        print(f"[SHEETS2] Reception email sent: {email_result}")
                 
+                    return email_sent_type
+
+                # Emails are optional for the sheet row: with a low budget, send them after the write
+                email_sent_type = None
+                defer_email = not deadline.has(2 * RESERVE_SECONDS)
+                if defer_email:
+                    print(f"[SHEETS2] Request budget low, deferring email until after the sheet write: {deadline}")
+                else:
+                    email_sent_type = send_notification_email()
+
                 # Send to Google Sheets
                 try:
-                    success = send_to_google_sheets_v2(call_data, extracted_vars, call_summary, tech_data)
+                    success = send_to_google_sheets_v2(call_data, extracted_vars, call_summary, tech_data, deadline=deadline)
+                    if defer_email:
+                        email_sent_type = send_notification_email()
                     
                     if success:
+                        # Only a handled delivery makes its signature a replay; a failed one is retried
+                        accept_signature(self.headers)
                         response_data = {
                             "status": "success",
                             "message": "Data sent to Google Sheets v2",
@@ -963,6 +987,8 @@ class handler(BaseHTTPRequestHandler):
                         }
                         self.send_response(200)
                     else:
+                        # The row carries an idempotency key, so a retry cannot duplicate it
+                        self.release_call(claimed)
                         response_data = {
                             "status": "partial_success",
                             "message": "Data may have been sent to Google Sheets but response failed",
@@ -974,6 +1000,7 @@ class handler(BaseHTTPRequestHandler):
                         
                 except Exception as e:
                     print(f"[SHEETS2 API ERROR] Exception in Google Sheets operation: {e}")
+                    self.release_call(claimed)
                     response_data = {
                         "status": "partial_success", 
                         "message": "Data processing completed but response generation failed",
@@ -985,7 +1012,7 @@ class handler(BaseHTTPRequestHandler):
                 self.send_header('Content-type', 'application/json')
                 self.send_header('Access-Control-Allow-Origin', '*')
                 self.end_headers()
-                self.wfile.write(json.dumps(response_data).encode())
+                self.wfile.write(encode_response(response_data, self.headers))
                 
             else:
                 # Not a call_analyzed event, return success but no action
@@ -998,25 +1025,26 @@ class handler(BaseHTTPRequestHandler):
                 self.send_header('Content-type', 'application/json')
                 self.send_header('Access-Control-Allow-Origin', '*')
                 self.end_headers()
-                self.wfile.write(json.dumps(response_data).encode())
+                self.wfile.write(encode_response(response_data, self.headers))
             
-        except json.JSONDecodeError as e:
+        except JSONDecodeError as e:
             print(f"[SHEETS2 API ERROR] Invalid JSON payload: {e}")
             self.send_response(400)
             self.send_header('Content-type', 'application/json')
             self.send_header('Access-Control-Allow-Origin', '*')
             self.end_headers()
             error_response = {"error": "Invalid JSON payload"}
-            self.wfile.write(json.dumps(error_response).encode())
+            self.wfile.write(dumps(error_response))
             
         except Exception as e:
             print(f"[SHEETS2 API ERROR] Processing failed: {e}")
+            self.release_call(claimed)
             self.send_response(500)
             self.send_header('Content-type', 'application/json')
             self.send_header('Access-Control-Allow-Origin', '*')
             self.end_headers()
             error_response = {"error": "Internal Server Error"}
-            self.wfile.write(json.dumps(error_response).encode())
+            self.wfile.write(dumps(error_response))
 
     def do_OPTIONS(self):
         """Handle OPTIONS requests (CORS preflight)"""
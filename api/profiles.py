@@ -0,0 +1,51 @@
+from http.server import BaseHTTPRequestHandler
+import urllib.parse
+
+from api._lib.codec import dumps
+from api._lib.profiling import artifact_path, authorized, profile_token, recent_profiles
+
+
+class handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if not profile_token():
+            self.send_json(404, {"error": "Profiling endpoint is disabled (PROFILE_TOKEN not set)"})
+            return
+        if not authorized(self.headers):
+            self.send_json(401, {"error": "Unauthorized"})
+            return
+
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        name = query.get('name', [''])[0]
+        if not name:
+            self.send_json(200, {"profiles": recent_profiles()})
+            return
+
+        path = artifact_path(name)
+        if path is None:
+            self.send_json(404, {"error": f"No profile named {name}"})
+            return
+        with open(path, 'rb') as f:
+            body = f.read()
+        self.send_response(200)
+        if name.endswith('.txt'):
+            self.send_header('Content-type', 'text/plain; charset=utf-8')
+        else:
+            self.send_header('Content-type', 'application/octet-stream')
+            self.send_header('Content-Disposition', f'attachment; filename="{name}"')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, response):
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(dumps(response))
+
+    def do_OPTIONS(self):
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+        self.end_headers()
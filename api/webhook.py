@@ -1,5 +1,4 @@
 from http.server import BaseHTTPRequestHandler
-import json
 import os
 from datetime import datetime
 import urllib.request
@@ -7,34 +6,52 @@ import urllib.parse
 import ssl
 import hashlib
 
-# Google Apps Script URLs for each client
-CLIENT_URLS = {
-    'braconier': os.environ.get('BRACONIER_EXEC_URL', ''),
-    'adaptive': os.environ.get('ADAPTIVE_EXEC_URL', ''),
-    'elitefire': os.environ.get('ELITEFIRE_EXEC_URL', ''),
-    'pacific': os.environ.get('PACIFIC_EXEC_URL', ''),
-}
+from api._lib.body import check_body_size, read_body
+from api._lib.capture import capture_request
+from api._lib.codec import dumps, loads
+from api._lib.completions import mark_completed
+from api._lib.deadline import RESERVE_SECONDS, Deadline
+from api._lib.idempotency import IDEMPOTENCY_FIELD, idempotency_key, sheet_headers
+from api._lib.latency import latency_report
+from api._lib.metrics import stage
+from api._lib.oncall_snapshot import lookup_timeout, remember_tech, snapshot_tech
+from api._lib.outbound import open_url
+from api._lib.profiling import profiled
+from api._lib.projection import call_fields, project
+from api._lib.records import ExtractedVars, ServiceSheetRow, TechContact
+from api._lib.responses import encode_response
+from api._lib.signature import accept_signature, check_retell_signature
+from api._lib.sniff import sniff_call_id, sniff_event
+from api._lib.tenants import router_clients, tenants
 
-def forward_to_api_gateway(body_str, signature_header):
+# The parts of a call extract_variables and send_to_sheets read; the rest is dropped at parse time
+CALL_FIELDS = call_fields(
+    'call_id', 'agent_name', 'duration_ms', 'call_analysis', 'collected_dynamic_variables', 'from_number', 'transcript',
+)
+
+@stage('webhook', 'forward')
+def forward_to_api_gateway(body, signature_header, deadline=None, event_type=None):
     """Forward webhook to API gateway synchronously before responding.
-    Must complete within the serverless request lifecycle."""
+    Must complete within the serverless request lifecycle.
+    ``body`` is the raw request body; pass ``event_type`` when it is already known."""
     api_gateway_url = os.environ.get('API_GATEWAY_URL', '').strip()
     if not api_gateway_url:
         return
 
-    event_type = None
-    try:
-        body_dict = json.loads(body_str)
-        event_type = body_dict.get("event", "")
-    except:
-        pass
+    if event_type is None:
+        event_type = sniff_event(body)
+    if event_type is None:
+        try:
+            event_type = loads(body).get("event", "")
+        except:
+            pass
 
     # Only forward call_started, call_ended, and call_analyzed events
     if event_type not in ["call_started", "call_ended", "call_analyzed"]:
         return
 
     try:
-        data = body_str.encode('utf-8')
+        data = body.encode('utf-8') if isinstance(body, str) else body
         req = urllib.request.Request(
             api_gateway_url,
             data=data,
@@ -43,23 +60,17 @@ def forward_to_api_gateway(body_str, signature_header):
                 'x-retell-signature': signature_header or ''
             }
         )
-        with urllib.request.urlopen(req, timeout=3) as response:
+        with open_url(req, timeout=3, deadline=deadline) as response:
             print(f"[API_GATEWAY] Forwarded {event_type} event, status: {response.status}")
     except Exception as e:
         # Swallow errors — forward failures must never block the main webhook response
         print(f"[API_GATEWAY] Error forwarding webhook: {e}")
 
-def extract_variables(call_data):
-    """Extract dynamic variables from Retell call data"""
-    variables = {
-        'fromNumber': '',
-        'customerName': '',
-        'serviceAddress': '',
-        'callSummary': '',
-        'email': '',
-        'isitEmergency': '',
-        'emergencyType': ''
-    }
+@stage('webhook', 'extract')
+def extract_variables(call_data, fields=None):
+    """Extract dynamic variables from Retell call data.
+    ``fields`` maps each variable to its ``custom_analysis_data`` aliases (the tenant's ``fields``)."""
+    variables = ExtractedVars()
     
     def normalize_emergency(value):
         if value is None:
@@ -84,18 +95,10 @@ def extract_variables(call_data):
     analysis = call_data.get('call_analysis', {})
     custom = analysis.get('custom_analysis_data', {})
     if custom:
-        if not variables['fromNumber']:
-            variables['fromNumber'] = str(custom.get('fromNumber', '') or custom.get('caller_phone', '') or call_data.get('from_number', ''))
-        if not variables['customerName']:
-            variables['customerName'] = str(custom.get('customerName', '') or custom.get('caller_name', ''))
-        if not variables['serviceAddress']:
-            variables['serviceAddress'] = str(custom.get('serviceAddress', '') or custom.get('caller_address', ''))
-        if not variables['callSummary']:
-            variables['callSummary'] = str(custom.get('issue_description', '') or analysis.get('call_summary', ''))
-        if not variables['isitEmergency']:
-            variables['isitEmergency'] = normalize_emergency(custom.get('isitEmergency', '') or custom.get('isEmergency', ''))
-        if not variables['emergencyType']:
-            variables['emergencyType'] = str(custom.get('emergencyType', '') or custom.get('emergency_type', ''))
+        for key, aliases in (fields or {}).items():
+            if key in variables and not variables[key]:
+                value = next((custom[alias] for alias in aliases if custom.get(alias)), '')
+                variables[key] = str(value) if value else ''
     
     # Fallback for call summary
     if not variables['callSummary']:
@@ -109,43 +112,46 @@ def extract_variables(call_data):
     
     return variables
 
-def get_tech_data(emergency_type=''):
-    """Get on-call tech data from APIs"""
+@stage('webhook', 'tech_lookup')
+def get_tech_data(tenant, emergency_type='', deadline=None):
+    """Get on-call tech data from the tenant's APIs, the one for ``emergency_type`` first"""
     def try_api(url, name):
         try:
             ctx = ssl.create_default_context()
             ctx.check_hostname = False
             ctx.verify_mode = ssl.CERT_NONE
-            with urllib.request.urlopen(url, timeout=10, context=ctx) as resp:
-                data = json.loads(resp.read().decode('utf-8'))
+            with open_url(url, timeout=lookup_timeout(url, 10), context=ctx, deadline=deadline) as resp:
+                data = loads(resp.read())
                 if isinstance(data, dict):
                     assignments = data.get('assignments', [])
                     for assignment in assignments:
                         if assignment:
                             for tech in assignment.get('techs', []):
                                 if tech and (tech.get('email') or tech.get('phone')):
-                                    return {'name': tech.get('name', ''), 'email': tech.get('email', ''), 'phone': tech.get('phone', '')}
+                                    return TechContact(tech.get('name', ''), tech.get('email', ''), tech.get('phone', ''))
         except Exception as e:
             print(f"[API ERROR] {name}: {e}")
-        return {'name': '', 'email': '', 'phone': ''}
-    
-    hvac_api = "https://hvacapi.vercel.app/api/assignments"
-    plumbing_api = "https://plumbing-api.vercel.app/api/assignments"
+        return TechContact()
     
-    if emergency_type == 'Plumbing':
-        result = try_api(plumbing_api, "Plumbing")
+    order = tenant.tech_api_order(emergency_type)
+    result = TechContact()
+    for index, (name, url) in enumerate(order):
+        # Fallback APIs are optional when the request budget is low
+        if index and deadline is not None and not deadline.has(RESERVE_SECONDS):
+            print(f"[API] Skipping {name} fallback: {deadline}")
+            break
+        result = try_api(url, name)
         if result['email'] or result['phone']:
+            remember_tech(url, result)
             return result
-        return try_api(hvac_api, "HVAC")
-    else:
-        result = try_api(hvac_api, "HVAC")
-        if result['email'] or result['phone']:
-            return result
-        return try_api(plumbing_api, "Plumbing")
+    # A recent snapshot of a live answer beats an empty result
+    return snapshot_tech(*[url for _, url in order]) or result
 
-def send_to_sheets(client, call_data, extracted, tech_data):
+@stage('webhook', 'sheet_write')
+def send_to_sheets(client, call_data, extracted, tech_data, deadline=None):
     """Send data to Google Sheets via Apps Script"""
-    sheets_url = CLIENT_URLS.get(client, '')
+    tenant = tenants().get(client)
+    sheets_url = tenant.sink_url if tenant else ''
     
     if not sheets_url:
         print(f"[ERROR] No URL configured for client: {client}")
@@ -153,44 +159,40 @@ def send_to_sheets(client, call_data, extracted, tech_data):
     
     analysis = call_data.get('call_analysis', {})
     
-    sheet_data = {
-        'timestamp': datetime.now().isoformat(),
-        'call_id': call_data.get('call_id', ''),
-        'agent_name': call_data.get('agent_name', ''),
-        'duration_ms': call_data.get('duration_ms', 0),
-        'sentiment': analysis.get('user_sentiment', ''),
-        'successful': analysis.get('call_successful', False),
-        'call_summary': extracted.get('callSummary', '') or analysis.get('call_summary', ''),
-        'from_number': extracted.get('fromNumber', ''),
-        'customer_name': extracted.get('customerName', ''),
-        'service_address': extracted.get('serviceAddress', ''),
-        'email': tech_data.get('email', ''),
-        'phone': tech_data.get('phone', ''),
-        'is_emergency': extracted.get('isitEmergency', ''),
-        'emergency_type': extracted.get('emergencyType', ''),
-        'transcript': call_data.get('transcript', ''),
-        'make_call': True,
-        'response_call_id_1': '',
-        'response_call_id_2': '',
-        'response_call_id_3': '',
-        'call_decline_counter': 0,
-        'last_call_time': '',
-        'is_email_sent': False,
-        'note': ''
-    }
+    sheet_data = ServiceSheetRow(
+        timestamp=datetime.now().isoformat(),
+        call_id=call_data.get('call_id', ''),
+        agent_name=call_data.get('agent_name', ''),
+        duration_ms=call_data.get('duration_ms', 0),
+        sentiment=analysis.get('user_sentiment', ''),
+        successful=analysis.get('call_successful', False),
+        call_summary=extracted.get('callSummary', '') or analysis.get('call_summary', ''),
+        from_number=extracted.get('fromNumber', ''),
+        customer_name=extracted.get('customerName', ''),
+        service_address=extracted.get('serviceAddress', ''),
+        email=tech_data.get('email', ''),
+        phone=tech_data.get('phone', ''),
+        is_emergency=extracted.get('isitEmergency', ''),
+        emergency_type=extracted.get('emergencyType', ''),
+        transcript=call_data.get('transcript', ''),
+        # Same key as the client's own pipeline (and backfill), so Apps Script drops either duplicate
+        idempotency_key=idempotency_key(call_data.get('call_id', ''), tenant.pipeline_version),
+    )
     
     print(f"[SHEETS] Sending to {client}: call_id={sheet_data['call_id']}, customer={sheet_data['customer_name']}")
     
     try:
-        data = json.dumps(sheet_data).encode('utf-8')
-        req = urllib.request.Request(sheets_url, data=data, headers={'Content-Type': 'application/json'})
+        data = sheet_data.to_json()
+        req = urllib.request.Request(sheets_url, data=data, headers=sheet_headers(sheet_data.get(IDEMPOTENCY_FIELD)))
         ctx = ssl.create_default_context()
         ctx.check_hostname = False
         ctx.verify_mode = ssl.CERT_NONE
         
-        with urllib.request.urlopen(req, timeout=15, context=ctx) as resp:
+        with open_url(req, timeout=15, context=ctx, deadline=deadline) as resp:
             result = resp.read().decode('utf-8')
             print(f"[SHEETS] Success: {result}")
+            # Same markers as the client's own handler, so reconcile sees router deliveries too
+            mark_completed(client, sheet_data['call_id'], sheet_data.get(IDEMPOTENCY_FIELD))
             return True
     except Exception as e:
         print(f"[SHEETS ERROR] {e}")
@@ -206,12 +208,16 @@ class handler(BaseHTTPRequestHandler):
         response = {
             "message": "Retell Webhook Handler",
             "status": "healthy",
-            "usage": "POST /api/webhook?client=braconier (or adaptive, elitefire, pacific)",
-            "clients": list(CLIENT_URLS.keys())
+            "usage": "POST /api/webhook?client=<client>",
+            "clients": [tenant.key for tenant in router_clients()],
+            # Observed dependency latency and the timeouts learned from it
+            "latency": latency_report()
         }
-        self.wfile.write(json.dumps(response).encode())
+        self.wfile.write(dumps(response))
 
+    @profiled('webhook')
     def do_POST(self):
+        deadline = Deadline()
         try:
             # Parse query string for client parameter
             parsed = urllib.parse.urlparse(self.path)
@@ -227,37 +233,71 @@ class handler(BaseHTTPRequestHandler):
             print(f"[WEBHOOK] Client: {client}, Path: {self.path}")
             
             # Read request body
-            content_length = int(self.headers.get('Content-Length', 0))
-            if content_length > 0:
-                body_str = self.rfile.read(content_length).decode('utf-8')
-                body = json.loads(body_str)
-            else:
-                body_str = '{}'
+            # Oversized bodies are refused before a byte is read; the rest is read into one buffer
+            rejection = check_body_size(self.headers)
+            post_data = read_body(self.rfile, self.headers) if rejection is None else b''
+
+            # Reject forged or replayed webhooks before parsing or any outbound work
+            rejection = rejection or check_retell_signature(post_data, self.headers)
+            if rejection:
+                status, response_data = rejection
+                self.send_response(status)
+                self.send_header('Content-type', 'application/json')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                self.wfile.write(encode_response(response_data, self.headers))
+                return
+
+            # Keep the accepted request as it arrived when CAPTURE_DIR is set
+            capture_request(self.path, self.headers, post_data)
+
+            # Only call_analyzed needs the whole document; other events are answered from the sniffed `event`
+            event_hint = sniff_event(post_data) if post_data else None
+            if not post_data:
                 body = {}
+            elif event_hint is not None and event_hint != 'call_analyzed':
+                body = {"event": event_hint, "call": {"call_id": sniff_call_id(post_data) or "unknown"}}
+            else:
+                body = loads(post_data)
             
             # Forward to API gateway (non-blocking, only for call_started, call_ended, and call_analyzed)
             signature_header = self.headers.get('x-retell-signature', '') or self.headers.get('X-Retell-Signature', '')
             try:
-                forward_to_api_gateway(body_str, signature_header)
+                forward_to_api_gateway(post_data, signature_header, deadline=deadline, event_type=body.get("event", ""))
             except Exception as fwd_err:
                 # Isolated guard — forwarding errors must never affect the main response
                 print(f"[API_GATEWAY] Unexpected forwarding error (ignored): {fwd_err}")
+            # Forwarded and parsed: the raw bytes are no longer needed
+            del post_data
             
             event_type = body.get("event", "unknown")
-            call_data = body.get("call", {})
+            # Keep only what the pipeline reads so transcripts, word timings and tool chatter can be freed early
+            call_data = project(body.get("call", {}), CALL_FIELDS)
+            del body
             call_id = call_data.get("call_id", "unknown")
             
             print(f"[WEBHOOK] Event: {event_type}, Call ID: {call_id}")
             
             # Only process call_analyzed events
-            if event_type == "call_analyzed" and client:
-                extracted = extract_variables(call_data)
+            tenant = tenants().get(client)
+            if event_type == "call_analyzed" and client and tenant is None:
+                print(f"[ERROR] Unknown client: {client}")
+                response_data = {
+                    "status": "error",
+                    "message": f"Unknown client '{client}'",
+                    "call_id": call_id
+                }
+            elif event_type == "call_analyzed" and client:
+                extracted = extract_variables(call_data, tenant.fields)
                 print(f"[WEBHOOK] Extracted: {extracted}")
                 
-                tech_data = get_tech_data(extracted.get('emergencyType', ''))
+                tech_data = get_tech_data(tenant, extracted.get('emergencyType', ''), deadline=deadline)
                 print(f"[WEBHOOK] Tech data: {tech_data}")
                 
-                success = send_to_sheets(client, call_data, extracted, tech_data)
+                success = send_to_sheets(client, call_data, extracted, tech_data, deadline=deadline)
+                if success:
+                    # Only a handled delivery makes its signature a replay; a failed one is retried
+                    accept_signature(self.headers)
                 
                 response_data = {
                     "status": "success" if success else "error",
@@ -276,7 +316,7 @@ class handler(BaseHTTPRequestHandler):
             self.send_header('Content-type', 'application/json')
             self.send_header('Access-Control-Allow-Origin', '*')
             self.end_headers()
-            self.wfile.write(json.dumps(response_data).encode())
+            self.wfile.write(encode_response(response_data, self.headers))
             
         except Exception as e:
             print(f"[ERROR] {e}")
@@ -284,7 +324,7 @@ class handler(BaseHTTPRequestHandler):
             self.send_header('Content-type', 'application/json')
             self.send_header('Access-Control-Allow-Origin', '*')
             self.end_headers()
-            self.wfile.write(json.dumps({"error": str(e)}).encode())
+            self.wfile.write(dumps({"error": str(e)}))
 
     def do_OPTIONS(self):
         self.send_response(200)
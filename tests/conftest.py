@@ -0,0 +1,11 @@
+import pytest
+
+from api._lib import completions
+
+
+@pytest.fixture(autouse=True)
+def completion_markers(tmp_path, monkeypatch):
+    """Keep each test's completion markers in its own directory."""
+    monkeypatch.setattr(completions, 'COMPLETIONS_DIR', str(tmp_path))
+    monkeypatch.setattr(completions, '_stores', {})
+    return completions
@@ -0,0 +1,99 @@
+import io
+import json
+
+import pytest
+
+from api._lib.body import check_body_size, content_length, read_body
+from api._lib.server import run_handler
+
+
+class Trickle(io.RawIOBase):
+    """A socket-like stream: at most ``step`` bytes per read, then EOF once the data runs out."""
+
+    def __init__(self, data, step):
+        self.data = memoryview(data)
+        self.step = step
+        self.calls = []
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        self.calls.append(len(buf))
+        n = min(len(buf), self.step, len(self.data))
+        buf[:n] = self.data[:n]
+        self.data = self.data[n:]
+        return n
+
+
+def headers(length):
+    return {'Content-Length': str(length)}
+
+
+@pytest.mark.parametrize('length', [1, 15, 16, 17, 31, 32, 33, 16 * 5])
+@pytest.mark.parametrize('step', [1, 7, 16, 1000])
+def test_reads_exactly_the_declared_length(length, step):
+    data = bytes(range(256)) * 2
+    stream = Trickle(data, step)
+    body = read_body(stream, headers(length), chunk_size=16)
+    assert body == data[:length]
+    # Never asks for more than one chunk, nor past the declared end
+    assert max(stream.calls) <= 16
+    assert len(data) - len(stream.data) == length
+
+
+def test_pipelined_bytes_stay_in_the_stream():
+    stream = io.BytesIO(b'{"a": 1}GET / HTTP/1.1\r\n')
+    assert read_body(stream, headers(8), chunk_size=3) == b'{"a": 1}'
+    assert stream.read() == b'GET / HTTP/1.1\r\n'
+
+
+@pytest.mark.parametrize('sent', [0, 1, 15, 16, 17, 40])
+def test_truncated_stream_returns_what_arrived(sent):
+    data = b'x' * sent
+    body = read_body(Trickle(data, 5), headers(100), chunk_size=16)
+    assert body == data
+    # The view is released, so the short buffer is an ordinary resizable bytearray
+    body.extend(b'!')
+    assert len(body) == sent + 1
+
+
+def test_no_body():
+    assert read_body(io.BytesIO(b'ignored'), {}) == b''
+    assert read_body(io.BytesIO(b'ignored'), headers(0)) == b''
+
+
+@pytest.mark.parametrize('value, length', [
+    (None, 0), ('', 0), ('  ', 0), ('12', 12), (' 12 ', 12), ('-1', -1), ('abc', -1), ('1.5', -1), ('0x10', -1),
+])
+def test_content_length(value, length):
+    assert content_length({} if value is None else {'Content-Length': value}) == length
+
+
+def test_size_gate(monkeypatch):
+    assert check_body_size(headers(10), limit=10) is None
+    assert check_body_size(headers(11), limit=10) == (413, {'error': 'Request body too large', 'max_bytes': 10})
+    assert check_body_size({'Content-Length': 'abc'})[0] == 400
+    monkeypatch.setenv('MAX_BODY_BYTES', '64')
+    assert check_body_size(headers(65))[0] == 413
+    monkeypatch.setenv('MAX_BODY_BYTES', 'lots')
+    assert check_body_size(headers(65)) is None
+
+
+def post(body, length):
+    from api import braconier
+    raw = (f'POST /api/braconier HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+           f'Content-Length: {length}\r\n\r\n').encode() + body
+    response = run_handler(braconier.handler, raw, ('127.0.0.1', 0))
+    return int(response.split(b' ', 2)[1]), json.loads(response.split(b'\r\n\r\n', 1)[1])
+
+
+def test_handler_rejects_a_truncated_body():
+    body = b'{"event": "call_analyzed", "call": {"call_id": "call_cut"'
+    assert post(body, len(body) + 100) == (400, {'error': 'Invalid JSON payload'})
+
+
+def test_handler_refuses_oversized_bodies_unread(monkeypatch):
+    monkeypatch.setenv('MAX_BODY_BYTES', '32')
+    assert post(b'{"event": "call_started"}' + b' ' * 40, 65) == (
+        413, {'error': 'Request body too large', 'max_bytes': 32})
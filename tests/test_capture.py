@@ -0,0 +1,68 @@
+import os
+import subprocess
+import sys
+import time
+
+from api._lib import capture
+from api._lib.capture import CaptureWriter, encode_record, iter_captures, list_segments
+
+BODY = b'{"event": "call_analyzed", "call": {"call_id": "call_cap"}}'
+
+
+def make_segment(directory, pid, age):
+    """An idle segment written ``age`` seconds ago by ``pid``."""
+    path = os.path.join(directory, f'{time.time_ns() - int(age * 1e9):020d}-{pid}.seg')
+    open(path, 'wb').close()
+    open(path[:-4] + '.idx', 'wb').close()
+    os.utime(path, (time.time() - age, time.time() - age))
+    return path
+
+
+def dead_pid():
+    proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+    proc.wait()
+    return proc.pid
+
+
+def test_prune_spares_segments_other_writers_have_open(tmp_path):
+    directory = str(tmp_path)
+    gone = dead_pid()
+    stale = [make_segment(directory, gone, 3600 - i) for i in range(3)]
+    # Another live worker's newest segment, idle for an hour: still open
+    other = make_segment(directory, os.getppid(), 3000)
+    # A segment from another host (its pid means nothing here), written to a moment ago
+    remote = make_segment(directory, gone, 1)
+
+    writer = CaptureWriter(directory, max_segments=2, active_seconds=60)
+    writer.append('/api/braconier', {}, BODY)
+    writer.close()
+
+    left = list_segments(directory)
+    assert not any(p in left for p in stale)
+    assert other in left and remote in left
+    assert len(left) == 3  # over the limit by the segments still in use
+
+
+def test_prune_drops_a_live_writers_older_segments(tmp_path):
+    directory = str(tmp_path)
+    older = [make_segment(directory, os.getppid(), 3600 - i) for i in range(3)]
+    writer = CaptureWriter(directory, max_segments=2, active_seconds=60)
+    writer.append('/api/braconier', {}, BODY)
+    writer.close()
+    left = list_segments(directory)
+    assert older[:2] == [p for p in older if p not in left]
+    assert older[2] in left and len(left) == 2
+
+
+def test_signature_and_credentials_are_not_captured(tmp_path, monkeypatch):
+    headers = {'Content-Type': 'application/json', 'X-Retell-Signature': 'v=1,d=ab', 'Authorization': 'Bearer x'}
+    _, meta = encode_record('/api/braconier', headers, BODY)
+    assert meta['headers'] == {'Content-Type': 'application/json'}
+    assert meta['call_id'] == 'call_cap'
+
+    writer = CaptureWriter(str(tmp_path))
+    writer.append('/api/braconier', headers, BODY)
+    writer.close()
+    [(_, meta, body)] = iter_captures([str(tmp_path)])
+    assert body == BODY and 'X-Retell-Signature' not in meta['headers']
+    assert capture.segment_pid(list_segments(str(tmp_path))[0]) == os.getpid()
@@ -0,0 +1,67 @@
+import pytest
+
+from api._lib.classifier import CLIENT_TYPES, KEYWORDS, Classifier, classify_emergency, infer_emergency_type, tokenize
+
+
+def naive_scores(types, text):
+    """Every phrase counted at every token position: what the automaton must reproduce."""
+    tokens = tokenize(text)
+    totals = {}
+    for label in types:
+        for phrase, weight in KEYWORDS[label]:
+            needle = tokenize(phrase)
+            for i in range(len(tokens) - len(needle) + 1):
+                if tokens[i:i + len(needle)] == needle:
+                    totals[label] = totals.get(label, 0) + weight
+    return totals
+
+
+OVERLAPPING = [
+    'burst pipe in the basement',                  # 'burst pipe' and its suffix 'pipe'
+    'no hot water heater',                         # 'no hot water' overlaps 'water heater'
+    'hot water tank and no hot water tank',        # shared 'hot water' prefix, two phrases
+    'fire sprinkler head leaking',                 # 'fire sprinkler', 'sprinkler', 'sprinkler head'
+    'false alarm panel beeping',                   # 'false alarm', 'alarm', 'alarm panel', 'panel'
+    'fire fire alarm panel',                       # a partial match that fails back into a new one
+    'smoke smoke detector detector',
+    'dry pipe wet pipe fire pump fire line',
+    'AC not cooling, blowing warm air, heat pump and mini split',
+    'sump pump backed up, sewer backed up into the sink',
+]
+
+
+@pytest.mark.parametrize('client', sorted(CLIENT_TYPES))
+@pytest.mark.parametrize('text', OVERLAPPING)
+def test_overlapping_phrases_all_count(client, text):
+    types = CLIENT_TYPES[client]
+    assert Classifier(types).scores(text) == naive_scores(types, text)
+
+
+def test_suffix_outputs_are_inherited():
+    pacific = Classifier(CLIENT_TYPES['pacific'])
+    # fire sprinkler 3 + sprinkler 3 + sprinkler head 3
+    assert pacific.scores('fire sprinkler head') == {'Sprinkler': 9}
+    # false alarm 3 + alarm 1 + alarm panel 3 + panel 1
+    assert pacific.scores('false alarm panel') == {'Fire Alarm': 8}
+
+
+def test_tokens_not_substrings():
+    assert tokenize('The A/C quit, back door, contacts') == ['the', 'ac', 'quit', 'back', 'door', 'contact']
+    assert classify_emergency('adaptive', 'Please call back about the contact place') == ('', 0.0)
+    assert classify_emergency('adaptive', 'A/C is broken') == ('HVAC', 0.5)
+    # Plurals fold onto the keyword, 'ss' endings are left alone
+    assert Classifier(('Plumbing',)).scores('two toilets') == {'Plumbing': 2}
+    assert tokenize('glass') == ['glass']
+
+
+def test_scores_sum_across_texts():
+    braconier = Classifier(CLIENT_TYPES['braconier'])
+    assert braconier.scores('furnace', 'furnace') == {'HVAC': 6}
+
+
+def test_ties_go_to_the_first_type_and_weak_matches_are_dropped():
+    # duct 1 vs leak 2; boiler 2 vs leak 2 is a tie, so HVAC (listed first) wins at low confidence
+    assert classify_emergency('braconier', 'duct leak') == ('Plumbing', 0.33)
+    assert classify_emergency('braconier', 'boiler leak') == ('HVAC', 0.25)
+    assert infer_emergency_type('braconier', 'boiler leak') == ''
+    assert infer_emergency_type('pacific', 'sprinkler head burst pipe') == 'Sprinkler'
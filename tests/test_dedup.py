@@ -0,0 +1,143 @@
+import io
+import time
+import uuid
+
+import pytest
+
+from api._lib import codec
+from api._lib.dedup import (
+    Deduper, FileBackend, RedisBackend, RedisError, content_hash, encode_command, read_reply, start_stand_in,
+)
+
+CALL = {
+    'call_id': 'call_hash_1',
+    'start_timestamp': 1760000000000,
+    'call_analysis': {'custom_analysis_data': {'customerName': 'Zoë', 'isitEmergency': True}},
+    'collected_dynamic_variables': {'fromNumber': '+16045550100'},
+}
+
+
+def test_content_hash_is_stable_across_codec_backends():
+    # Instances running with and without orjson must agree on claims; run under JSON_CODEC=stdlib too
+    assert codec.BACKEND in ('orjson', 'stdlib')
+    assert content_hash(CALL) == 'e8a4ec1c308648782d70d04fdede7c90'
+
+
+def test_resp_encoding_and_replies():
+    assert encode_command('SET', b'k', 1500) == b'*3\r\n$3\r\nSET\r\n$1\r\nk\r\n$4\r\n1500\r\n'
+    stream = io.BytesIO(b'+OK\r\n-ERR nope\r\n:7\r\n$3\r\na\r\n\r\n$-1\r\n*2\r\n$1\r\n0\r\n*1\r\n$1\r\nk\r\n')
+    assert read_reply(stream) == 'OK'
+    error = read_reply(stream)
+    assert isinstance(error, RedisError) and str(error) == 'ERR nope'
+    assert read_reply(stream) == 7
+    assert read_reply(stream) == b'a\r\n'  # bulk strings are length-prefixed, not line-based
+    assert read_reply(stream) is None
+    assert read_reply(stream) == [b'0', [b'k']]
+
+
+def test_truncated_reply_is_a_connection_error():
+    with pytest.raises(ConnectionError):
+        read_reply(io.BytesIO(b'$5\r\nab'))
+    with pytest.raises(ConnectionError):
+        read_reply(io.BytesIO(b''))
+
+
+@pytest.fixture(scope='module')
+def store_url():
+    return start_stand_in()
+
+
+def backend(url, **kwargs):
+    return RedisBackend(url, f'test-{uuid.uuid4().hex[:8]}', **kwargs)
+
+
+def record(call_id):
+    return {'call_id': call_id, 'timestamp': int(time.time() * 1000), 'claim': uuid.uuid4().hex}
+
+
+def test_set_nx_claims_once(store_url):
+    store = backend(store_url)
+    first, second = record('call_a'), record('call_a')
+    assert store.claim_many([('h1', first)]) == [True]
+    assert store.claim_many([('h1', second)]) == [False]
+    # A retried pipeline that already went through recognises its own value
+    assert store.claim_many([('h1', first)]) == [True]
+    assert store.claim_many([('h2', record('call_b')), ('h1', second)]) == [True, False]
+    assert store.call_ids() == {'call_a', 'call_b'}
+
+
+def test_claims_expire_after_the_ttl(store_url):
+    store = backend(store_url, ttl=0.05)
+    assert store.claim_many([('h', record('call_a'))]) == [True]
+    time.sleep(0.1)
+    assert store.claim_many([('h', record('call_a'))]) == [True]
+
+
+def test_release_only_deletes_our_own_claim(store_url):
+    store = backend(store_url)
+    ours, theirs = record('call_a'), record('call_a')
+    assert store.claim_many([('h', ours)]) == [True]
+    assert store.release('h', theirs) is False
+    assert store.claim_many([('h', theirs)]) == [False]
+    assert store.release('h', ours) is True
+    assert store.release('h', ours) is False
+    assert store.claim_many([('h', theirs)]) == [True]
+
+
+def test_file_backend_release(tmp_path):
+    store = FileBackend(str(tmp_path / 'claims.json'))
+    ours, theirs = record('call_a'), record('call_a')
+    assert store.claim_many([('h', ours)]) == [True]
+    assert store.release('h', theirs) is False
+    assert store.release('h', ours) is True
+    assert store.claim_many([('h', theirs)]) == [True]
+
+
+def test_released_call_is_processed_again(store_url):
+    call = dict(CALL, start_timestamp=int(time.time() * 1000))
+    here = Deduper(backend(store_url))
+    there = Deduper(here.backend)  # another process on the same store
+    assert here.is_duplicate(call) is False
+    assert there.is_duplicate(call) is True
+    assert here.is_duplicate(call) is True  # in flight: answered from the front cache
+    assert here.release(call) is True
+    assert there.is_duplicate(call) is False
+    assert here.release(call) is False  # no longer ours
+
+
+def test_unreachable_store_falls_back_to_the_file(tmp_path):
+    # Nothing listens on port 1; connecting fails at once
+    dedup = Deduper(RedisBackend('redis://127.0.0.1:1/0', 'test', timeout=0.2),
+                    fallback=FileBackend(str(tmp_path / 'claims.json')), cache_size=0)
+    call = dict(CALL, start_timestamp=int(time.time() * 1000))
+    assert dedup.is_duplicate(call) is False
+    assert dedup.is_duplicate(call) is True
+    assert dedup.call_ids() == {'call_hash_1'}
+
+
+def test_claim_is_released_when_the_sheet_write_fails(monkeypatch, tmp_path):
+    from api import braconier
+    from tests.test_reconcile import FakeResponse, analyzed_call, deliver
+
+    sink_url = 'https://script.google.com/macros/s/braconier/exec'
+    monkeypatch.setenv('BRACONIER_EXEC_URL', sink_url)
+    monkeypatch.setattr(braconier, 'DEDUP', Deduper(FileBackend(str(tmp_path / 'claims.json'))))
+    writes = []
+
+    def open_url(req, *args, **kwargs):
+        if getattr(req, 'full_url', req) == sink_url:
+            writes.append(req)
+            if len(writes) == 1:
+                raise TimeoutError('sheet write timed out')
+        return FakeResponse()
+
+    monkeypatch.setattr(braconier, 'open_url', open_url)
+    call = analyzed_call('call_retry')
+
+    deliver(braconier, call)
+    assert braconier.DEDUP.call_ids() == set()
+    deliver(braconier, call)  # Retell's retry
+    assert len(writes) == 2
+    assert braconier.DEDUP.call_ids() == {'call_retry'}
+    deliver(braconier, call)  # a true duplicate after success
+    assert len(writes) == 2
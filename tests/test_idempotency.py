@@ -0,0 +1,75 @@
+import pytest
+
+from api import webhook
+from api._lib.idempotency import IDEMPOTENCY_FIELD, IDEMPOTENCY_HEADER, idempotency_key
+from api._lib.pipelines import PIPELINES
+from api._lib.records import ExtractedVars, TechContact
+from api._lib.tenants import router_clients
+
+
+class FakeResponse:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def read(self):
+        return b'{"status": "success"}'
+
+
+SINK_URL = 'https://script.google.com/macros/s/test/exec'
+
+
+def capture_writes(monkeypatch, module):
+    """Replace ``module.open_url`` and return the sheet writes it receives."""
+    sent = []
+
+    def open_url(req, *args, **kwargs):
+        # EliteFire also asks its assignments API for the tech inside the send
+        if getattr(req, 'full_url', req) == SINK_URL:
+            sent.append(req)
+        return FakeResponse()
+
+    monkeypatch.setattr(module, 'open_url', open_url)
+    return sent
+
+
+def sent_key(req):
+    key = req.get_header(IDEMPOTENCY_HEADER.capitalize())
+    assert webhook.loads(req.data)[IDEMPOTENCY_FIELD] == key
+    return key
+
+
+@pytest.mark.parametrize('client', sorted(t.key for t in router_clients() if t.key in PIPELINES))
+def test_router_and_backfill_write_the_same_key(monkeypatch, client):
+    pipeline = PIPELINES[client]
+    monkeypatch.setenv(pipeline.sink_env, SINK_URL)
+    call = {'call_id': 'call_parity_1', 'agent_name': 'Agent', 'call_analysis': {'call_summary': 'No heat'}}
+    extracted = ExtractedVars(fromNumber='+16045550100', customerName='Dana Ruiz')
+
+    routed = capture_writes(monkeypatch, webhook)
+    assert webhook.send_to_sheets(client, call, extracted, TechContact())
+
+    backfilled = capture_writes(monkeypatch, pipeline.module)
+    assert pipeline.send(call, pipeline.extract(call), TechContact())
+
+    assert len(routed) == 1 and len(backfilled) == 1
+    assert sent_key(routed[0]) == sent_key(backfilled[0])
+
+
+@pytest.mark.parametrize('client', sorted(t.key for t in router_clients() if t.key in PIPELINES))
+def test_rows_without_a_call_id_carry_no_key(monkeypatch, client):
+    assert idempotency_key('', 'any-version') is None
+    pipeline = PIPELINES[client]
+    monkeypatch.setenv(pipeline.sink_env, SINK_URL)
+    call = {'agent_name': 'Agent', 'call_analysis': {'call_summary': 'No call_id'}}
+
+    routed = capture_writes(monkeypatch, webhook)
+    assert webhook.send_to_sheets(client, call, ExtractedVars(), TechContact())
+    backfilled = capture_writes(monkeypatch, pipeline.module)
+    assert pipeline.send(call, pipeline.extract(call), TechContact())
+
+    for req in routed + backfilled:
+        assert req.get_header(IDEMPOTENCY_HEADER.capitalize()) is None
+        assert IDEMPOTENCY_FIELD not in webhook.loads(req.data)
@@ -0,0 +1,43 @@
+import time
+
+import pytest
+
+from api._lib import oncall_snapshot
+from api._lib.filestate import write_json_atomic
+from api._lib.records import TechContact
+
+API_URL = 'https://fetchoncall.vercel.app/api/assignments?service=fire-alarm'
+
+
+@pytest.fixture
+def snapshot_file(tmp_path, monkeypatch):
+    path = str(tmp_path / 'oncall_snapshot.json')
+    monkeypatch.setattr(oncall_snapshot, 'SNAPSHOT_FILE', path)
+    monkeypatch.setattr(oncall_snapshot, '_snapshots', None)
+    monkeypatch.setattr(oncall_snapshot, '_file_version', None)
+    return path
+
+
+def test_sees_snapshots_written_by_another_worker(snapshot_file):
+    # This worker has read the (empty) snapshot state already
+    assert oncall_snapshot.snapshot_tech(API_URL) is None
+
+    # A sibling worker looked the tech up and persisted it
+    tech = {'name': 'Sam Lee', 'email': 'sam@example.com', 'phone': '+16045550199'}
+    write_json_atomic(snapshot_file, {API_URL: {'tech': tech, 'saved_at': time.time()}})
+
+    found = oncall_snapshot.snapshot_tech(API_URL)
+    assert isinstance(found, TechContact)
+    assert (found.name, found.email, found.stale) == ('Sam Lee', 'sam@example.com', True)
+
+
+def test_reload_keeps_unpersisted_entries(snapshot_file, monkeypatch):
+    other_url = API_URL.replace('fire-alarm', 'sprinkler')
+    monkeypatch.setattr(oncall_snapshot, 'SNAPSHOT_FILE', snapshot_file + '.missing/oncall.json')
+    oncall_snapshot.remember_tech(API_URL, TechContact('Ana', 'ana@example.com', ''))  # cannot persist
+    monkeypatch.setattr(oncall_snapshot, 'SNAPSHOT_FILE', snapshot_file)
+    write_json_atomic(snapshot_file, {other_url: {'tech': {'name': 'Bo', 'email': 'bo@example.com', 'phone': ''},
+                                                  'saved_at': time.time()}})
+
+    assert oncall_snapshot.snapshot_tech(API_URL).email == 'ana@example.com'
+    assert oncall_snapshot.snapshot_tech(other_url).email == 'bo@example.com'
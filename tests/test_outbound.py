@@ -0,0 +1,80 @@
+import threading
+import time
+
+import pytest
+
+from api._lib import outbound
+from api._lib.deadline import MIN_TIMEOUT_SECONDS, Deadline
+from api._lib.outbound import LimitExceeded, Limiter, destination, open_url
+
+SINK_URL = 'https://script.google.com/macros/s/limits/exec'
+
+
+class FakeResponse:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def read(self):
+        return b'ok'
+
+
+@pytest.fixture
+def sink(monkeypatch):
+    """A one-slot limiter for SINK_URL; returns the socket timeouts urlopen was given."""
+    limiter = Limiter(destination(SINK_URL), concurrency=1, max_wait=10)
+    monkeypatch.setitem(outbound._limiters, destination(SINK_URL), limiter)
+    timeouts = []
+
+    def urlopen(req, timeout=None, **kwargs):
+        timeouts.append(timeout)
+        return FakeResponse()
+
+    monkeypatch.setattr(outbound.urllib.request, 'urlopen', urlopen)
+    return limiter, timeouts
+
+
+def hold_slot(limiter, seconds):
+    """Occupy the limiter's only slot from another thread for ``seconds``."""
+    held = threading.Event()
+
+    def run():
+        with limiter.slot():
+            held.set()
+            time.sleep(seconds)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    held.wait()
+    return thread
+
+
+def test_spent_budget_still_queues_for_a_slot(sink):
+    limiter, timeouts = sink
+    deadline = Deadline(budget=0)
+    thread = hold_slot(limiter, 0.2)
+    try:
+        with open_url(SINK_URL, timeout=10, deadline=deadline) as response:
+            assert response.read() == b'ok'
+    finally:
+        thread.join()
+    assert timeouts == [MIN_TIMEOUT_SECONDS]
+    assert limiter.stats['queued'] == 1
+    assert limiter.stats['rejected'] == 0
+
+
+def test_spent_budget_gives_up_after_the_floor(sink):
+    limiter, timeouts = sink
+    thread = hold_slot(limiter, MIN_TIMEOUT_SECONDS + 0.5)
+    started = time.monotonic()
+    try:
+        with pytest.raises(LimitExceeded):
+            with open_url(SINK_URL, timeout=10, deadline=Deadline(budget=0)):
+                pass
+        waited = time.monotonic() - started
+    finally:
+        thread.join()
+    assert MIN_TIMEOUT_SECONDS <= waited < MIN_TIMEOUT_SECONDS + 0.5
+    assert timeouts == []
@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+from api import braconier
+from api._lib import profiling
+from api._lib.codec import dumps, loads
+from api._lib.server import run_handler
+
+
+@pytest.fixture
+def profile_everything(tmp_path, monkeypatch):
+    monkeypatch.setenv('PROFILE_REQUESTS', '1')
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+    return tmp_path
+
+
+def post(body, content_length=None):
+    length = len(body) if content_length is None else content_length
+    raw = (f'POST /api/braconier HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+           f'Content-Length: {length}\r\n\r\n').encode() + body
+    head, _, payload = run_handler(braconier.handler, raw, ('127.0.0.1', 0)).partition(b'\r\n\r\n')
+    return int(head.split()[1]), loads(payload)
+
+
+def test_oversized_body_is_refused_without_reading_it(profile_everything):
+    # Would be a terabyte allocation if the profiler read the declared body
+    status, response = post(b'{}', content_length=10 ** 12)
+    assert status == 413
+    assert response['error'] == 'Request body too large'
+    assert os.listdir(profile_everything) == []
+
+
+def test_artifact_is_tagged_with_the_call_id_the_handler_read(profile_everything):
+    body = dumps({'event': 'call_started', 'call': {'call_id': 'call_prof_1', 'transcript': 'x' * 200000}})
+    status, response = post(body)
+    assert (status, response['status']) == (200, 'ignored')
+    assert response['call_id'] == 'call_prof_1'
+    names = sorted(os.listdir(profile_everything))
+    assert len(names) == 2
+    assert all('-braconier-call_prof_1.' in name for name in names)
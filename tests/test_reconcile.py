@@ -0,0 +1,121 @@
+import time
+
+from api._lib import reconcile
+from api._lib.codec import dumps
+from api._lib.dedup import Deduper, FileBackend
+from api._lib.pipelines import get_pipeline
+from api._lib.ratelimit import TokenBucket
+from api._lib.server import run_handler
+
+RECORDING_URL = 'https://dxc03zgurdly9.cloudfront.net/call_ef1/recording.wav'
+
+
+def full_call(call_id):
+    """A get-call answer carrying fields only some pipelines read."""
+    return {
+        'call_id': call_id,
+        'call_status': 'ended',
+        'agent_name': 'EliteFire Agent',
+        'duration_ms': 61000,
+        'recording_url': RECORDING_URL,
+        'call_cost': {'combined_cost': 42, 'product_costs': [{'product': 'tts', 'cost': 10}]},
+        'transcript_object': [{'role': 'agent', 'content': 'Hello', 'words': []}],
+        'collected_dynamic_variables': {'customerName': 'Dana Ruiz', 'fromNumber': '+16045550100'},
+        'call_analysis': {'call_summary': 'Sprinkler head leaking'},
+    }
+
+
+def test_elitefire_keeps_recording_url_after_reconcile(monkeypatch):
+    fetched = []
+
+    def get_call(api_key, call_id, timeout=15):
+        fetched.append(call_id)
+        return full_call(call_id)
+
+    monkeypatch.setattr(reconcile, 'get_call', get_call)
+    listed = [
+        {'call_id': 'call_ef1', 'call_status': 'ended'},  # list entry without analysis: re-fetched
+        {'call_id': 'call_done', 'call_status': 'ended'},
+    ]
+
+    missing = reconcile.find_missing(listed, {'call_done'}, 'key', TokenBucket(1000))
+
+    assert fetched == ['call_ef1']
+    assert [c['call_id'] for c in missing] == ['call_ef1']
+    pipeline = get_pipeline('elitefire')
+    call = pipeline.project(missing[0])
+    assert call['recording_url'] == RECORDING_URL
+    assert call['call_cost'] == {'combined_cost': 42}
+    assert pipeline.extract(call)['recording_url'] == RECORDING_URL
+
+
+class FakeResponse:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def read(self):
+        return b'{"status": "ok"}'
+
+
+def analyzed_call(call_id):
+    return {
+        'call_id': call_id,
+        'call_status': 'ended',
+        'start_timestamp': int(time.time() * 1000),
+        'collected_dynamic_variables': {
+            'fromNumber': '+16045550100', 'customerName': 'Dana Ruiz', 'isitEmergency': 'no',
+        },
+        'call_analysis': {'call_summary': 'Boiler check'},
+    }
+
+
+def deliver(handler_module, call, path='/api/braconier'):
+    body = dumps({'event': 'call_analyzed', 'call': call})
+    raw = (f'POST {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+           f'Content-Length: {len(body)}\r\n\r\n').encode() + body
+    return run_handler(handler_module.handler, raw, ('127.0.0.1', 0))
+
+
+def test_claimed_call_whose_write_failed_is_missing(monkeypatch, tmp_path):
+    from api import braconier
+
+    sink_url = 'https://script.google.com/macros/s/braconier/exec'
+    monkeypatch.setenv('BRACONIER_EXEC_URL', sink_url)
+    monkeypatch.setattr(braconier, 'DEDUP', Deduper(FileBackend(str(tmp_path / 'claims.json'))))
+    sink_up = [False]
+
+    def open_url(req, *args, **kwargs):
+        if getattr(req, 'full_url', req) == sink_url and not sink_up[0]:
+            raise TimeoutError('sheet write timed out')
+        return FakeResponse()
+
+    monkeypatch.setattr(braconier, 'open_url', open_url)
+
+    deliver(braconier, analyzed_call('call_failed'))
+    # An instance that died after claiming: the claim is never released
+    assert not braconier.DEDUP.is_duplicate(analyzed_call('call_crashed'))
+    sink_up[0] = True
+    deliver(braconier, analyzed_call('call_written'))
+
+    assert braconier.DEDUP.call_ids() == {'call_crashed', 'call_written'}
+    processed = reconcile.processed_call_ids('braconier')
+    assert processed == {'call_written'}
+
+    listed = [analyzed_call(c) for c in ('call_failed', 'call_crashed', 'call_written')]
+    missing = reconcile.find_missing(listed, processed, 'key', TokenBucket(1000))
+    assert [c['call_id'] for c in missing] == ['call_failed', 'call_crashed']
+
+
+def test_router_writes_count_as_processed(monkeypatch):
+    from api import webhook
+
+    sink_url = 'https://script.google.com/macros/s/braconier/exec'
+    monkeypatch.setenv('BRACONIER_EXEC_URL', sink_url)
+    monkeypatch.setattr(webhook, 'open_url', lambda req, *args, **kwargs: FakeResponse())
+
+    deliver(webhook, analyzed_call('call_routed'), path='/api/webhook?client=braconier')
+
+    assert reconcile.processed_call_ids('braconier') == {'call_routed'}
@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+from api._lib import records
+from api._lib.idempotency import IDEMPOTENCY_FIELD
+from api._lib.records import ExtractedVars, ServiceSheetRow, TechContact, TripSheetRow
+
+MISSING = object()
+
+
+def samples():
+    return [
+        TechContact('Dana', 'dana@example.com', '+16045550100'),
+        TechContact('Dana', 'dana@example.com', '', stale=True, snapshot_at='2026-10-19T08:00:00'),
+        TechContact('Dana', None, '', stale=False),  # a None regular field and a falsy optional one
+        ExtractedVars(customerName='Zoë "Z" 100%', isitEmergency=True, emergencyType=None),
+        ServiceSheetRow(call_id='call_1', duration_ms=61000, transcript='Agent: hi\nUser: héllo ☃'),
+        ServiceSheetRow(call_id='', note={'nested': [1, 2.5, None]}, **{IDEMPOTENCY_FIELD: 'k' * 32}),
+        TripSheetRow(call_cost=1.25, firstName='%s %d', tripdetails='\x00\x1f'),
+    ]
+
+
+@pytest.mark.parametrize('record', samples(), ids=repr)
+def test_reads_like_its_dict(record):
+    d = record.to_dict()
+    names = list(record.ALL_FIELDS) + ['unknown', '']
+    for name in names:
+        assert record.get(name) == d.get(name)
+        assert record.get(name, MISSING) == d.get(name, MISSING)
+        assert (name in record) == (name in d)
+        if name in d:
+            assert record[name] == d[name]
+        else:
+            with pytest.raises(KeyError):
+                record[name]
+    assert record.keys() == list(d.keys())
+    assert record.values() == list(d.values())
+    assert record.items() == list(d.items())
+    assert list(record) == list(d) and len(record) == len(d)
+    assert record == d and dict(record.items()) == d
+    assert repr(record) == repr(d)
+    assert record.copy() == record and record.copy() is not record
+
+
+def test_optional_none_is_absent():
+    tech = TechContact('Dana', 'dana@example.com', '')
+    assert tech.get('stale') is None
+    assert tech.get('stale', 'fresh') == 'fresh'
+    assert 'stale' not in tech and 'stale' not in tech.keys()
+    with pytest.raises(KeyError):
+        tech['stale']
+    tech['stale'] = False
+    assert tech.get('stale', 'fresh') is False and tech['stale'] is False and 'stale' in tech
+    # A regular field holding None is present, like a dict value of None
+    vars_ = ExtractedVars(email=None)
+    assert vars_.get('email', 'x') is None and 'email' in vars_ and vars_['email'] is None
+
+
+def test_rows_put_the_key_last_only_when_set():
+    row = ServiceSheetRow(call_id='call_1')
+    assert row.keys()[-1] == 'note' and row.get(IDEMPOTENCY_FIELD) is None
+    row[IDEMPOTENCY_FIELD] = 'abc'
+    assert row.keys()[-1] == IDEMPOTENCY_FIELD
+    assert row.to_row() == [getattr(row, name) for name in ServiceSheetRow.FIELDS]
+
+
+@pytest.mark.parametrize('record', samples(), ids=repr)
+def test_stdlib_json_is_byte_identical(record, monkeypatch):
+    monkeypatch.setattr(records, 'BACKEND', 'stdlib')
+    assert record.to_json() == json.dumps(record.to_dict()).encode()
+
+
+def test_unknown_fields_are_rejected_or_ignored():
+    with pytest.raises(TypeError):
+        TechContact(nickname='D')
+    with pytest.raises(TypeError):
+        TechContact('a', 'b', 'c', 'd')
+    with pytest.raises(KeyError):
+        TechContact()['nickname'] = 'D'
+    tech = TechContact.from_mapping({'name': 'Dana', 'nickname': 'D'}, phone='1')
+    assert tech.to_dict() == {'name': 'Dana', 'email': '', 'phone': '1'}
@@ -0,0 +1,87 @@
+import time
+
+from api import webhook
+from api._lib import signature
+from api._lib.codec import dumps, loads
+from api._lib.server import run_handler
+
+SECRET = 'whsec_test'
+SINK_URL = 'https://script.google.com/macros/s/router/exec'
+
+
+class FakeResponse:
+    def __init__(self, body=b'{}'):
+        self.body = body
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def read(self):
+        return self.body
+
+
+def signed_request(body):
+    timestamp_ms = int(time.time() * 1000)
+    digest = signature.compute_digest(SECRET, body, timestamp_ms)
+    head = (
+        'POST /api/webhook?client=braconier HTTP/1.1\r\n'
+        'Host: localhost\r\n'
+        'Content-Type: application/json\r\n'
+        f'Content-Length: {len(body)}\r\n'
+        f'{signature.SIGNATURE_HEADER}: v={timestamp_ms},d={digest}\r\n'
+        '\r\n'
+    )
+    return head.encode('latin-1') + body
+
+
+def post(raw):
+    response = run_handler(webhook.handler, raw, ('127.0.0.1', 0))
+    head, _, body = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), loads(body)
+
+
+def test_retry_after_failed_write_is_processed(monkeypatch):
+    monkeypatch.setenv('RETELL_VERIFY_SIGNATURE', 'enforce')
+    monkeypatch.setenv('RETELL_WEBHOOK_SECRET', SECRET)
+    monkeypatch.setenv('BRACONIER_EXEC_URL', SINK_URL)
+    monkeypatch.setattr(signature, 'replay_cache', signature.ReplayCache())
+    writes = []
+    sink_up = [False]
+
+    def open_url(req, *args, **kwargs):
+        if getattr(req, 'full_url', req) != SINK_URL:
+            return FakeResponse()  # tech lookup: no assignment
+        writes.append(req)
+        if not sink_up[0]:
+            raise TimeoutError('sheet write timed out')
+        return FakeResponse(b'{"status": "ok"}')
+
+    monkeypatch.setattr(webhook, 'open_url', open_url)
+    body = dumps({'event': 'call_analyzed', 'call': {'call_id': 'call_retry_1', 'call_analysis': {}}})
+    raw = signed_request(body)
+
+    status, first = post(raw)
+    assert (status, first['status']) == (200, 'error')
+
+    # Retell retries the failed delivery with the same signed body
+    sink_up[0] = True
+    status, retry = post(raw)
+    assert (status, retry['status']) == (200, 'success')
+    assert len(writes) == 2
+
+    # Once handled, the same signature is a replay
+    status, replay = post(raw)
+    assert (status, replay['status']) == (200, 'skipped')
+    assert len(writes) == 2
+
+
+def test_forged_signature_is_rejected(monkeypatch):
+    monkeypatch.setenv('RETELL_VERIFY_SIGNATURE', 'enforce')
+    monkeypatch.setenv('RETELL_WEBHOOK_SECRET', SECRET)
+    raw = signed_request(b'{"event": "call_analyzed"}').replace(b'call_analyzed', b'call_analyzeD')
+    status, response = post(raw)
+    assert status == 401
+    assert response == {'error': 'Invalid signature'}
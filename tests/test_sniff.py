@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+from api._lib.server import run_handler
+from api._lib.sniff import sniff_call_id, sniff_event
+
+
+@pytest.mark.parametrize('raw, event', [
+    (b'{"event": "call_analyzed", "call": {}}', 'call_analyzed'),
+    (b'  \r\n{\n\t"event"\t:\n"call_ended"}', 'call_ended'),
+    # Escapes decode exactly as json.loads does
+    (b'{"event": "call_\\u0061nalyzed"}', 'call_analyzed'),
+    (b'{"\\u0065vent": "call_started"}', 'call_started'),
+    (b'{"event": "call_\\"analyzed\\""}', 'call_"analyzed"'),
+    (b'{"event": "call\\\\", "x": "call_analyzed"}', 'call\\'),
+    (b'{"event": "caf\xc3\xa9"}', 'caf\u00e9'),
+])
+def test_event_matches_a_full_parse(raw, event):
+    assert sniff_event(raw) == event == json.loads(raw)['event']
+
+
+@pytest.mark.parametrize('raw', [
+    # A nested "event" is not the top-level one
+    b'{"call": {"event": "call_analyzed"}, "event": "call_ended"}',
+    b'{"data": "{\\"event\\": \\"call_analyzed\\"}", "event": "call_started"}',
+    b'[{"event": "call_analyzed"}]',
+    # The key only looks like "event" up to an escaped quote
+    b'{"event\\"": "call_started", "event": "call_analyzed"}',
+    # Non-string values and damage fall back to a full parse
+    b'{"event": null}',
+    b'{"event": 7}',
+    b'{"event" "call_analyzed"}',
+    b'{"event": "call_analyzed',
+    b'{"event": "call_\\x"}',
+    b'',
+])
+def test_anything_else_falls_back(raw):
+    assert sniff_event(raw) is None
+
+
+def test_value_cut_by_the_limit_falls_back():
+    raw = b'{"event": "' + b'x' * 600 + b'"}'
+    assert sniff_event(raw) is None
+    assert sniff_event(raw, limit=len(raw)) == 'x' * 600
+
+
+def test_call_id_ignores_escaped_lookalikes():
+    raw = (b'{"event": "call_ended", "transcript": "agent: your \\"call_id\\": \\"call_fake\\" ok", '
+           b'"call": {"call_id": "call_real"}}')
+    assert sniff_call_id(raw) == 'call_real'
+    # An escaped quote inside the id is not a valid id
+    assert sniff_call_id(b'{"call": {"call_id": "call_\\"x"}}') == ''
+    assert sniff_call_id(b'{"call": {"call_id" :\n "call_abc-1"}}') == 'call_abc-1'
+    assert sniff_call_id(b'{"call": {"transcript": "' + b'a' * 5000 + b'", "call_id": "call_late"}}') == ''
+
+
+def post(module, raw_body, path):
+    raw = (f'POST {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+           f'Content-Length: {len(raw_body)}\r\n\r\n').encode() + raw_body
+    response = run_handler(module.handler, raw, ('127.0.0.1', 0))
+    return json.loads(response.split(b'\r\n\r\n', 1)[1])
+
+
+def test_nested_event_does_not_trigger_processing(monkeypatch):
+    from api import braconier
+    writes = []
+    monkeypatch.setattr(braconier, 'open_url', lambda req, *a, **k: writes.append(req))
+    body = post(braconier, b'{"call": {"call_id": "call_n1", "event": "call_analyzed"}, "event": "call_ended"}',
+                '/api/braconier')
+    assert writes == []
+    assert body == {'status': 'ignored', 'call_id': 'call_n1'}
+
+
+def test_escaped_event_is_not_call_analyzed(monkeypatch):
+    from api import braconier
+    writes = []
+    monkeypatch.setattr(braconier, 'open_url', lambda req, *a, **k: writes.append(req))
+    body = post(braconier, b'{"event": "call_\\"analyzed", "call": {"call_id": "call_n2"}}', '/api/braconier')
+    assert writes == []
+    assert body == {'status': 'ignored', 'call_id': 'call_n2'}